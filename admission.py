@@ -0,0 +1,159 @@
+import math
+import os
+import threading
+import time
+
+import metrics
+
+CLASSES = ('critical', 'normal', 'low')
+
+# Requests one gunicorn worker runs at once; gunicorn.conf.py gives it threads_needed() threads, so
+# requests waiting for a slot never take the threads critical requests need.
+AI_THREADS = int(os.getenv('AI_THREADS', 4))
+# Requests one process serves at once. asgi.py uses AI_BRIDGE_THREADS unless this is set.
+ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', AI_THREADS))
+# Share of the capacity only critical requests may use, and the most low-priority requests may take.
+ADMISSION_RESERVED = float(os.getenv('ADMISSION_RESERVED', 0.25))
+ADMISSION_LOW_SHARE = float(os.getenv('ADMISSION_LOW_SHARE', 0.25))
+# Waiting requests allowed per class, and how long each class may wait for a slot, in seconds.
+ADMISSION_QUEUE = os.getenv('ADMISSION_QUEUE', 'critical=64,normal=32,low=4')
+ADMISSION_WAIT = os.getenv('ADMISSION_WAIT', 'critical=10,normal=2,low=0.2')
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
+# Route rule prefixes by class; anything else is normal.
+ROUTE_CLASSES = (
+    ('/health', 'critical'),
+    ('/metrics', 'critical'),
+    ('/api/ai/dispatch/', 'critical'),
+    ('/api/ai/analyze/batch', 'low'),
+    ('/api/ai/heatmap/', 'low'),
+    ('/api/ai/crowds', 'low'),
+    ('/api/ai/history/', 'low'),
+    ('/api/ai/admin/', 'low'),
+    ('/api/ai/facilities/reload', 'low'),
+)
+
+
+def parse_classes(spec, cast=float):
+    """``'critical=64,normal=32'`` -> ``{'critical': 64, 'normal': 32}``."""
+    values = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        if name not in CLASSES:
+            raise ValueError(f'Unknown priority class {name!r}; expected one of {CLASSES}')
+        values[name] = cast(value)
+    return values
+
+
+def route_class(rule):
+    for prefix, cls in ROUTE_CLASSES:
+        if rule.startswith(prefix):
+            return cls
+    return 'normal'
+
+
+class Overloaded(Exception):
+    def __init__(self, cls, retry_after):
+        super().__init__(f'{cls} capacity exhausted')
+        self.cls = cls
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Per-class concurrency limits with bounded, priority-ordered waiting.
+
+    All classes share ``capacity`` slots. Normal and low requests together
+    never hold more than ``capacity - reserved``, so critical requests (SOS
+    dispatch, /health) always find room; low requests are further held to
+    ``low_share`` of the capacity. A request that cannot start waits in its
+    class's queue, and a freed slot goes to the highest class waiting. A full
+    queue or an expired wait raises ``Overloaded`` right away so callers can
+    shed with 429.
+    """
+
+    def __init__(self, capacity=ADMISSION_CAPACITY, reserved=ADMISSION_RESERVED, low_share=ADMISSION_LOW_SHARE,
+                 queue=ADMISSION_QUEUE, wait=ADMISSION_WAIT, retry_after=ADMISSION_RETRY_AFTER):
+        self.capacity = max(capacity, 1)
+        # A single-slot process has nothing to reserve.
+        self.shared = self.capacity - (math.ceil(self.capacity * reserved) if self.capacity > 1 else 0)
+        self.limits = {
+            'critical': self.capacity,
+            'normal': self.shared,
+            'low': max(1, min(self.shared, math.floor(self.capacity * low_share))),
+        }
+        self.queue = {cls: 0 for cls in CLASSES}
+        self.queue.update(parse_classes(queue, int) if isinstance(queue, str) else queue)
+        self.wait = {cls: 0.0 for cls in CLASSES}
+        self.wait.update(parse_classes(wait) if isinstance(wait, str) else wait)
+        self.retry_after = retry_after
+        self.active = {cls: 0 for cls in CLASSES}
+        self.waiting = {cls: 0 for cls in CLASSES}
+        self.rejected = {cls: 0 for cls in CLASSES}
+        self._cond = threading.Condition()
+
+    def threads_needed(self):
+        """Request threads that leave critical requests a thread while every other slot and queue is full.
+
+        Normal and low requests block a thread for each shared slot and each place in their
+        queues; the reserved slots need one thread each on top.
+        """
+        return self.capacity + self.queue['normal'] + self.queue['low']
+
+    def _fits(self, cls):
+        if self.active[cls] >= self.limits[cls]:
+            return False
+        total = sum(self.active.values())
+        if cls == 'critical':
+            return total < self.capacity
+        return total - self.active['critical'] < self.shared and total < self.capacity
+
+    def _may_start(self, cls):
+        # Higher classes that are waiting and could start now go first.
+        for higher in CLASSES[:CLASSES.index(cls)]:
+            if self.waiting[higher] and self._fits(higher):
+                return False
+        return self._fits(cls)
+
+    def acquire(self, cls):
+        """Take a slot for ``cls``, waiting up to its limit; raises ``Overloaded`` when shed."""
+        with self._cond:
+            if self._may_start(cls):
+                self.active[cls] += 1
+                return 0.0
+            if self.waiting[cls] >= self.queue[cls]:
+                self._reject(cls)
+            started = time.monotonic()
+            deadline = started + self.wait[cls]
+            self.waiting[cls] += 1
+            try:
+                while not self._may_start(cls):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(cls)
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting[cls] -= 1
+            self.active[cls] += 1
+            # Another class may have become admissible while this one waited.
+            self._cond.notify_all()
+            return time.monotonic() - started
+
+    def _reject(self, cls):
+        self.rejected[cls] += 1
+        metrics.ADMISSION_REJECTED.inc(1, cls)
+        raise Overloaded(cls, self.retry_after)
+
+    def release(self, cls):
+        with self._cond:
+            self.active[cls] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'limits': dict(self.limits),
+                'active': dict(self.active),
+                'waiting': dict(self.waiting),
+                'rejected': dict(self.rejected),
+            }
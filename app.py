@@ -1,30 +1,505 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
+import numpy as np
+import atexit
+import hmac
+import logging
+import math
 import os
+import threading
+import time
+
+from admission import AdmissionController, Overloaded, route_class
+from cache import CachedZoneLookup
+from crowd import CrowdMonitor
+from dispatch import DispatchEngine, position
+from facilities import FacilityIndex, read_facilities
+from heatmap import HEATMAP_ZOOMS, HeatmapGrid, TILE_BINS
+from ingest import score_frames, score_stream
+import metrics
+from model import load_model
+from online import OnlineBaseline
+from persistence import WriteBehindBuffer, open_sink
+from profiler import FORMATS as PROFILE_FORMATS, RequestProfiler
+from route_safety import score_routes
+from scoring import Scorer, parse_timestamp
+from segments import SegmentSink, query_shards
+from sharding import SHARD_DIR, ShardedScorer
+from trajectory import TrajectoryStore
+from watchdog import InactivityWatchdog, silence_thresholds
+import wire
+from zones import load_zones
 
 app = Flask(__name__)
 CORS(app)
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 10000))
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 500))
+MAX_FACILITY_RESULTS = 50
+MAX_HISTORY_POINTS = int(os.getenv('MAX_HISTORY_POINTS', 100000))
+
+# Admin routes are disabled unless ADMIN_TOKEN is set; callers send it as a Bearer token.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+# Loaded once per process at import time so no request pays the load cost.
+model = load_model()
+zones = load_zones()
+trajectories = TrajectoryStore()
+online = OnlineBaseline()
+zone_cache = CachedZoneLookup(zones)
+heatmap = HeatmapGrid()
+crowds = CrowdMonitor(on_alert=lambda alert: logging.warning('crowd alert: %s', alert))
+sink = open_sink()
+history = WriteBehindBuffer(sink) if sink is not None else None
+if history is not None:
+    atexit.register(history.close)
+watchdog = InactivityWatchdog(silence_thresholds(zones), zone_ids=zone_cache.ids,
+                              on_event=lambda event: logging.warning('inactivity: %s', event))
+scorer = Scorer(model, zone_cache, trajectories, online, heatmap, history, crowds, watchdog)
+if SHARD_DIR:
+    # Each tourist's pings are scored by the worker that owns their state (see sharding.py).
+    scorer = ShardedScorer(scorer)
+facilities = FacilityIndex(read_facilities())
+dispatcher = DispatchEngine()
+profiler = RequestProfiler()
+admission = AdmissionController()
+
+metrics.registry.callback('ai_zone_cache_hits_total', 'Zone risk cache hits.',
+                          lambda: zone_cache.cache.hits, type='counter')
+metrics.registry.callback('ai_zone_cache_misses_total', 'Zone risk cache misses.',
+                          lambda: zone_cache.cache.misses, type='counter')
+metrics.registry.callback('ai_zone_cache_hit_ratio', 'Zone risk cache hit ratio since start.',
+                          lambda: zone_cache.stats()['hit_ratio'])
+metrics.registry.callback('ai_zone_cache_entries', 'Entries held in the zone risk cache.', lambda: len(zone_cache.cache))
+metrics.registry.callback('ai_dispatch_queue_depth', 'SOS alerts waiting for a unit.', lambda: dispatcher.status()['queued'])
+metrics.registry.callback('ai_dispatch_available_units', 'Responder units free to assign.',
+                          lambda: dispatcher.status()['available_units'])
+metrics.registry.callback('ai_tracked_tourists', 'Tourists with trajectory state in this process.',
+                          lambda: len(trajectories))
+metrics.registry.callback('ai_persist_buffered_rows', 'Scored pings waiting to be persisted.',
+                          lambda: None if history is None else len(history))
+metrics.registry.callback('ai_persist_dropped_total', 'Scored pings dropped because the persistence buffer was full.',
+                          lambda: None if history is None else history.dropped, type='counter')
+metrics.registry.callback('ai_persist_quarantined_total', 'Scored pings the persistence sink kept rejecting, set aside.',
+                          lambda: None if history is None else history.quarantined, type='counter')
+metrics.registry.callback('ai_heatmap_tiles', 'Heatmap tiles held in memory.', lambda: len(heatmap))
+metrics.registry.callback('ai_crowd_clusters', 'Crowd clusters currently detected.', lambda: len(crowds))
+metrics.registry.callback('ai_watchdog_tourists', 'Tourists watched for inactivity in this process.',
+                          lambda: len(watchdog))
+metrics.registry.callback('ai_admission_active', 'Requests holding an admission slot, by priority class.',
+                          lambda: admission.stats()['active'], labelname='class')
+metrics.registry.callback('ai_admission_waiting', 'Requests queued for an admission slot, by priority class.',
+                          lambda: admission.stats()['waiting'], labelname='class')
+
+def shared_state():
+    """Objects that must exist once per host when gunicorn runs several workers (see hub.py)."""
+    # Crowds and the heatmap mix tourists, so they need every worker's pings even when tourists are sharded.
+    state = {'dispatcher': dispatcher, 'crowds': crowds, 'heatmap': heatmap}
+    if not SHARD_DIR:
+        # Sharded workers each hear all of their own tourists' pings, so they keep their own watchdog.
+        state['watchdog'] = watchdog
+    return state
+
+def use_hub(proxies):
+    """Swap this worker's shared objects for proxies to the hub's; called after fork."""
+    global dispatcher, crowds, heatmap, watchdog
+    # The Scorer itself, inside ShardedScorer when sharding.
+    pipeline = getattr(scorer, 'scorer', scorer)
+    dispatcher = proxies['dispatcher']
+    crowds = pipeline.crowds = proxies['crowds']
+    heatmap = pipeline.heatmap = proxies['heatmap']
+    if 'watchdog' in proxies:
+        watchdog = pipeline.watchdog = proxies['watchdog']
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    g.profile = profiler.start() if profiler.sample_rate else None
+    metrics.IN_FLIGHT.inc()
+
+@app.before_request
+def admit():
+    # Low-priority work is shed first; SOS dispatch and /health keep a reserved share (see admission.py).
+    cls = route_class(request.url_rule.rule if request.url_rule else '')
+    try:
+        waited = admission.acquire(cls)
+    except Overloaded as exc:
+        response = jsonify({'success': False, 'error': f'Service overloaded ({exc.cls} priority); retry later'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(exc.retry_after)
+        return response
+    g.admitted = cls
+    metrics.ADMISSION_WAIT_SECONDS.observe(waited, cls)
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('started', None)
+    if started is None:
+        return response
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (rule, request.method, str(response.status_code))
+    profile = g.pop('profile', None)
+    admitted = g.pop('admitted', None)
+
+    # Observed once the server closes the body, so streamed ingest latency covers the whole stream.
+    def observe():
+        if profile is not None:
+            profiler.stop(profile)
+        if admitted is not None:
+            admission.release(admitted)
+        metrics.IN_FLIGHT.dec()
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, *labels)
+
+    response.call_on_close(observe)
+    return response
+
+def time_arg(value):
+    """Epoch seconds/milliseconds or ISO-8601 from a query string; NaN when absent or invalid."""
+    try:
+        return parse_timestamp(float(value))
+    except (TypeError, ValueError):
+        return parse_timestamp(value)
+
+def is_admin():
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, f'Bearer {ADMIN_TOKEN}')
+
+def health_info():
+    return {
         'status': 'healthy',
         'service': 'JatayuNetra AI Service',
-        'port': os.getenv('PORT', 5000)
-    })
+        'port': os.getenv('PORT', 5000),
+        'pid': os.getpid(),
+        'model': model.info(),
+        'online': online.info(),
+        'zones': len(zones),
+        'facilities': {'count': len(facilities), 'generation': facilities.generation},
+        'tracked_tourists': len(trajectories),
+        'zone_cache': zone_cache.stats(),
+        'crowds': crowds.stats(),
+        'watchdog': watchdog.stats(),
+        'sharding': scorer.info() if SHARD_DIR else None,
+        'admission': admission.stats(),
+        'persistence': None if history is None else history.stats()
+    }
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify(health_info())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/ai/analyze', methods=['POST'])
 def analyze():
+    payload = request.get_json(silent=True) or {}
+    try:
+        result = scorer.score_records([payload])[0]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    result.pop('token_id')
+    return jsonify({
+        'success': True,
+        'data': result
+    })
+
+@app.route('/api/ai/analyze/batch', methods=['POST'])
+def analyze_batch():
+    if request.mimetype == wire.CONTENT_TYPE:
+        return analyze_batch_binary()
+    payload = request.get_json(silent=True) or {}
+    records = payload.get('records') if isinstance(payload, dict) else payload
+    if not isinstance(records, list):
+        return jsonify({'success': False, 'error': 'Expected a JSON list of records'}), 400
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({'success': False, 'error': f'Batch exceeds {MAX_BATCH_SIZE} records'}), 413
+    try:
+        results = scorer.score_records(records)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'data': {
+            'count': len(results),
+            'results': results
+        }
+    })
+
+def analyze_batch_binary():
+    try:
+        cols = wire.decode_pings(request.get_data())
+    except wire.WireError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if len(cols['lat']) > MAX_BATCH_SIZE:
+        return jsonify({'success': False, 'error': f'Batch exceeds {MAX_BATCH_SIZE} records'}), 413
+    cols, scores = scorer.score(cols)
+    return Response(wire.encode_results(cols, scores, zone_cache.ids), content_type=wire.CONTENT_TYPE)
+
+@app.route('/api/ai/zones/lookup', methods=['POST'])
+def zones_lookup():
+    payload = request.get_json(silent=True) or {}
+    try:
+        lat, lng = float(payload['lat']), float(payload['lng'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'lat and lng are required numbers'}), 400
+    return jsonify({
+        'success': True,
+        'data': {'zones': [zone.to_dict() for zone in zones.lookup(lat, lng)]}
+    })
+
+@app.route('/api/ai/facilities/nearest', methods=['POST'])
+def facilities_nearest():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    points = payload.get('points')
+    single = points is None
+    try:
+        points = [payload] if single else points
+        lat = [float(p['lat']) for p in points]
+        lng = [float(p['lng']) for p in points]
+        k = min(int(payload.get('k', 3)), MAX_FACILITY_RESULTS)
+        radius_m = payload.get('radius_m')
+        radius_m = None if radius_m is None else float(radius_m)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Every point needs numeric lat and lng'}), 400
+    if k < 1:
+        return jsonify({'success': False, 'error': 'k must be at least 1'}), 400
+    if len(points) > MAX_BATCH_SIZE:
+        return jsonify({'success': False, 'error': f'Batch exceeds {MAX_BATCH_SIZE} points'}), 413
+
+    kind = payload.get('type')
+    if radius_m is None:
+        matches = facilities.nearest(lat, lng, kind, k)
+    else:
+        matches = [m[:MAX_FACILITY_RESULTS] for m in facilities.within(lat, lng, radius_m, kind)]
+    results = [
+        [dict(facility, distance_m=round(distance, 1)) for facility, distance in found]
+        for found in matches
+    ]
+    return jsonify({
+        'success': True,
+        'data': {'facilities': results[0]} if single else {'results': results}
+    })
+
+@app.route('/api/ai/facilities/reload', methods=['POST'])
+def facilities_reload():
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    # Build the new index off the request thread; queries keep using the old one until the swap.
+    threading.Thread(target=lambda: facilities.reload(read_facilities()), daemon=True).start()
+    return jsonify({'success': True, 'data': {'generation': facilities.generation}}), 202
+
+@app.route('/api/ai/admin/profile', methods=['GET'])
+def profile_report():
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    fmt = request.args.get('format', 'text')
+    if fmt not in PROFILE_FORMATS:
+        return jsonify({'success': False, 'error': f'format must be one of {list(PROFILE_FORMATS)}'}), 400
+    filename = {'text': 'profile.txt', 'pstats': 'profile.pstats', 'collapsed': 'profile.collapsed'}[fmt]
+    return Response(profiler.report(fmt), mimetype='application/octet-stream' if fmt == 'pstats' else 'text/plain',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/api/ai/admin/profile', methods=['POST'])
+def profile_configure():
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    payload = request.get_json(silent=True) or {}
+    try:
+        profiler.configure(payload.get('sample_rate'), payload.get('stack_interval'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'sample_rate and stack_interval must be numbers'}), 400
+    if payload.get('reset'):
+        profiler.reset()
+    return jsonify({'success': True, 'data': profiler.info()})
+
+@app.route('/api/ai/history/<token_id>', methods=['GET'])
+def tourist_history(token_id):
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    if not isinstance(sink, SegmentSink):
+        return jsonify({'success': False, 'error': 'History queries need PERSIST_URL=segments:///<dir>'}), 404
+    start, end = (time_arg(request.args.get(name)) for name in ('from', 'to'))
+    found = query_shards(sink.root, token_id, -math.inf if math.isnan(start) else start,
+                         math.inf if math.isnan(end) else end)
+    count = len(found['timestamp'])
+    found = {name: col[:MAX_HISTORY_POINTS] for name, col in found.items()}
+    return jsonify({
+        'success': True,
+        'data': {
+            'token_id': token_id,
+            'count': count,
+            'truncated': count > MAX_HISTORY_POINTS,
+            'timestamp': found['timestamp'].tolist(),
+            'lat': found['lat'].tolist(),
+            'lng': found['lng'].tolist(),
+            'speed': [None if s != s else s for s in np.round(found['speed'].astype(np.float64), 2).tolist()]
+        }
+    })
+
+@app.route('/api/ai/watchdog', methods=['GET'])
+def watchdog_status():
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    since = time_arg(request.args.get('since'))
     return jsonify({
         'success': True,
         'data': {
-            'anomaly_score': 0.2,
-            'safety_score': 0.8,
-            'recommendations': ['All systems normal']
+            'overdue': watchdog.overdue(request.args.get('min_stage', 1, type=int)),
+            'events': watchdog.recent_events(None if math.isnan(since) else since),
+            'stats': watchdog.stats()
         }
     })
 
+@app.route('/api/ai/watchdog/<token_id>', methods=['DELETE'])
+def watchdog_forget(token_id):
+    if not is_admin():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    if not watchdog.forget_token(token_id):
+        return jsonify({'success': False, 'error': 'Tourist is not being watched'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/ai/dispatch/alerts', methods=['POST'])
+def dispatch_alert():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    location = payload.get('location') or payload
+    try:
+        lat, lng = position(location['lat'], location['lng'])
+        anomaly_score = payload.get('anomaly_score')
+        if anomaly_score is None:
+            anomaly_score = scorer.score_records([payload])[0]['anomaly_score']
+        alert = dispatcher.submit(lat, lng, payload.get('severity', 'high'), float(anomaly_score),
+                                  payload.get('alert_id'), payload)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'location with numeric lat and lng is required'}), 400
+    return jsonify({
+        'success': True,
+        'data': dict(alert.to_dict(), status='assigned' if alert.unit_id else 'queued')
+    }), 201
+
+@app.route('/api/ai/dispatch/units', methods=['POST'])
+def dispatch_units():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    try:
+        # Every unit is checked before any is registered.
+        units = [(str(unit['unit_id']), *position(unit['lat'], unit['lng']), unit.get('type', 'police'),
+                  unit.get('available', True)) for unit in payload.get('units', [])]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Every unit needs unit_id and a valid lat and lng'}), 400
+    assignments = []
+    for unit in units:
+        assignments += dispatcher.upsert_unit(*unit)
+    return jsonify({
+        'success': True,
+        'data': {'assignments': [alert.to_dict() for alert, _ in assignments], **dispatcher.status()}
+    })
+
+@app.route('/api/ai/dispatch/units/<unit_id>/release', methods=['POST'])
+def dispatch_release(unit_id):
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    lat, lng = payload.get('lat'), payload.get('lng')
+    try:
+        if lat is not None or lng is not None:
+            lat, lng = position(lat, lng)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'lat and lng must be a valid position'}), 400
+    try:
+        assignments = dispatcher.release(unit_id, lat, lng)
+    except KeyError:
+        return jsonify({'success': False, 'error': f'Unknown unit {unit_id}'}), 404
+    return jsonify({
+        'success': True,
+        'data': {'assignments': [alert.to_dict() for alert, _ in assignments]}
+    })
+
+@app.route('/api/ai/dispatch/status', methods=['GET'])
+def dispatch_status():
+    return jsonify({'success': True, 'data': dispatcher.status()})
+
+@app.route('/api/ai/routes/score', methods=['POST'])
+def routes_score():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+    routes = payload.get('routes')
+    if not isinstance(routes, list) or not routes:
+        return jsonify({'success': False, 'error': 'Expected a non-empty list of routes'}), 400
+    departure = parse_timestamp(payload.get('departure_time'))
+    if math.isnan(departure):
+        departure = time.time()
+    try:
+        results = score_routes(routes, zones, departure, payload.get('mode', 'walking'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'data': {
+            'routes': results,
+            'safest_route_id': max(results, key=lambda r: r['safety_score'])['route_id']
+        }
+    })
+
+@app.route('/api/ai/heatmap/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def heatmap_tile(z, x, y):
+    if z not in HEATMAP_ZOOMS:
+        return jsonify({'success': False, 'error': f'Zoom must be one of {sorted(HEATMAP_ZOOMS)}'}), 404
+    if not heatmap.contains(z, x, y):
+        return jsonify({'success': False, 'error': f'Tile {z}/{x}/{y} does not exist'}), 404
+    etag = heatmap.etag(z, x, y)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        grid = heatmap.tile(z, x, y)
+        cells = []
+        if grid is not None:
+            rows, cols = np.nonzero(grid >= 0.01)
+            values = np.round(grid[rows, cols].astype(np.float64), 3)
+            cells = [list(cell) for cell in zip(rows.tolist(), cols.tolist(), values.tolist())]
+        response = jsonify({
+            'success': True,
+            'data': {
+                'z': z, 'x': x, 'y': y,
+                'bins': TILE_BINS,
+                'max': 0.0 if grid is None else round(float(grid.max()), 3),
+                'cells': cells
+            }
+        })
+    response.set_etag(etag)
+    # Always revalidate; an unchanged tile costs a 304 with no body.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/ai/crowds', methods=['GET'])
+def crowd_status():
+    min_size = request.args.get('min_size', 0, type=int)
+    since = time_arg(request.args.get('since'))
+    return jsonify({
+        'success': True,
+        'data': {
+            'clusters': crowds.snapshot(min_size),
+            'alerts': crowds.recent_alerts(None if math.isnan(since) else since),
+            'stats': crowds.stats()
+        }
+    })
+
+@app.route('/api/ai/ingest', methods=['POST'])
+def ingest():
+    if request.mimetype == wire.CONTENT_TYPE:
+        frames = score_frames(request.stream, scorer, MAX_BATCH_SIZE)
+        return Response(stream_with_context(frames), content_type=wire.CONTENT_TYPE)
+    results = score_stream(request.stream, scorer, INGEST_CHUNK_SIZE)
+    return Response(stream_with_context(results), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
-    print(f'🤖 AI Service starting on port {port}')
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    debug = os.getenv('FLASK_ENV') == 'development'
+    print(f'🤖 AI Service starting on port {port} (dev server; use gunicorn -c gunicorn.conf.py app:app in production)')
+    app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,319 @@
+"""asyncio serving mode for the AI service.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+``/health`` and ``/api/ai/analyze`` are served natively on the event loop,
+with scoring offloaded to a thread pool, so one process can hold thousands
+of idle or slow connections. They go through the same admission control as
+the Flask routes. Concurrent analyze calls are micro-batched into
+a single scoring pass. Every other route runs the Flask app from
+``app.py`` on a bridge thread pool, with request and response bodies
+streamed between the thread and the loop. Both paths share the same model,
+zones and per-tourist state.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from admission import AdmissionController, Overloaded, route_class
+import app as flask_service
+import metrics
+
+# Threads that run scoring for native routes; NumPy and scikit-learn release the GIL for most of it.
+AI_SCORING_THREADS = int(os.getenv('AI_SCORING_THREADS', os.cpu_count() or 1))
+# Flask requests run at once; each holds a bridge thread for the whole request, so size it for concurrent
+# slow bodies. The pool has extra threads for requests waiting on admission.
+AI_BRIDGE_THREADS = int(os.getenv('AI_BRIDGE_THREADS', 64))
+MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', 16 * 1024 * 1024))
+# Concurrent /api/ai/analyze calls are scored together: whatever arrives while a batch is
+# being scored (up to this many pings) forms the next one.
+ANALYZE_MAX_BATCH = int(os.getenv('ANALYZE_MAX_BATCH', 256))
+
+scoring_pool = ThreadPoolExecutor(AI_SCORING_THREADS, thread_name_prefix='scoring')
+if 'ADMISSION_CAPACITY' not in os.environ:
+    # Flask routes run on the bridge threads here, not gunicorn's.
+    flask_service.admission = AdmissionController(capacity=AI_BRIDGE_THREADS)
+# Native routes wait for admission on these threads too; the queues bound how many wait at once.
+bridge_pool = ThreadPoolExecutor(flask_service.admission.threads_needed(), thread_name_prefix='wsgi')
+
+# Same CORS policy as flask_cors' default on the Flask routes.
+JSON_HEADERS = [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]
+
+
+async def read_body(receive, limit=MAX_BODY_BYTES):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError('client disconnected')
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise ValueError(f'body exceeds {limit} bytes')
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': JSON_HEADERS + [(b'content-length', str(len(body)).encode())] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _score_many(payloads):
+    """Score payloads in one pass; a ValueError falls back to one pass per payload."""
+    try:
+        return flask_service.scorer.score_records(payloads)
+    except ValueError:
+        pass
+    results = []
+    for payload in payloads:
+        try:
+            results.append(flask_service.scorer.score_records([payload])[0])
+        except ValueError as e:
+            results.append(e)
+    return results
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-ping requests into one scoring pass on the pool."""
+
+    def __init__(self, max_batch=ANALYZE_MAX_BATCH):
+        self.max_batch = max_batch
+        self._pending = []
+        self._running = False
+        self._task = None
+
+    async def score(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if not self._running:
+            self._running = True
+            self._task = asyncio.ensure_future(self._drain())
+        result = await future
+        if isinstance(result, ValueError):
+            raise result
+        result.pop('token_id')
+        return result
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+                try:
+                    results = await loop.run_in_executor(scoring_pool, _score_many, [p for p, _ in batch])
+                except Exception as e:
+                    results = [e] * len(batch)
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception) and not isinstance(result, ValueError):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        finally:
+            self._running = False
+
+
+batcher = MicroBatcher()
+
+
+async def health(scope, receive, send):
+    await send_json(send, flask_service.health_info())
+    return 200
+
+
+async def analyze(scope, receive, send):
+    try:
+        body = await read_body(receive)
+    except ValueError as e:
+        await send_json(send, {'success': False, 'error': str(e)}, 413)
+        return 413
+    # Like the Flask route's ``get_json(silent=True) or {}``: anything else that is
+    # not an object reaches to_columns and is rejected there.
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = None
+    try:
+        result = await batcher.score(payload or {})
+    except ValueError as e:
+        await send_json(send, {'success': False, 'error': str(e)}, 400)
+        return 400
+    await send_json(send, {'success': True, 'data': result})
+    return 200
+
+
+async def admit(cls, send):
+    """Take an admission slot for a native route; answers 429 and returns None when shed.
+
+    Waiting for a slot happens on a bridge thread so it never blocks the loop.
+    """
+    admission = flask_service.admission
+    acquiring = asyncio.get_running_loop().run_in_executor(bridge_pool, admission.acquire, cls)
+    try:
+        waited = await asyncio.shield(acquiring)
+    except Overloaded as exc:
+        await send_json(send, {'success': False, 'error': f'Service overloaded ({exc.cls} priority); retry later'},
+                        429, [(b'retry-after', str(exc.retry_after).encode())])
+        return None
+    except asyncio.CancelledError:
+        # The slot may still be granted after the request is gone; hand it straight back.
+        acquiring.add_done_callback(lambda f: f.exception() is None and admission.release(cls))
+        raise
+    metrics.ADMISSION_WAIT_SECONDS.observe(waited, cls)
+    return admission
+
+
+NATIVE_ROUTES = {
+    ('GET', '/health'): health,
+    ('POST', '/api/ai/analyze'): analyze,
+}
+
+
+class _BodyStream:
+    """``wsgi.input`` for a bridge thread: pulls ASGI body messages from the loop on demand."""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._done = False
+
+    def _fill(self):
+        message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if message['type'] == 'http.disconnect':
+            self._done = True
+            return
+        self._buffer += message.get('body', b'')
+        self._done = not message.get('more_body')
+
+    def read(self, size=-1):
+        while not self._done and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, size=-1):
+        while not self._done and b'\n' not in self._buffer and (size is None or size < 0 or len(self._buffer) < size):
+            self._fill()
+        end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': unquote(scope['path']),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[key] = value
+        else:
+            key = f'HTTP_{key}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _run_wsgi(scope, receive, send, loop):
+    """Run one Flask request entirely on this thread, so its hooks see a single thread."""
+    def call(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]),
+                      [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+
+    result = flask_service.app(_environ(scope, _BodyStream(receive, loop)), start_response)
+    try:
+        for chunk in result:
+            if not chunk:
+                continue
+            if len(started) == 2:
+                call({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                started.append(True)
+            call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if len(started) == 2:
+            call({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+        call({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            scoring_pool.shutdown(wait=True)
+            bridge_pool.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    handler = NATIVE_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(bridge_pool, _run_wsgi, scope, receive, send, loop)
+
+    started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    status = 500
+    try:
+        cls = route_class(scope['path'])
+        admission = await admit(cls, send)
+        if admission is None:
+            status = 429
+            return
+        try:
+            status = await handler(scope, receive, send)
+        finally:
+            admission.release(cls)
+    finally:
+        metrics.IN_FLIGHT.dec()
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, scope['path'], scope['method'], str(status))
@@ -0,0 +1,262 @@
+"""HTTP load and latency benchmark for the AI service.
+
+Starts the service (or targets a running one with --url), drives it from
+concurrent client threads with a weighted mix of requests, and writes
+throughput plus p50/p95/p99 latency per request kind to a JSON file.
+
+    python benchmark.py --concurrency 16 --duration 30 --mix analyze=6,batch=1,health=3
+    python benchmark.py --baseline bench_baseline.json   # exit 1 on regression
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+import wire
+
+DEFAULT_MIX = 'analyze=6,batch=1,health=3'
+
+
+def make_payloads(batch_size, seed=1):
+    rng = random.Random(seed)
+
+    def ping(i):
+        return {
+            'token_id': f'BENCH-{i % 1000}',
+            'lat': 10.0 + rng.uniform(-0.05, 0.05),
+            'lng': 76.3 + rng.uniform(-0.05, 0.05),
+            'speed': rng.uniform(0, 15),
+        }
+
+    batch = [ping(i) for i in range(batch_size)]
+    binary = wire.encode_pings([p['token_id'] for p in batch], [p['lat'] for p in batch],
+                               [p['lng'] for p in batch], [p['speed'] for p in batch])
+    return {
+        'health': ('GET', '/health', None, None),
+        'analyze': ('POST', '/api/ai/analyze', json.dumps(ping(0)).encode(), 'application/json'),
+        'batch': ('POST', '/api/ai/analyze/batch', json.dumps({'records': batch}).encode(), 'application/json'),
+        'batch_binary': ('POST', '/api/ai/analyze/batch', binary, wire.CONTENT_TYPE),
+    }
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+class Client:
+    """One keep-alive connection per thread, reopened whenever the server closes it."""
+
+    def __init__(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def request(self, method, path, body, content_type):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                headers = {'Content-Type': content_type} if content_type else {}
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def run_load(host, port, mix, payloads, concurrency, duration, warmup, timeout):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = Client(host, port, timeout)
+        local = {name: [] for name in names}
+        local_errors = {name: 0 for name in names}
+        while True:
+            name = rng.choices(names, weights)[0]
+            method, path, body, content_type = payloads[name]
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            try:
+                ok = client.request(method, path, body, content_type) < 400
+            except (http.client.HTTPException, OSError):
+                ok = False
+            if started >= measure_from:
+                if ok:
+                    local[name].append(time.perf_counter() - started)
+                else:
+                    local_errors[name] += 1
+        with lock:
+            for name in names:
+                samples[name] += local[name]
+                errors[name] += local_errors[name]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, errors
+
+
+def summarize(samples, errors, duration):
+    summary = {}
+    for name, latencies in samples.items():
+        ms = np.array(latencies) * 1000.0
+        summary[name] = {
+            'requests': len(latencies),
+            'errors': errors[name],
+            'throughput_rps': round(len(latencies) / duration, 1),
+            'p50_ms': round(float(np.percentile(ms, 50)), 3) if len(ms) else None,
+            'p95_ms': round(float(np.percentile(ms, 95)), 3) if len(ms) else None,
+            'p99_ms': round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+            'max_ms': round(float(ms.max()), 3) if len(ms) else None,
+        }
+    total = sum(len(v) for v in samples.values())
+    summary['total'] = {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'throughput_rps': round(total / duration, 1),
+    }
+    return summary
+
+
+def compare(results, baseline, tolerance):
+    """Regressions where p95/p99 grew or throughput fell by more than ``tolerance``."""
+    regressions = []
+    for name, current in results['summary'].items():
+        before = baseline.get('summary', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if current.get(metric) and before.get(metric) and current[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f'{name}.{metric}: {before[metric]} -> {current[metric]}')
+        if before.get('throughput_rps') and current['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}.throughput_rps: {before['throughput_rps']} -> {current['throughput_rps']}")
+    return regressions
+
+
+def start_service(server, port, workers):
+    env = dict(os.environ, PORT=str(port), FLASK_ENV='production', AI_WORKERS=str(workers))
+    if server == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '', 'app:app']
+    else:
+        cmd = [sys.executable, 'app.py']
+    return subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_healthy(host, port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the AI service over HTTP')
+    parser.add_argument('--url', help='benchmark a running service instead of starting one')
+    parser.add_argument('--server', choices=('dev', 'gunicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='weighted request kinds: analyze, batch, batch_binary, health')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    payloads = make_payloads(args.batch_size)
+    unknown = set(mix) - set(payloads)
+    if unknown:
+        parser.error(f'unknown request kinds in --mix: {sorted(unknown)}')
+
+    process = None
+    if args.url:
+        parsed = urlparse(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = '127.0.0.1', args.port
+        process = start_service(args.server, port, args.workers)
+    try:
+        if not wait_healthy(host, port):
+            sys.exit(f'Service at {host}:{port} never became healthy')
+        print(f'📈 Driving {host}:{port} with {args.concurrency} clients for {args.duration}s ({args.mix})')
+        samples, errors = run_load(host, port, mix, payloads, args.concurrency,
+                                   args.duration, args.warmup, args.timeout)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {
+            'server': 'external' if args.url else args.server,
+            'workers': None if args.url else args.workers,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'mix': mix,
+            'batch_size': args.batch_size,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+        },
+        'summary': summarize(samples, errors, args.duration),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for name, stats in results['summary'].items():
+        print(f'  {name:12s} {json.dumps(stats)}')
+    print(f'✅ Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('❌ Regressions against baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('✅ No regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
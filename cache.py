@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Quantization cell edge in degrees (~55 m at the equator).
+SCORE_CACHE_CELL_DEG = float(os.getenv('SCORE_CACHE_CELL_DEG', 0.0005))
+SCORE_CACHE_TTL = float(os.getenv('SCORE_CACHE_TTL', 300))
+SCORE_CACHE_MAX_BYTES = int(os.getenv('SCORE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# Rough footprint of one entry: int key, value tuple and OrderedDict bookkeeping.
+ENTRY_BYTES = 256
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_many(self, keys, now):
+        """Cached values for ``keys`` (None for misses), refreshing their LRU position."""
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is not None and entry[0] < now:
+                    del self._data[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self.hits += 1
+                    self._data.move_to_end(key)
+                    values.append(entry[1])
+        return values
+
+    def put_many(self, items, now):
+        expires = now + self.ttl
+        with self._lock:
+            for key, value in items:
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class CachedZoneLookup:
+    """Zone registry front that caches the location risk per quantized cell.
+
+    Only cells that no zone edge passes through are cached with a single
+    result, since every point in them has the same zones. Cells an edge
+    crosses are remembered as such and their pings always get the exact
+    polygon test, so results match ``ZoneRegistry`` everywhere. Exposes the
+    same lookup interface as ``ZoneRegistry``.
+    """
+
+    def __init__(self, zones, cell_deg=SCORE_CACHE_CELL_DEG, ttl=SCORE_CACHE_TTL, max_bytes=SCORE_CACHE_MAX_BYTES):
+        self.zones = zones
+        self.cell_deg = cell_deg
+        self.cache = LRUCache(max_bytes // ENTRY_BYTES, ttl)
+        self._cols = int(np.ceil(360.0 / cell_deg)) + 1
+        self.exact_lookups = 0
+
+    def __len__(self):
+        return len(self.zones)
+
+    def __getattr__(self, name):
+        return getattr(self.zones, name)
+
+    def _edge_cells(self, ix, iy):
+        """Which cells a zone edge passes through."""
+        # Padded so a point rounded into a neighbouring cell is still covered.
+        pad = self.cell_deg * 1e-6
+        min_x, min_y = ix * self.cell_deg - 180.0 - pad, iy * self.cell_deg - 90.0 - pad
+        max_x, max_y = min_x + self.cell_deg + 2 * pad, min_y + self.cell_deg + 2 * pad
+        edge = np.zeros(len(ix), dtype=bool)
+        for zone in self.zones.zones:
+            z_min_x, z_min_y, z_max_x, z_max_y = zone.bbox
+            near = np.nonzero((max_x >= z_min_x) & (min_x <= z_max_x) & (max_y >= z_min_y) & (min_y <= z_max_y))[0]
+            if len(near):
+                edge[near] |= zone.crosses(min_x[near], min_y[near], max_x[near], max_y[near])
+        return edge
+
+    def lookup_batch(self, lat, lng, timestamp=None):
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        risk = np.zeros(lat.shape)
+        zone_index = np.full(lat.shape, -1, dtype=np.int64)
+        valid = np.nonzero((np.abs(lat) <= 90) & (np.abs(lng) <= 180))[0]
+        if not len(self.zones) or not len(valid):
+            return risk, zone_index
+
+        now = time.time()
+        ix = np.floor((lng[valid] + 180.0) / self.cell_deg).astype(np.int64)
+        iy = np.floor((lat[valid] + 90.0) / self.cell_deg).astype(np.int64)
+        keys = iy * self._cols + ix
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        # Values are (risk, zone index), or (nan, -1) for cells that need the exact test.
+        cached = self.cache.get_many(unique_keys.tolist(), now)
+        missing = np.array([i for i, value in enumerate(cached) if value is None], dtype=np.int64)
+        if len(missing):
+            cells = first[missing]
+            centre_lat = (iy[cells] + 0.5) * self.cell_deg - 90.0
+            centre_lng = (ix[cells] + 0.5) * self.cell_deg - 180.0
+            miss_risk, miss_index = self.zones.lookup_batch(centre_lat, centre_lng)
+            edge = self._edge_cells(ix[cells], iy[cells])
+            miss_risk[edge], miss_index[edge] = np.nan, -1
+            fresh = list(zip(miss_risk.tolist(), miss_index.tolist()))
+            for i, value in zip(missing.tolist(), fresh):
+                cached[i] = value
+            self.cache.put_many(zip(unique_keys[missing].tolist(), fresh), now)
+
+        cell_risk = np.fromiter((value[0] for value in cached), dtype=np.float64, count=len(cached))
+        cell_index = np.fromiter((value[1] for value in cached), dtype=np.int64, count=len(cached))
+        risk[valid] = cell_risk[inverse]
+        zone_index[valid] = cell_index[inverse]
+        exact = valid[np.isnan(cell_risk[inverse])]
+        if len(exact):
+            self.exact_lookups += len(exact)
+            risk[exact], zone_index[exact] = self.zones.lookup_batch(lat[exact], lng[exact])
+        return risk, zone_index
+
+    def stats(self):
+        return dict(self.cache.stats(), cell_deg=self.cell_deg, exact_lookups=self.exact_lookups)
@@ -0,0 +1,304 @@
+import collections
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+# DBSCAN radius; grid cells are eps/sqrt(2) wide so any two tourists in one cell are neighbours.
+CROWD_EPS_M = float(os.getenv('CROWD_EPS_M', 20))
+# Tourists a cell needs to be a core cell (DBSCAN minPts).
+CROWD_MIN_POINTS = int(os.getenv('CROWD_MIN_POINTS', 8))
+# A tourist stops counting towards a crowd this many seconds after their last ping.
+CROWD_WINDOW = float(os.getenv('CROWD_WINDOW', 300))
+# Alert thresholds: tracked tourists per m² over core cells, and net arrivals per minute.
+CROWD_ALERT_DENSITY = float(os.getenv('CROWD_ALERT_DENSITY', 0.1))
+CROWD_ALERT_GROWTH = float(os.getenv('CROWD_ALERT_GROWTH', 30))
+# Clusters smaller than this never alert.
+CROWD_MIN_SIZE = int(os.getenv('CROWD_MIN_SIZE', 25))
+CROWD_GROWTH_WINDOW = float(os.getenv('CROWD_GROWTH_WINDOW', 120))
+CROWD_ALERT_COOLDOWN = float(os.getenv('CROWD_ALERT_COOLDOWN', 300))
+# Pings dated further ahead of the server clock than this are counted as received now.
+CROWD_MAX_SKEW = float(os.getenv('CROWD_MAX_SKEW', 60))
+
+METRES_PER_DEG = 111320.0
+MAX_ALERTS = 1000
+_COL_OFFSET = 1 << 31
+
+
+class _Cluster:
+    __slots__ = ('id', 'cells', 'size', 'core_size', 'density', 'growth', 'lat', 'lng', 'born', 'samples',
+                 'last_alert')
+
+    def __init__(self, cluster_id, cells, born):
+        self.id = cluster_id
+        self.cells = cells
+        self.size = self.core_size = 0
+        self.density = self.growth = 0.0
+        self.lat = self.lng = None
+        self.born = born
+        self.samples = collections.deque()
+        self.last_alert = {}
+
+    def to_dict(self):
+        return {
+            'cluster_id': self.id,
+            'lat': round(self.lat, 6),
+            'lng': round(self.lng, 6),
+            'size': self.size,
+            'cells': len(self.cells),
+            'density': round(self.density, 4),
+            'growth_per_min': round(self.growth, 2),
+            'since': self.born,
+        }
+
+
+class CrowdMonitor:
+    """Density-based crowd clusters kept up to date as pings arrive.
+
+    Tourists count once, in the grid cell of their latest ping, until they go
+    quiet for ``window`` seconds. Cells are ``eps / sqrt(2)`` wide, so a cell
+    holding ``min_points`` tourists is a DBSCAN core region as a whole;
+    clusters are connected groups of core cells, and tourists in adjacent
+    non-core cells count as border points. When a cell turns core or stops
+    being one, only the clusters touching it are rebuilt, so an update costs
+    the size of the crowds nearby, never the number of tourists tracked.
+    """
+
+    def __init__(self, eps_m=CROWD_EPS_M, min_points=CROWD_MIN_POINTS, window=CROWD_WINDOW,
+                 alert_density=CROWD_ALERT_DENSITY, alert_growth=CROWD_ALERT_GROWTH, min_size=CROWD_MIN_SIZE,
+                 growth_window=CROWD_GROWTH_WINDOW, cooldown=CROWD_ALERT_COOLDOWN, max_skew=CROWD_MAX_SKEW,
+                 on_alert=None, clock=time.time):
+        self.cell_m = eps_m / math.sqrt(2.0)
+        self.cell_deg = self.cell_m / METRES_PER_DEG
+        self.min_points = min_points
+        self.window = window
+        self.alert_density = alert_density
+        self.alert_growth = alert_growth
+        self.min_size = min_size
+        self.growth_window = growth_window
+        self.cooldown = cooldown
+        self.max_skew = max_skew
+        self.on_alert = on_alert
+        self.clock = clock
+        # token -> (cell, last seen), and a min-heap of (last seen, seq, token) for expiry.
+        # Heap entries whose time no longer matches the tourist's are stale and skipped.
+        self.tourists = {}
+        self._expiry = []
+        self._seq = itertools.count()
+        self.now = -math.inf
+        self.counts = {}
+        # Core cell -> cluster id; a cell is core exactly when it is labelled.
+        self.label = {}
+        self.clusters = {}
+        self.alerts = collections.deque(maxlen=MAX_ALERTS)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clusters)
+
+    # Rows are cell_deg of latitude. Column width follows cos(latitude) per 1° band,
+    # so cells stay roughly square and neighbours across a band edge are found by position.
+
+    def _col_deg(self, row):
+        band = math.floor((row + 0.5) * self.cell_deg)
+        return self.cell_deg / max(math.cos(math.radians(band + 0.5)), 0.01)
+
+    def cells_of(self, lat, lng):
+        row = np.floor(lat / self.cell_deg).astype(np.int64)
+        band = np.floor((row + 0.5) * self.cell_deg)
+        col_deg = self.cell_deg / np.maximum(np.cos(np.radians(band + 0.5)), 0.01)
+        col = np.floor(lng / col_deg).astype(np.int64)
+        return (row << 32) + col + _COL_OFFSET
+
+    def _centre(self, cell):
+        row, col = cell >> 32, (cell & 0xffffffff) - _COL_OFFSET
+        return (row + 0.5) * self.cell_deg, (col + 0.5) * self._col_deg(row)
+
+    def _neighbours(self, cell):
+        row = cell >> 32
+        lng = self._centre(cell)[1]
+        for r in (row - 1, row, row + 1):
+            col = math.floor(lng / self._col_deg(r))
+            for c in (col - 1, col, col + 1):
+                n = (r << 32) + c + _COL_OFFSET
+                if n != cell:
+                    yield n
+
+    def update(self, tokens, lat, lng, timestamp):
+        """Move tourists to the cells of their new pings and refresh nearby clusters; returns new alerts."""
+        lat, lng, timestamp = (np.asarray(a, dtype=np.float64) for a in (lat, lng, timestamp))
+        ok = (np.abs(lat) <= 90) & (np.abs(lng) <= 180) & ~np.isnan(timestamp)
+        ok &= np.array([t is not None for t in tokens], dtype=bool)
+        idx = np.nonzero(ok)[0]
+        if not len(idx):
+            return []
+        # A ping from the future would otherwise expire everyone else.
+        timestamp = np.minimum(timestamp, self.clock() + self.max_skew)
+        idx = idx[np.argsort(timestamp[idx], kind='stable')]
+        cells = self.cells_of(lat[idx], lng[idx]).tolist()
+        times = timestamp[idx].tolist()
+        with self._lock:
+            dirty = set()
+            for i, cell, t in zip(idx.tolist(), cells, times):
+                token = tokens[i]
+                previous = self.tourists.get(token)
+                if previous is not None and previous[1] > t:
+                    continue
+                if previous is None or previous[0] != cell:
+                    if previous is not None:
+                        self._move(previous[0], -1, dirty)
+                    self._move(cell, 1, dirty)
+                self.tourists[token] = (cell, t)
+                heapq.heappush(self._expiry, (t, next(self._seq), token))
+            self.now = now = max(self.now, times[-1])
+            self._expire(now, dirty)
+            return self._refresh(dirty, now)
+
+    def _move(self, cell, delta, dirty):
+        count = self.counts.get(cell, 0) + delta
+        if count:
+            self.counts[cell] = count
+        else:
+            del self.counts[cell]
+        dirty.add(cell)
+
+    def _expire(self, now, dirty):
+        cutoff = now - self.window
+        expiry = self._expiry
+        while expiry and expiry[0][0] < cutoff:
+            t, _, token = heapq.heappop(expiry)
+            current = self.tourists.get(token)
+            if current is not None and current[1] == t:
+                del self.tourists[token]
+                self._move(current[0], -1, dirty)
+        # Tourists who ping often leave many stale entries; rebuild once they dominate.
+        if len(expiry) > 4 * len(self.tourists) + 1024:
+            self._expiry = [(t, next(self._seq), token) for token, (_, t) in self.tourists.items()]
+            heapq.heapify(self._expiry)
+
+    def _refresh(self, dirty, now):
+        flipped = [c for c in dirty if (self.counts.get(c, 0) >= self.min_points) != (c in self.label)]
+        touched = self._recluster(flipped, now) if flipped else set()
+        for cell in dirty:
+            if cell in self.label:
+                touched.add(self.label[cell])
+            elif self.label:
+                touched.update(self.label[n] for n in self._neighbours(cell) if n in self.label)
+        alerts = []
+        for cluster_id in touched:
+            cluster = self.clusters.get(cluster_id)
+            if cluster is not None:
+                self._measure(cluster, now)
+                alerts.extend(self._check(cluster, now))
+        return alerts
+
+    def _recluster(self, flipped, now):
+        """Rebuild the clusters around cells whose core status changed; returns the ids now present there."""
+        affected, seeds = set(), set()
+        for cell in flipped:
+            if cell in self.label:
+                affected.add(self.label[cell])
+            seeds.add(cell)
+            affected.update(self.label[n] for n in self._neighbours(cell) if n in self.label)
+        old = {}
+        for cluster_id in affected:
+            for cell in self.clusters[cluster_id].cells:
+                del self.label[cell]
+                old[cell] = cluster_id
+            seeds |= self.clusters[cluster_id].cells
+        seeds = {c for c in seeds if self.counts.get(c, 0) >= self.min_points}
+
+        # Connected components over the seed cells. Any core cell adjacent to one is a seed too.
+        components = []
+        while seeds:
+            stack = [seeds.pop()]
+            component = set(stack)
+            while stack:
+                for n in self._neighbours(stack.pop()):
+                    if n in seeds:
+                        seeds.discard(n)
+                        component.add(n)
+                        stack.append(n)
+            components.append(component)
+
+        # The largest piece of an old cluster keeps its id (and growth history); the rest are new.
+        previous = {cluster_id: self.clusters.pop(cluster_id) for cluster_id in affected}
+        touched = set()
+        for component in sorted(components, key=len, reverse=True):
+            overlap = collections.Counter(old[c] for c in component if c in old)
+            kept = next((cid for cid, _ in overlap.most_common() if cid in previous), None)
+            if kept is not None:
+                cluster = previous.pop(kept)
+                cluster.cells = component
+            else:
+                cluster = _Cluster(next(self._ids), component, now)
+            self.clusters[cluster.id] = cluster
+            for cell in component:
+                self.label[cell] = cluster.id
+            touched.add(cluster.id)
+        return touched
+
+    def _measure(self, cluster, now):
+        core = sum(self.counts[c] for c in cluster.cells)
+        border = {n for c in cluster.cells for n in self._neighbours(c) if n not in self.label and n in self.counts}
+        cluster.core_size = core
+        cluster.size = core + sum(self.counts[n] for n in border)
+        cluster.density = core / (len(cluster.cells) * self.cell_m ** 2)
+        lat = lng = 0.0
+        for cell in cluster.cells:
+            c_lat, c_lng = self._centre(cell)
+            lat += c_lat * self.counts[cell]
+            lng += c_lng * self.counts[cell]
+        cluster.lat, cluster.lng = lat / core, lng / core
+
+        samples = cluster.samples
+        samples.append((now, cluster.size))
+        while len(samples) > 2 and samples[1][0] <= now - self.growth_window:
+            samples.popleft()
+        # Growth only counts once the window is mostly covered, so a fresh cluster is not "growing" from zero.
+        t0, size0 = samples[0]
+        elapsed = now - t0
+        cluster.growth = (cluster.size - size0) * 60.0 / elapsed if elapsed >= self.growth_window / 2 else 0.0
+
+    def _check(self, cluster, now):
+        if cluster.size < self.min_size:
+            return []
+        alerts = []
+        for reason, value, limit in (('density', cluster.density, self.alert_density),
+                                     ('growth', cluster.growth, self.alert_growth)):
+            if value < limit or now - cluster.last_alert.get(reason, -math.inf) < self.cooldown:
+                continue
+            cluster.last_alert[reason] = now
+            alert = {'reason': reason, 'at': now, **cluster.to_dict()}
+            self.alerts.append(alert)
+            metrics.CROWD_ALERTS.inc(1, reason)
+            if self.on_alert is not None:
+                self.on_alert(alert)
+            alerts.append(alert)
+        return alerts
+
+    def snapshot(self, min_size=0):
+        """Current clusters, largest first."""
+        with self._lock:
+            found = [c.to_dict() for c in self.clusters.values() if c.size >= min_size]
+        return sorted(found, key=lambda c: c['size'], reverse=True)
+
+    def recent_alerts(self, since=None):
+        with self._lock:
+            return [a for a in self.alerts if since is None or a['at'] >= since]
+
+    def stats(self):
+        return {
+            'tourists': len(self.tourists),
+            'occupied_cells': len(self.counts),
+            'core_cells': len(self.label),
+            'clusters': len(self.clusters),
+            'alerts': len(self.alerts),
+        }
@@ -0,0 +1,344 @@
+import argparse
+import heapq
+import itertools
+import math
+import threading
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_M = 6371000.0
+
+SEVERITY = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
+# Priority points: one severity level outweighs a full anomaly score, and an
+# alert gains one severity level for every AGING_SECONDS it waits.
+SEVERITY_WEIGHT = 10.0
+ANOMALY_WEIGHT = 5.0
+AGING_SECONDS = 120.0
+
+# Grid cell edge in degrees (~5.5 km at the equator) for the available-unit index.
+UNIT_CELL_DEG = 0.05
+# Cells and units a nearest-unit ring search may visit before it asks the k-d tree instead.
+RING_CELLS = 256
+RING_UNITS = 32
+# New units checked one by one before the k-d tree is rebuilt (at least; sqrt(units) for big fleets).
+# Fleets this small skip the tree altogether.
+REBUILD_FRESH = 64
+
+
+def position(lat, lng):
+    """``(lat, lng)`` as floats; raises ValueError (TypeError for non-numbers) unless both are in range."""
+    lat, lng = float(lat), float(lng)
+    # NaN fails both comparisons.
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0):
+        raise ValueError(f'({lat}, {lng}) is not a valid position')
+    return lat, lng
+
+
+def _unit_vectors(points):
+    """``(lat, lng)`` pairs as points on the unit sphere; chord length orders them like great-circle distance."""
+    lat, lng = np.radians(np.asarray(points, dtype=np.float64)).T
+    return np.column_stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)])
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class Alert:
+    __slots__ = ('id', 'lat', 'lng', 'severity', 'anomaly_score', 'created_at', 'unit_id', 'assigned_at', 'payload')
+
+    def __init__(self, alert_id, lat, lng, severity, anomaly_score, created_at, payload=None):
+        self.id = alert_id
+        self.lat = lat
+        self.lng = lng
+        self.severity = severity
+        self.anomaly_score = anomaly_score
+        self.created_at = created_at
+        self.unit_id = None
+        self.assigned_at = None
+        self.payload = payload or {}
+
+    def priority(self):
+        # Aging adds (now - created_at) / AGING_SECONDS levels; "now" is common to every
+        # queued alert, so ranking by this static key is the same as ranking by the aged one.
+        return (SEVERITY_WEIGHT * (self.severity - self.created_at / AGING_SECONDS)
+                + ANOMALY_WEIGHT * self.anomaly_score)
+
+    def to_dict(self):
+        return {
+            'alert_id': self.id,
+            'lat': self.lat,
+            'lng': self.lng,
+            'severity': self.severity,
+            'anomaly_score': self.anomaly_score,
+            'created_at': self.created_at,
+            'unit_id': self.unit_id,
+            'assigned_at': self.assigned_at,
+        }
+
+
+class UnitGrid:
+    """Available responder units bucketed by grid cell, with O(1) add and remove.
+
+    ``nearest`` searches rings of cells outward from the query point and stops
+    once no unsearched cell can hold anything closer. When that would visit more
+    than ``RING_CELLS`` cells or ``RING_UNITS`` units (units are sparse, far away
+    or packed into a few cells) it asks a k-d tree over points on the unit sphere
+    instead. The tree is rebuilt lazily: removed units stay in it as tombstones
+    and new ones wait in a short list until either grows too large, so no query
+    ever scans the fleet.
+    """
+
+    def __init__(self, cell_deg=UNIT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self.units = {}
+        self._tree = None
+        self._ids = []
+        # unit_id -> tree row for units still available where the tree has them;
+        # other rows are tombstones. Units added since the last build wait in _fresh.
+        self._rows = {}
+        self._fresh = set()
+
+    def __len__(self):
+        return len(self.units)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    def add(self, unit_id, lat, lng):
+        cell = self._cell(lat, lng)
+        self.units[unit_id] = (lat, lng, cell)
+        self.cells.setdefault(cell, set()).add(unit_id)
+        self._fresh.add(unit_id)
+
+    def remove(self, unit_id):
+        _, _, cell = self.units.pop(unit_id)
+        members = self.cells[cell]
+        members.discard(unit_id)
+        if not members:
+            del self.cells[cell]
+        self._rows.pop(unit_id, None)
+        self._fresh.discard(unit_id)
+
+    def nearest(self, lat, lng):
+        if not self.units:
+            return None, None
+        cy, cx = self._cell(lat, lng)
+        # A ring r cells out is at least (r - 1) cells away; shrink the longitude
+        # step by cos(lat) so the bound stays valid away from the equator.
+        cell_m = self.cell_deg * math.pi / 180.0 * EARTH_RADIUS_M * max(math.cos(math.radians(abs(lat) + self.cell_deg)), 0.01)
+        best_id, best_d = None, math.inf
+        visited = examined = 0
+        r = 0
+        while (r - 1) * cell_m < best_d:
+            visited += 8 * r or 1
+            if visited > min(len(self.units), RING_CELLS):
+                return self._far(lat, lng)
+            for dy in range(-r, r + 1):
+                step = 1 if abs(dy) == r else 2 * r
+                for dx in range(-r, r + 1, step or 1):
+                    members = self.cells.get((cy + dy, cx + dx), ())
+                    examined += len(members)
+                    if examined > RING_UNITS:
+                        return self._far(lat, lng)
+                    unit_id, d = self._closest(members, lat, lng)
+                    if d < best_d:
+                        best_id, best_d = unit_id, d
+            r += 1
+        return best_id, best_d
+
+    def _closest(self, unit_ids, lat, lng):
+        best_id, best_d = None, math.inf
+        for unit_id in unit_ids:
+            u_lat, u_lng, _ = self.units[unit_id]
+            d = _haversine(lat, lng, u_lat, u_lng)
+            if d < best_d:
+                best_id, best_d = unit_id, d
+        return best_id, best_d
+
+    def _build(self):
+        self._ids = list(self.units)
+        self._tree = cKDTree(_unit_vectors([self.units[unit_id][:2] for unit_id in self._ids]))
+        self._rows = {unit_id: row for row, unit_id in enumerate(self._ids)}
+        self._fresh = set()
+
+    def _far(self, lat, lng):
+        if len(self.units) <= REBUILD_FRESH:
+            return self._closest(self.units, lat, lng)
+        # Tombstones slow queries down and fresh units are checked one by one, so
+        # rebuild once either outweighs the tree's live rows or sqrt(units).
+        if (self._tree is None or len(self._ids) - len(self._rows) > len(self._rows)
+                or len(self._fresh) > max(REBUILD_FRESH, math.isqrt(len(self.units)))):
+            self._build()
+        best_id, best_d = self._closest(self._fresh, lat, lng)
+        point = _unit_vectors([(lat, lng)])[0]
+        k = 1
+        while self._rows:
+            k = min(k, len(self._ids))
+            chord, idx = self._tree.query(point, k=k)
+            for c, row in zip(np.atleast_1d(chord).tolist(), np.atleast_1d(idx).tolist()):
+                unit_id = self._ids[row]
+                if self._rows.get(unit_id) == row:
+                    d = 2 * EARTH_RADIUS_M * math.asin(min(c / 2, 1.0))
+                    if d < best_d:
+                        best_id, best_d = unit_id, d
+                    return best_id, best_d
+            # Every row returned was a tombstone; look further out.
+            k *= 4
+        return best_id, best_d
+
+
+class DispatchEngine:
+    """Priority queue of SOS alerts matched to the nearest available responder.
+
+    Alerts wait in a heap keyed by severity, anomaly score and age. Whenever an
+    alert arrives or a unit is released, the highest-priority alerts are paired
+    with their nearest available unit until one side runs out.
+    """
+
+    def __init__(self, cell_deg=UNIT_CELL_DEG, clock=time.time):
+        self.clock = clock
+        self.available = UnitGrid(cell_deg)
+        self.units = {}
+        self.alerts = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.assigned_total = 0
+
+    def upsert_unit(self, unit_id, lat, lng, kind='police', available=True):
+        lat, lng = position(lat, lng)
+        with self._lock:
+            if unit_id in self.available.units:
+                self.available.remove(unit_id)
+            unit = self.units.setdefault(unit_id, {'unit_id': unit_id, 'alert_id': None})
+            unit.update(lat=lat, lng=lng, type=kind)
+            if available and unit['alert_id'] is None:
+                self.available.add(unit_id, lat, lng)
+            return self._drain()
+
+    def submit(self, lat, lng, severity='high', anomaly_score=0.0, alert_id=None, payload=None):
+        """Queue an alert and run assignment; returns the alert.
+
+        Submitting a known ``alert_id`` again (a client retry) returns the existing alert unchanged.
+        """
+        if isinstance(severity, str):
+            severity = SEVERITY.get(severity.lower(), SEVERITY['high'])
+        lat, lng = position(lat, lng)
+        with self._lock:
+            if alert_id is not None and alert_id in self.alerts:
+                return self.alerts[alert_id]
+            while alert_id is None or alert_id in self.alerts:
+                alert_id = f'SOS-{next(self._seq)}'
+            alert = Alert(alert_id, lat, lng, int(severity), float(anomaly_score), self.clock(), payload)
+            self.alerts[alert_id] = alert
+            heapq.heappush(self._queue, (-alert.priority(), next(self._seq), alert_id))
+            self._drain()
+            return alert
+
+    def release(self, unit_id, lat=None, lng=None):
+        """Mark a unit free (optionally at a new position) and rebalance the queue.
+
+        Returns the assignments made as a list of ``(alert, unit_id)``. A bad position
+        raises before anything changes.
+        """
+        moved = lat is not None or lng is not None
+        if moved:
+            lat, lng = position(lat, lng)
+        with self._lock:
+            unit = self.units[unit_id]
+            if unit['alert_id'] is not None:
+                self.alerts.pop(unit['alert_id'], None)
+                unit['alert_id'] = None
+            if moved:
+                unit.update(lat=lat, lng=lng)
+            if unit_id not in self.available.units:
+                self.available.add(unit_id, unit['lat'], unit['lng'])
+            return self._drain()
+
+    def _drain(self):
+        assignments = []
+        while self._queue and len(self.available):
+            _, _, alert_id = heapq.heappop(self._queue)
+            alert = self.alerts.get(alert_id)
+            if alert is None:
+                continue
+            unit_id, _ = self.available.nearest(alert.lat, alert.lng)
+            self.available.remove(unit_id)
+            self.units[unit_id]['alert_id'] = alert_id
+            alert.unit_id = unit_id
+            alert.assigned_at = self.clock()
+            self.assigned_total += 1
+            assignments.append((alert, unit_id))
+        return assignments
+
+    def status(self):
+        with self._lock:
+            return {
+                'queued': len(self._queue),
+                'units': len(self.units),
+                'available_units': len(self.available),
+                'assigned_total': self.assigned_total,
+            }
+
+
+def self_test(alerts=10000, units=500, seed=7):
+    """Replay a burst of simultaneous alerts, then release units until the queue is empty.
+
+    Checks that every alert is served exactly once and that alerts taken from
+    the queue come out in priority order.
+    """
+    import random
+    rng = random.Random(seed)
+    engine = DispatchEngine()
+    for i in range(units):
+        engine.upsert_unit(f'U{i}', rng.uniform(9.5, 10.5), rng.uniform(76.0, 77.0))
+
+    started = time.perf_counter()
+    for i in range(alerts):
+        engine.submit(rng.uniform(9.5, 10.5), rng.uniform(76.0, 77.0),
+                      severity=rng.randint(1, 4), anomaly_score=rng.random(), alert_id=f'A{i}')
+    submitted = time.perf_counter()
+
+    served = {a.id for a in engine.alerts.values() if a.unit_id is not None}
+    queued_order = []
+    busy = [u['unit_id'] for u in engine.units.values() if u['alert_id'] is not None]
+    while busy:
+        released = []
+        for unit_id in busy:
+            for alert, new_unit in engine.release(unit_id):
+                queued_order.append(alert)
+                served.add(alert.id)
+                released.append(new_unit)
+        busy = released
+    finished = time.perf_counter()
+
+    priorities = [a.priority() for a in queued_order]
+    assert len(served) == alerts, f'{alerts - len(served)} alerts never served'
+    assert all(a >= b for a, b in zip(priorities, priorities[1:])), 'queued alerts served out of priority order'
+    return {
+        'alerts': alerts,
+        'units': units,
+        'submit_seconds': round(submitted - started, 4),
+        'drain_seconds': round(finished - submitted, 4),
+        'assignments_per_second': round(alerts / (finished - started), 1),
+        'status': engine.status(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SOS dispatch engine')
+    parser.add_argument('--self-test', action='store_true', help='replay a burst of simultaneous alerts')
+    parser.add_argument('--alerts', type=int, default=10000)
+    parser.add_argument('--units', type=int, default=500)
+    args = parser.parse_args()
+    if args.self_test:
+        for key, value in self_test(args.alerts, args.units).items():
+            print(f'{key}: {value}')
+    else:
+        parser.print_help()
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from kinematics import EARTH_RADIUS_M
+
+FACILITIES_PATH = os.getenv('FACILITIES_PATH', 'data/facilities.json')
+
+ALL_TYPES = 'all'
+
+
+class _Snapshot:
+    """One immutable generation of the index: a BallTree per facility type plus one over all."""
+
+    def __init__(self, facilities):
+        self.facilities = facilities
+        self.trees = {}
+        self.members = {}
+        groups = {ALL_TYPES: list(range(len(facilities)))}
+        for i, facility in enumerate(facilities):
+            groups.setdefault(facility['type'], []).append(i)
+        for kind, members in groups.items():
+            if not members:
+                continue
+            coords = np.radians([[facilities[i]['lat'], facilities[i]['lng']] for i in members])
+            self.trees[kind] = BallTree(coords, metric='haversine')
+            self.members[kind] = np.array(members)
+
+
+class FacilityIndex:
+    """Nearest-facility lookups over haversine distance, grouped by facility type.
+
+    ``reload`` builds a complete new snapshot before swapping a single reference,
+    so queries never block and always see one consistent generation.
+    """
+
+    def __init__(self, facilities=()):
+        self._snapshot = _Snapshot(list(facilities))
+        self._reload_lock = threading.Lock()
+        self.generation = 0
+
+    def __len__(self):
+        return len(self._snapshot.facilities)
+
+    def types(self):
+        return sorted(kind for kind in self._snapshot.trees if kind != ALL_TYPES)
+
+    def reload(self, facilities):
+        snapshot = _Snapshot(list(facilities))
+        with self._reload_lock:
+            self._snapshot = snapshot
+            self.generation += 1
+
+    def _tree(self, snapshot, kind):
+        tree = snapshot.trees.get(kind or ALL_TYPES)
+        if tree is None:
+            return None, None
+        return tree, snapshot.members[kind or ALL_TYPES]
+
+    def nearest(self, lat, lng, kind=None, k=3):
+        """k nearest facilities per point; ``lat``/``lng`` are scalars or equal-length arrays.
+
+        Returns one list of ``(facility, distance_m)`` per point.
+        """
+        snapshot = self._snapshot
+        points = np.radians(np.column_stack([np.atleast_1d(lat), np.atleast_1d(lng)]))
+        tree, members = self._tree(snapshot, kind)
+        if tree is None:
+            return [[] for _ in range(len(points))]
+        dist, idx = tree.query(points, k=min(k, len(members)))
+        return [
+            [(snapshot.facilities[members[j]], d * EARTH_RADIUS_M) for d, j in zip(row_d, row_i)]
+            for row_d, row_i in zip(dist.tolist(), idx.tolist())
+        ]
+
+    def within(self, lat, lng, radius_m, kind=None):
+        """Facilities within ``radius_m`` of each point, closest first."""
+        snapshot = self._snapshot
+        points = np.radians(np.column_stack([np.atleast_1d(lat), np.atleast_1d(lng)]))
+        tree, members = self._tree(snapshot, kind)
+        if tree is None:
+            return [[] for _ in range(len(points))]
+        idx, dist = tree.query_radius(points, r=radius_m / EARTH_RADIUS_M, return_distance=True, sort_results=True)
+        return [
+            [(snapshot.facilities[members[j]], d * EARTH_RADIUS_M) for d, j in zip(row_d.tolist(), row_i.tolist())]
+            for row_d, row_i in zip(dist, idx)
+        ]
+
+
+def parse_facilities(data):
+    """Facilities from a JSON list of ``{id, name, type, lat, lng}`` or a GeoJSON point collection."""
+    if isinstance(data, dict):
+        data = [
+            dict(feature.get('properties') or {}, id=feature.get('id', (feature.get('properties') or {}).get('id')),
+                 lng=feature['geometry']['coordinates'][0], lat=feature['geometry']['coordinates'][1])
+            for feature in data.get('features', [])
+            if (feature.get('geometry') or {}).get('type') == 'Point'
+        ]
+    facilities = []
+    for n, item in enumerate(data):
+        facilities.append(dict(
+            item,
+            id=item.get('id') or f'facility-{n}',
+            type=item.get('type', 'other'),
+            lat=float(item['lat']),
+            lng=float(item['lng']),
+        ))
+    return facilities
+
+
+def read_facilities(path=FACILITIES_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return parse_facilities(json.load(f))
@@ -0,0 +1,81 @@
+# Production server for the AI service: gunicorn -c gunicorn.conf.py app:app
+import gc
+import itertools
+import multiprocessing
+import os
+
+import admission
+import hub
+import sharding
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('AI_WORKERS', multiprocessing.cpu_count()))
+# gthread workers heartbeat from their main loop while request threads run, so a long streamed
+# /api/ai/ingest upload is not killed by `timeout`; AI_THREADS=1 gives sync workers, which are.
+# Admission waiters each hold a thread, so there are enough for them all plus the critical slots.
+threads = admission.AdmissionController().threads_needed() if admission.AI_THREADS > 1 else 1
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Import app.py (and so load and warm the model) once in the master before forking,
+# so every worker shares the model pages copy-on-write.
+preload_app = True
+
+# SIGTERM drains: workers stop accepting, finish in-flight requests, then exit.
+graceful_timeout = int(os.getenv('AI_GRACEFUL_TIMEOUT', 30))
+timeout = int(os.getenv('AI_WORKER_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth from per-process state.
+max_requests = int(os.getenv('AI_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+
+
+def worker_exit(server, worker):
+    # Flush buffered location history and hand tourist state to the remaining workers
+    # before the worker goes away.
+    import app
+    if app.history is not None:
+        app.history.close()
+    if sharding.SHARD_DIR:
+        app.scorer.drain()
+
+
+def _publish_members(server, extra=()):
+    if sharding.SHARD_DIR and not sharding.SHARD_LISTEN:
+        indices = {w.shard_index for w in server.WORKERS.values() if hasattr(w, 'shard_index')}
+        sharding.write_members(indices | set(extra))
+
+
+def when_ready(server):
+    # Workers forked from here share one copy of host-wide state (SOS dispatch) through the hub.
+    if server.cfg.workers > 1:
+        import app
+        hub.start(app.shared_state())
+
+
+def on_exit(server):
+    hub.stop()
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far into the permanent generation so the cyclic
+    # GC in workers never touches (and un-shares) the preloaded model's pages.
+    gc.freeze()
+    # Workers get the lowest free shard index, so a replacement takes over its predecessor's slot.
+    used = {getattr(w, 'shard_index', None) for w in server.WORKERS.values()}
+    worker.shard_index = next(i for i in itertools.count() if i not in used)
+    _publish_members(server, [worker.shard_index])
+
+
+def post_fork(server, worker):
+    import app
+    if hub.running():
+        app.use_hub(hub.connect())
+    if sharding.SHARD_DIR:
+        app.scorer.start(worker.shard_index)
+
+
+def child_exit(server, worker):
+    _publish_members(server)
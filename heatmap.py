@@ -0,0 +1,145 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+# Each tile costs 16 KB, so very high zooms over wide areas get expensive.
+HEATMAP_ZOOMS = tuple(int(z) for z in os.getenv('HEATMAP_ZOOMS', '10,12,14').split(','))
+HEATMAP_HALF_LIFE = float(os.getenv('HEATMAP_HALF_LIFE', 10 * 60))
+# Served tiles only change once per step, so polling inside a step is a 304.
+HEATMAP_DECAY_STEP = float(os.getenv('HEATMAP_DECAY_STEP', 30))
+# Pings dated further ahead of the server clock than this are counted as now.
+HEATMAP_MAX_SKEW = float(os.getenv('HEATMAP_MAX_SKEW', 60))
+TILE_BINS = 64
+
+MAX_MERCATOR_LAT = 85.05112878
+# Tiles whose decayed peak falls below this are dropped when the grids are rebased.
+PRUNE_BELOW = 1e-3
+
+
+def mercator(lat, lng):
+    """Normalized Web Mercator coordinates in [0, 1)."""
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(lng) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return np.clip(x, 0.0, 1.0 - 1e-12), np.clip(y, 0.0, 1.0 - 1e-12)
+
+
+class _ZoomLevel:
+    """All tiles of one zoom level stacked in a single (tiles, bins, bins) array."""
+
+    def __init__(self, zoom, capacity=64):
+        self.zoom = zoom
+        self.index = {}
+        self.free = []
+        self.grids = np.zeros((capacity, TILE_BINS, TILE_BINS), dtype=np.float32)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        # key -> (next version, epoch) of tiles pruned at the last rebase, so a tile that comes
+        # back within the same decay step never reuses an ETag. Later epochs cannot collide.
+        self.retired = {}
+
+    def slots_for(self, keys):
+        slots = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys.tolist()):
+            slot = self.index.get(key)
+            if slot is None:
+                slot = self.free.pop() if self.free else len(self.index)
+                if slot >= len(self.grids):
+                    self.grids = np.concatenate([self.grids, np.zeros_like(self.grids)])
+                    self.versions = np.concatenate([self.versions, np.zeros_like(self.versions)])
+                self.grids[slot] = 0.0
+                self.versions[slot] = self.retired.pop(key, (0, None))[0]
+                self.index[key] = slot
+            slots[i] = slot
+        return slots
+
+
+class HeatmapGrid:
+    """Time-decayed ping density in 64x64-bin tiles at several zoom levels.
+
+    Uses forward decay: a ping at time t adds exp(rate * (t - base)), and reads
+    scale by exp(-rate * (now - base)), so decay never touches stored tiles.
+    When the growth factor gets large every tile is rescaled once and ``base``
+    moves forward. Each tile carries a version bumped on every write, which,
+    with the decay step, makes up its ETag.
+    """
+
+    def __init__(self, zooms=HEATMAP_ZOOMS, half_life=HEATMAP_HALF_LIFE, decay_step=HEATMAP_DECAY_STEP,
+                 max_skew=HEATMAP_MAX_SKEW, clock=time.time):
+        self.zooms = tuple(sorted(zooms))
+        self.rate = math.log(2.0) / half_life
+        self.decay_step = decay_step
+        self.max_skew = max_skew
+        self.clock = clock
+        self.base = clock()
+        self.levels = {z: _ZoomLevel(z) for z in self.zooms}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(level.index) for level in self.levels.values())
+
+    def add(self, lat, lng, timestamp, weight=1.0):
+        lat, lng, timestamp = (np.asarray(a, dtype=np.float64) for a in (lat, lng, timestamp))
+        ok = (np.abs(lat) <= 90) & (np.abs(lng) <= 180) & ~np.isnan(timestamp)
+        if not ok.any():
+            return
+        # Client clocks drive the decay base, so a ping from the future must not rebase every tile to it.
+        timestamp = np.minimum(timestamp, self.clock() + self.max_skew)
+        x, y = mercator(lat[ok], lng[ok])
+        with self._lock:
+            if self.rate * (timestamp[ok].max() - self.base) > 20:
+                self._rebase(float(timestamp[ok].max()))
+            w = (weight * np.exp(self.rate * (timestamp[ok] - self.base))).astype(np.float32)
+            for z, level in self.levels.items():
+                scale = (1 << z) * TILE_BINS
+                px = (x * scale).astype(np.int64)
+                py = (y * scale).astype(np.int64)
+                tile_keys = (px // TILE_BINS) * (1 << z) + py // TILE_BINS
+                unique_keys, inverse = np.unique(tile_keys, return_inverse=True)
+                slots = level.slots_for(unique_keys)
+                np.add.at(level.grids, (slots[inverse], py % TILE_BINS, px % TILE_BINS), w)
+                level.versions[slots] += 1
+
+    def _rebase(self, now):
+        factor = np.float32(math.exp(-self.rate * (now - self.base)))
+        epoch = self.epoch()
+        for level in self.levels.values():
+            level.grids *= factor
+            peaks = level.grids.max(axis=(1, 2))
+            # ETags carry the epoch, so versions retired in an earlier one are safe to forget.
+            level.retired = {key: kept for key, kept in level.retired.items() if kept[1] == epoch}
+            for key, slot in list(level.index.items()):
+                if peaks[slot] < PRUNE_BELOW:
+                    del level.index[key]
+                    level.free.append(slot)
+                    level.retired[key] = (int(level.versions[slot]) + 1, epoch)
+        self.base = now
+
+    def epoch(self, now=None):
+        return int((self.clock() if now is None else now) // self.decay_step)
+
+    def contains(self, z, x, y):
+        return z in self.levels and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+    def etag(self, z, x, y, now=None):
+        level = self.levels[z]
+        key = x * (1 << z) + y
+        slot = level.index.get(key)
+        epoch = self.epoch(now)
+        if slot is not None:
+            version = int(level.versions[slot])
+        else:
+            version, retired_in = level.retired.get(key, (0, None))
+            version = version if retired_in == epoch else 0
+        return f'{z}-{x}-{y}-{version}-{epoch}'
+
+    def tile(self, z, x, y, now=None):
+        """Decayed density for one tile as seen at the start of the current decay step."""
+        as_of = self.epoch(now) * self.decay_step
+        with self._lock:
+            slot = self.levels[z].index.get(x * (1 << z) + y)
+            if slot is None:
+                return None
+            return self.levels[z].grids[slot] * np.float32(math.exp(-self.rate * (as_of - self.base)))
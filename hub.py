@@ -0,0 +1,92 @@
+"""State that must exist once per host, served to every gunicorn worker.
+
+gunicorn spreads requests over ``AI_WORKERS`` processes, so anything a worker
+keeps to itself only sees that worker's share of the traffic: a responder unit
+registered through one worker would be unknown to the others, a crowd split
+across workers would be too small to see, each worker would serve different
+heatmap tiles under its own ETags, and a tourist whose pings land on another
+worker would look silent. With more than one worker the master starts a hub
+process (``when_ready`` in gunicorn.conf.py) that owns the single copy of such
+objects, and each worker swaps its own copy for a proxy that forwards every
+call to the hub over a Unix socket (``multiprocessing.managers``). A
+single-process server (``python app.py``, ``uvicorn asgi:app``) never starts a
+hub and keeps the objects in process.
+"""
+import functools
+import os
+import signal
+from multiprocessing.managers import BaseManager
+
+# Methods each shared object answers through its proxy; nothing else is reachable.
+EXPOSED = {
+    'dispatcher': ('upsert_unit', 'submit', 'release', 'status'),
+    'crowds': ('update', 'snapshot', 'recent_alerts', 'stats', '__len__'),
+    'heatmap': ('add', 'contains', 'etag', 'tile', '__len__'),
+    'watchdog': ('update', 'overdue', 'recent_events', 'forget_token', 'stats', '__len__'),
+}
+
+# Handlers gunicorn installs in the master; the hub is forked from it and must not inherit them.
+MASTER_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1', 'SIGUSR2', 'SIGWINCH', 'SIGTTIN',
+                  'SIGTTOU', 'SIGCHLD')
+
+_served = {}
+# The master keeps the server (and so the socket file) alive; the hub process serves from it.
+_server = None
+_pid = None
+_authkey = os.urandom(32)
+
+
+class _Hub(BaseManager):
+    pass
+
+
+def _serve(name):
+    return _served[name]
+
+
+def start(objects):
+    """Serve ``objects`` (name -> object) from a new hub process; call once, before workers fork.
+
+    The hub is forked, so it starts from the objects as they are now. Its socket is
+    bound first, so workers can connect as soon as they exist.
+    """
+    global _server, _pid
+    _served.update(objects)
+    for name in objects:
+        _Hub.register(name, callable=functools.partial(_serve, name), exposed=EXPOSED[name])
+    server = _Hub(authkey=_authkey).get_server()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for name in MASTER_SIGNALS:
+                signal.signal(getattr(signal, name), signal.SIG_DFL)
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    _server, _pid = server, pid
+    return server.address
+
+
+def running():
+    return _pid is not None
+
+
+def connect():
+    """Proxies for every object the hub serves, by name; call in each worker after fork."""
+    client = _Hub(address=_server.address, authkey=_authkey)
+    client.connect()
+    return {name: getattr(client, name)() for name in _served}
+
+
+def stop():
+    """Stop the hub; called by the process that started it."""
+    global _server, _pid
+    if _pid is None:
+        return
+    try:
+        os.kill(_pid, signal.SIGTERM)
+        os.waitpid(_pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+    _server = _pid = None
+    _served.clear()
@@ -0,0 +1,93 @@
+import json
+from itertools import islice
+
+import wire
+
+MAX_LINE_BYTES = 64 * 1024
+
+
+def iter_lines(stream, max_line_bytes=MAX_LINE_BYTES):
+    """Yield raw lines from a binary stream without ever buffering more than one line.
+
+    Lines longer than ``max_line_bytes`` are drained and yielded as ``None``.
+    """
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            while True:
+                rest = stream.readline(max_line_bytes)
+                if not rest or rest.endswith(b'\n'):
+                    break
+            yield None
+        else:
+            yield line
+
+
+def parse_pings(lines):
+    """Yield ``(line_no, record, error)`` for each non-blank NDJSON line."""
+    for line_no, line in enumerate(lines, start=1):
+        if line is None:
+            yield line_no, None, 'line too long'
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None, 'invalid JSON'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'expected a JSON object'
+            continue
+        yield line_no, record, None
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def score_stream(stream, scorer, chunk_size=500):
+    """Score an NDJSON ping stream chunk by chunk, yielding one NDJSON result line per ping."""
+    for chunk in chunked(parse_pings(iter_lines(stream)), chunk_size):
+        valid = [(line_no, record) for line_no, record, error in chunk if error is None]
+        try:
+            results = iter(scorer.score_records([record for _, record in valid]))
+        except ValueError:
+            # One bad record should not reject its neighbours; fall back to per-ping scoring.
+            results = iter(_score_each([record for _, record in valid], scorer))
+        for line_no, record, error in chunk:
+            result = {'line': line_no, 'error': error} if error else dict(next(results), line=line_no)
+            yield json.dumps(result) + '\n'
+
+
+def _score_each(records, scorer):
+    for record in records:
+        try:
+            yield scorer.score_records([record])[0]
+        except ValueError as e:
+            yield {'token_id': record.get('token_id'), 'error': str(e)}
+
+
+def score_frames(stream, scorer, max_rows):
+    """Score a stream of binary ping frames, yielding one result frame per input frame.
+
+    A malformed frame ends the stream with an error frame, since framing cannot resume after it.
+    """
+    frames = wire.read_frames(stream, max_rows)
+    while True:
+        try:
+            cols = next(frames)
+            cols, scores = scorer.score(cols)
+        except StopIteration:
+            return
+        except ValueError as e:
+            yield wire.encode_error(e)
+            return
+        yield wire.encode_results(cols, scores, scorer.zones.ids if scorer.zones is not None else [None])
@@ -0,0 +1,183 @@
+"""Vectorized distance, speed and heading features for batches of pings.
+
+Everything here works on whole arrays: pings are grouped by tourist and
+ordered by time with one lexsort, and consecutive-ping quantities come from
+shifted views of the sorted arrays, with no Python loop over pings.
+
+    python kinematics.py --bench [--pings 1000000] [--tourists 10000]
+"""
+import argparse
+import time
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bearing(lat1, lng1, lat2, lng2):
+    """Initial bearing in degrees clockwise from north, in [0, 360)."""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    y = np.sin(lng2 - lng1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(lng2 - lng1)
+    return np.mod(np.degrees(np.arctan2(y, x)), 360.0)
+
+
+def turn_angle(heading1, heading2):
+    """Absolute change between two bearings, in [0, 180]."""
+    return np.abs(np.mod(heading2 - heading1 + 180.0, 360.0) - 180.0)
+
+
+def steps_between(prev_lat, prev_lng, prev_t, lat, lng, t):
+    """Distance, time step, speed and bearing from each previous ping to the next; speed is 0 when dt <= 0."""
+    dist = haversine(prev_lat, prev_lng, lat, lng)
+    dt = t - prev_t
+    speed = np.where(dt > 0, dist / np.where(dt > 0, dt, 1.0), 0.0)
+    return dist, dt, speed, bearing(prev_lat, prev_lng, lat, lng)
+
+
+def turns_since_move(heading, moving, track_start, carried=np.nan):
+    """Turn of each moving step against the last earlier moving step of its track (0 while standing still).
+
+    Pings are grouped by track and in time order; ``track_start`` is each ping's
+    track's first index. A track with no earlier moving step turns against
+    ``carried``, its heading from before these pings (NaN for none, giving 0).
+    Also returns, per ping, the index of the last moving step up to it (-1 for none).
+    """
+    idx = np.arange(len(heading))
+    moved_at = np.maximum.accumulate(np.where(moving, idx, -1))
+    before = np.r_[-1, moved_at][:-1]
+    last = np.where(before >= track_start, heading[np.maximum(before, 0)], carried)
+    return np.where(moving & ~np.isnan(last), turn_angle(last, heading), 0.0), moved_at
+
+
+def track_codes(token_id):
+    """Small integer per distinct tourist; integer token arrays are used as they are."""
+    token_id = np.asarray(token_id)
+    if token_id.dtype.kind in 'iu':
+        return token_id
+    # Interning through a dict hashes each token once, far cheaper than sorting strings.
+    index = {}
+    return np.fromiter((index.setdefault(t, len(index)) for t in token_id.tolist()), dtype=np.int64,
+                       count=len(token_id))
+
+
+def group_by_track(token_id, timestamp):
+    """Sort order grouping pings by tourist, oldest first, plus a first-of-track mask in that order."""
+    codes = track_codes(token_id)
+    # Two stable passes (time, then tourist) beat one lexsort on the pair.
+    order = np.argsort(timestamp, kind='stable')
+    order = order[np.argsort(codes[order], kind='stable')]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = codes[order][1:] != codes[order][:-1]
+    return order, first
+
+
+def _sorted_steps(order, first, timestamp, lat, lng, moved_m):
+    t, y, x = timestamp[order], lat[order], lng[order]
+    n = len(order)
+    dist, dt, speed, heading = (np.full(n, np.nan) for _ in range(4))
+    if n > 1:
+        dist[1:], dt[1:], speed[1:], heading[1:] = steps_between(y[:-1], x[:-1], t[:-1], y[1:], x[1:], t[1:])
+    dist[first] = dt[first] = speed[first] = heading[first] = np.nan
+
+    # Turn against the last step that actually moved, looked up within the same track.
+    track_start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+    turn, _ = turns_since_move(heading, dist > moved_m, track_start)
+    turn[first] = np.nan
+    return {'distance': dist, 'dt': dt, 'speed': speed, 'bearing': heading, 'turn': turn}, track_start
+
+
+def _unsort(order, values):
+    out = np.empty(len(order))
+    out[order] = values
+    return out
+
+
+def step_kinematics(token_id, timestamp, lat, lng, moved_m=1.0):
+    """Per-ping distance, time step, speed, bearing and turn relative to the tourist's previous ping.
+
+    Results are in input order. A tourist's first ping in the batch gets NaN.
+    A turn is measured against the last step longer than ``moved_m`` (0 while
+    standing still), like the live trajectory store does.
+    """
+    timestamp, lat, lng = (np.asarray(a, dtype=np.float64) for a in (timestamp, lat, lng))
+    order, first = group_by_track(token_id, timestamp)
+    steps, _ = _sorted_steps(order, first, timestamp, lat, lng, moved_m)
+    return {name: _unsort(order, values) for name, values in steps.items()}
+
+
+def rolling_track_features(token_id, timestamp, lat, lng, window=16):
+    """Trailing-window track features per ping over a recorded batch, in input order.
+
+    ``mean_speed``, ``speed_std`` and ``mean_turn`` cover the last ``window``
+    pings of the same tourist up to and including each one, the same window
+    ``TrajectoryStore`` reports, computed from per-track cumulative sums.
+    """
+    timestamp, lat, lng = (np.asarray(a, dtype=np.float64) for a in (timestamp, lat, lng))
+    order, first = group_by_track(token_id, timestamp)
+    steps, track_start = _sorted_steps(order, first, timestamp, lat, lng, 1.0)
+    speed, turn = steps['speed'], steps['turn']
+    valid = ~np.isnan(speed)
+    idx = np.arange(len(order))
+    lo = np.maximum(idx - window + 1, track_start)
+
+    def window_sum(values):
+        c = np.r_[0.0, np.cumsum(np.where(valid, values, 0.0))]
+        return c[idx + 1] - c[lo]
+
+    samples = np.maximum(window_sum(np.ones(len(order))), 1.0)
+    mean = window_sum(speed) / samples
+    std = np.sqrt(np.maximum(window_sum(speed * speed) / samples - mean * mean, 0.0))
+    return {
+        'track_speed': _unsort(order, speed),
+        'mean_speed': _unsort(order, mean),
+        'speed_std': _unsort(order, std),
+        'mean_turn': _unsort(order, window_sum(turn) / samples),
+    }
+
+
+def bench(pings=1_000_000, tourists=10_000, repeat=3, seed=0):
+    """Per-ping cost of the kernels over one shuffled batch of many interleaved tracks."""
+    rng = np.random.default_rng(seed)
+    token = rng.integers(0, tourists, pings)
+    timestamp = 1.7e9 + rng.uniform(0, 86400, pings)
+    lat = 10.0 + rng.normal(0, 0.05, pings)
+    lng = 76.3 + rng.normal(0, 0.05, pings)
+    token_id = np.array([f'T{i}' for i in range(tourists)], dtype=object)[token]
+
+    results = {}
+    for name, fn in (
+        ('haversine', lambda: haversine(lat[:-1], lng[:-1], lat[1:], lng[1:])),
+        ('group_by_track', lambda: group_by_track(token_id, timestamp)),
+        ('step_kinematics', lambda: step_kinematics(token_id, timestamp, lat, lng)),
+        ('rolling_track_features', lambda: rolling_track_features(token_id, timestamp, lat, lng)),
+    ):
+        best = min(_timed(fn) for _ in range(repeat))
+        results[name] = {'seconds': round(best, 4), 'ns_per_ping': round(best / pings * 1e9, 1)}
+    return results
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched haversine/kinematics kernels')
+    parser.add_argument('--bench', action='store_true', help='time the kernels on a synthetic batch')
+    parser.add_argument('--pings', type=int, default=1_000_000)
+    parser.add_argument('--tourists', type=int, default=10_000)
+    args = parser.parse_args()
+    if args.bench:
+        for name, result in bench(args.pings, args.tourists).items():
+            print(f'{name}: {result}')
+    else:
+        parser.print_help()
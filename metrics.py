@@ -0,0 +1,153 @@
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = (f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, k), v) for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.type = 'gauge'
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; ``observe`` is one bisect and a few adds under a lock."""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.type = 'histogram'
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(k, list(counts), total) for k, (counts, total) in sorted(self._series.items())]
+        out = []
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _labels(self.labelnames + ('le',), labels + (_number(bound),))
+                out.append((f'{self.name}_bucket', le, cumulative))
+            label_str = _labels(self.labelnames, labels)
+            out.append((f'{self.name}_sum', label_str, total))
+            out.append((f'{self.name}_count', label_str, cumulative))
+        return out
+
+
+class Callback:
+    """Gauge or counter read from ``fn()`` at scrape time, so it costs nothing on the hot path.
+
+    ``fn`` returns a number, or a dict mapping one label value to a number.
+    """
+
+    def __init__(self, name, help, fn, type='gauge', labelname=None):
+        self.name, self.help, self.fn, self.type = name, help, fn, type
+        self.labelname = labelname
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            return [(self.name, _labels((self.labelname,), (k,)), v)
+                    for k, v in sorted(value.items()) if v is not None]
+        return [] if value is None else [(self.name, '', value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self.register(Histogram(name, help, buckets, labelnames))
+
+    def callback(self, name, help, fn, type='gauge', labelname=None):
+        return self.register(Callback(name, help, fn, type, labelname))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry; every gunicorn worker keeps and serves its own.
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'ai_request_duration_seconds', 'Request latency by route, method and status.',
+    labelnames=('route', 'method', 'status'))
+IN_FLIGHT = registry.gauge('ai_requests_in_flight', 'Requests currently being handled.')
+INFERENCE_SECONDS = registry.histogram('ai_model_inference_seconds', 'Anomaly model predict() time per call.')
+BATCH_SIZE = registry.histogram('ai_scoring_batch_size', 'Pings per scoring pass.', buckets=SIZE_BUCKETS)
+CROWD_ALERTS = registry.counter('ai_crowd_alerts_total', 'Crowd alerts raised, by reason.', labelnames=('reason',))
+SHARD_FORWARDED = registry.counter('ai_shard_forwarded_pings_total', 'Pings sent to the worker owning their tourist.')
+SHARD_FALLBACKS = registry.counter('ai_shard_fallback_pings_total', 'Pings scored locally because their owner was unreachable.')
+SHARD_HANDOFFS = registry.counter('ai_shard_handoff_tourists_total', 'Tourist states handed to a new owning worker.')
+WATCHDOG_EVENTS = registry.counter('ai_watchdog_events_total', 'Inactivity escalation events, by stage.', labelnames=('event',))
+ADMISSION_REJECTED = registry.counter('ai_admission_rejected_total', 'Requests shed with 429, by priority class.',
+                                      labelnames=('class',))
+ADMISSION_WAIT_SECONDS = registry.histogram('ai_admission_wait_seconds', 'Time queued for an admission slot, by priority class.',
+                                            labelnames=('class',))
@@ -0,0 +1,145 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.ensemble import IsolationForest
+
+import metrics
+
+MODEL_PATH = os.getenv('MODEL_PATH', 'models/anomaly_iforest.joblib')
+
+# Hours are shifted to IST before encoding; all tourist traffic is in India.
+TZ_OFFSET_HOURS = float(os.getenv('TZ_OFFSET_HOURS', 5.5))
+
+FEATURES = ('speed', 'hour_sin', 'hour_cos', 'speed_std', 'mean_turn')
+BUILTIN_VERSION = f'builtin-iforest-v2-sklearn{sklearn.__version__}'
+
+
+def hour_of_day(timestamp):
+    """Local hour in [0, 24) for epoch seconds; NaN timestamps map to noon."""
+    hours = np.mod(timestamp / 3600.0 + TZ_OFFSET_HOURS, 24.0)
+    return np.where(np.isnan(hours), 12.0, hours)
+
+
+def build_features(cols):
+    """Model input matrix; trajectory features default to 0 for tourists without history."""
+    n = len(cols['speed'])
+    angle = hour_of_day(cols['timestamp']) * (2 * np.pi / 24.0)
+    return np.column_stack([
+        np.nan_to_num(cols['speed']),
+        np.sin(angle),
+        np.cos(angle),
+        np.nan_to_num(cols.get('speed_std', np.zeros(n))),
+        np.nan_to_num(cols.get('mean_turn', np.zeros(n))),
+    ])
+
+
+def synthetic_baseline(n=5000, seed=42):
+    """Plausible tourist behaviour: mostly daytime walking, some driving, some resting."""
+    rng = np.random.default_rng(seed)
+    mode = rng.choice(3, size=n, p=[0.6, 0.25, 0.15])
+    speed = np.select(
+        [mode == 0, mode == 1],
+        [rng.lognormal(np.log(1.3), 0.3, n), rng.lognormal(np.log(10.0), 0.4, n)],
+        default=rng.exponential(0.1, n),
+    )
+    hours = np.clip(rng.normal(14.0, 3.5, n), 0, 23.99)
+    timestamp = (hours - TZ_OFFSET_HOURS) * 3600.0
+    # Walkers wander (frequent turns, steady pace); vehicles hold heading but vary speed.
+    speed_std = np.select([mode == 0, mode == 1], [rng.gamma(2.0, 0.15, n), rng.gamma(2.0, 1.5, n)],
+                          default=rng.gamma(1.0, 0.05, n))
+    mean_turn = np.select([mode == 0, mode == 1], [rng.gamma(3.0, 10.0, n), rng.gamma(2.0, 5.0, n)],
+                          default=rng.gamma(1.0, 5.0, n))
+    return build_features({'speed': speed, 'timestamp': timestamp,
+                           'speed_std': speed_std, 'mean_turn': mean_turn})
+
+
+def train(features, seed=42):
+    forest = IsolationForest(n_estimators=100, contamination='auto', random_state=seed)
+    forest.fit(features)
+    return forest
+
+
+class AnomalyModel:
+    def __init__(self, forest, version, features=FEATURES):
+        if tuple(features) != FEATURES:
+            raise ValueError(f'Model expects features {features}, service provides {FEATURES}')
+        self.forest = forest
+        self.version = version
+        self.loaded_at = None
+        self.load_seconds = None
+
+    def predict(self, cols):
+        """Anomaly probability in [0, 1] for every row of ``cols``."""
+        if len(cols['speed']) == 0:
+            return np.empty(0)
+        started = time.perf_counter()
+        decision = self.forest.decision_function(build_features(cols))
+        metrics.INFERENCE_SECONDS.observe(time.perf_counter() - started)
+        # decision_function is ~0 at the contamination threshold and negative for outliers.
+        return 1.0 / (1.0 + np.exp(20.0 * decision))
+
+    def warm_up(self):
+        self.predict({
+            'speed': np.array([1.2]),
+            'timestamp': np.array([time.time()]),
+        })
+
+    def info(self):
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+        }
+
+
+def save_model(model, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    joblib.dump({'forest': model.forest, 'version': model.version, 'features': FEATURES}, path)
+
+
+def load_model(path=MODEL_PATH):
+    """Load the artifact at ``path``, or train the built-in baseline if it is missing,
+    then run one dummy inference so the first request does not pay for it."""
+    started = time.perf_counter()
+    if os.path.exists(path):
+        artifact = joblib.load(path)
+        model = AnomalyModel(artifact['forest'], artifact['version'], artifact['features'])
+    else:
+        print(f'⚠️  No model artifact at {path}, training built-in baseline')
+        model = AnomalyModel(train(synthetic_baseline()), BUILTIN_VERSION)
+    model.warm_up()
+    model.load_seconds = round(time.perf_counter() - started, 4)
+    model.loaded_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train and save the anomaly model artifact')
+    parser.add_argument('--out', default=MODEL_PATH)
+    parser.add_argument('--version', default=None)
+    parser.add_argument('--pings', help='NDJSON file of recorded pings to train on (default: synthetic baseline)')
+    parser.add_argument('--samples', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.pings:
+        import json
+        from kinematics import rolling_track_features
+        from scoring import to_columns
+        from trajectory import TRAJECTORY_WINDOW
+        with open(args.pings) as f:
+            cols = to_columns([json.loads(line) for line in f if line.strip()])
+        # Same track features the service derives live, computed for the whole file at once.
+        track = rolling_track_features(cols['token_id'], cols['timestamp'], cols['lat'], cols['lng'],
+                                       TRAJECTORY_WINDOW)
+        cols.update(speed_std=track['speed_std'], mean_turn=track['mean_turn'],
+                    speed=np.where(np.isnan(cols['speed']), track['track_speed'], cols['speed']))
+        features = build_features(cols)
+    else:
+        features = synthetic_baseline(args.samples)
+    version = args.version or f'iforest-{time.strftime("%Y%m%d%H%M%S")}'
+    save_model(AnomalyModel(train(features), version), args.out)
+    print(f'✅ Saved model {version} to {args.out}')
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import numpy as np
+
+from model import hour_of_day
+
+ANOMALY_MODE = os.getenv('ANOMALY_MODE', 'model')
+ANOMALY_MODES = ('model', 'online', 'hybrid')
+
+# Region cells for the streaming baselines (~11 km at the equator).
+ONLINE_REGION_DEG = float(os.getenv('ONLINE_REGION_DEG', 0.1))
+# Old observations lose half their weight after this many seconds.
+ONLINE_HALF_LIFE = float(os.getenv('ONLINE_HALF_LIFE', 15 * 60))
+# Baselines are only trusted once they hold this much (decayed) weight.
+ONLINE_MIN_WEIGHT = float(os.getenv('ONLINE_MIN_WEIGHT', 20))
+
+
+class OnlineBaseline:
+    """Exponentially decayed speed mean/variance per (region cell, local hour).
+
+    Each batch is folded into the per-key state with the parallel (Chan) form of
+    Welford's update after decaying the old weight by the time elapsed, so the
+    cost is O(1) per ping and no retraining is ever needed. Pings are scored
+    against the baseline as it stood before their own batch.
+    """
+
+    def __init__(self, mode=ANOMALY_MODE, region_deg=ONLINE_REGION_DEG,
+                 half_life=ONLINE_HALF_LIFE, min_weight=ONLINE_MIN_WEIGHT, capacity=1024):
+        if mode not in ANOMALY_MODES:
+            raise ValueError(f'ANOMALY_MODE must be one of {ANOMALY_MODES}, got {mode!r}')
+        self.mode = mode
+        self.region_deg = region_deg
+        self.decay_rate = np.log(2.0) / half_life
+        self.min_weight = min_weight
+        self.slots = {}
+        self._lock = threading.Lock()
+        self.weight = np.zeros(capacity)
+        self.mean = np.zeros(capacity)
+        self.m2 = np.zeros(capacity)
+        self.updated = np.zeros(capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def keys(self, lat, lng, timestamp):
+        cols = int(np.ceil(360.0 / self.region_deg))
+        ix = np.floor((lng + 180.0) / self.region_deg).astype(np.int64)
+        iy = np.floor((lat + 90.0) / self.region_deg).astype(np.int64)
+        return (iy * cols + ix) * 24 + hour_of_day(timestamp).astype(np.int64)
+
+    def _slots_for(self, unique_keys):
+        slots = np.empty(len(unique_keys), dtype=np.int64)
+        for i, key in enumerate(unique_keys.tolist()):
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.slots[key] = len(self.slots)
+                if slot >= len(self.weight):
+                    for name in ('weight', 'mean', 'm2', 'updated'):
+                        values = getattr(self, name)
+                        setattr(self, name, np.concatenate([values, np.zeros(len(values))]))
+            slots[i] = slot
+        return slots
+
+    def score_update(self, cols, now):
+        """Per-ping online anomaly in [0, 1] and a mask of pings whose baseline is warm."""
+        lat, lng, speed = cols['lat'], cols['lng'], cols['speed']
+        t = np.where(np.isnan(cols['timestamp']), now, cols['timestamp'])
+        n = len(lat)
+        score = np.zeros(n)
+        warm = np.zeros(n, dtype=bool)
+        # Pings with no reported or derived speed neither learn nor get scored.
+        valid = np.nonzero((np.abs(lat) <= 90) & (np.abs(lng) <= 180) & ~np.isnan(speed))[0]
+        if not len(valid):
+            return score, warm
+
+        unique_keys, inverse = np.unique(self.keys(lat[valid], lng[valid], t[valid]), return_inverse=True)
+        with self._lock:
+            slots = self._slots_for(unique_keys)
+
+            weight, mean, m2 = self.weight[slots], self.mean[slots], self.m2[slots]
+            std = np.sqrt(m2 / np.maximum(weight, 1e-9))
+            z = np.abs(speed[valid] - mean[inverse]) / np.maximum(std[inverse], 0.5)
+            score[valid] = np.clip((z - 2.0) / 4.0, 0.0, 1.0)
+            warm[valid] = weight[inverse] >= self.min_weight
+
+            batch_t = np.maximum(np.bincount(inverse, weights=t[valid]) / np.bincount(inverse), self.updated[slots])
+            decay = np.where(weight > 0, np.exp(-self.decay_rate * (batch_t - self.updated[slots])), 0.0)
+            weight, m2 = weight * decay, m2 * decay
+            b_n = np.bincount(inverse).astype(np.float64)
+            b_mean = np.bincount(inverse, weights=speed[valid]) / b_n
+            b_m2 = np.bincount(inverse, weights=(speed[valid] - b_mean[inverse]) ** 2)
+            total = weight + b_n
+            delta = b_mean - mean
+            self.mean[slots] = mean + delta * b_n / total
+            self.m2[slots] = m2 + b_m2 + delta * delta * weight * b_n / total
+            self.weight[slots] = total
+            self.updated[slots] = batch_t
+        return score, warm
+
+    def blend(self, model_anomaly, online_anomaly, warm):
+        if self.mode == 'online':
+            combined = online_anomaly
+        elif self.mode == 'hybrid':
+            combined = 0.5 * (model_anomaly + online_anomaly)
+        else:
+            return model_anomaly
+        # Cold baselines (new region, new hour) fall back to the model.
+        return np.where(warm, combined, model_anomaly)
+
+    def info(self):
+        return {'mode': self.mode, 'baselines': len(self.slots)}
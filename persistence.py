@@ -0,0 +1,336 @@
+import csv
+import io
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+# Where scored pings are written: postgresql://..., sqlite:///path.db, file:///path.csv
+# or segments:///dir (memory-mapped columnar store, see segments.py).
+# Unset disables persistence.
+PERSIST_URL = os.getenv('PERSIST_URL', '')
+PERSIST_FLUSH_ROWS = int(os.getenv('PERSIST_FLUSH_ROWS', 5000))
+PERSIST_FLUSH_INTERVAL = float(os.getenv('PERSIST_FLUSH_INTERVAL', 2.0))
+# Rows held in memory at most; beyond it, new pings are dropped (or wait, see PERSIST_BLOCK_SECONDS).
+PERSIST_MAX_ROWS = int(os.getenv('PERSIST_MAX_ROWS', 200000))
+# How long a full buffer may hold up a request before dropping its pings; 0 never waits.
+PERSIST_BLOCK_SECONDS = float(os.getenv('PERSIST_BLOCK_SECONDS', 0))
+# Attempts at a batch the sink rejects (bad data, not a lost connection) before it is split
+# in half to isolate the bad rows; a single row that still fails is quarantined.
+PERSIST_MAX_RETRIES = int(os.getenv('PERSIST_MAX_RETRIES', 3))
+
+COLUMNS = ('token_id', 'recorded_at', 'lat', 'lng', 'speed', 'anomaly_score', 'safety_score', 'zone_id')
+# Column widths in schema.sql.
+TOKEN_ID_WIDTH = 50
+ZONE_ID_WIDTH = 100
+MAX_RETRY_DELAY = 30.0
+# Primary result codes for a database another connection holds (sqlite3.h).
+SQLITE_BUSY, SQLITE_LOCKED = 5, 6
+
+log = logging.getLogger(__name__)
+
+
+def _iso(timestamps):
+    return np.datetime_as_string((timestamps * 1e6).astype('datetime64[us]'), timezone='UTC').tolist()
+
+
+def _records(batch):
+    def values(a):
+        return [None if v != v else v for v in a.tolist()]
+    return zip(batch['token_id'], _iso(batch['timestamp']), values(batch['lat']), values(batch['lng']),
+               values(batch['speed']), values(batch['anomaly']), values(batch['safety']), batch['zone_id'])
+
+
+def _fit(values, width):
+    """Strings cut to a VARCHAR width, without the NUL bytes Postgres text cannot hold."""
+    return [None if v is None else v.replace('\x00', '')[:width] for v in values]
+
+
+def _rows(batch):
+    return len(batch['token_id'])
+
+
+def _slice(batch, lo, hi):
+    return {name: values[lo:hi] for name, values in batch.items()}
+
+
+class PostgresSink:
+    """Bulk ``COPY`` into ``location_history`` (see schema.sql); needs psycopg2."""
+
+    def __init__(self, dsn, table='location_history'):
+        import psycopg2
+        self._connect = lambda: psycopg2.connect(dsn)
+        # Connection trouble is worth waiting out; anything else is about the rows.
+        self._transient = (psycopg2.OperationalError, psycopg2.InterfaceError, OSError)
+        self.conn = None
+        self.table = table
+
+    def retryable(self, exc):
+        return isinstance(exc, self._transient)
+
+    def write(self, batch):
+        if self.conn is None or self.conn.closed:
+            self.conn = self._connect()
+        batch = dict(batch, token_id=_fit(batch['token_id'], TOKEN_ID_WIDTH),
+                     zone_id=_fit(batch['zone_id'], ZONE_ID_WIDTH))
+        buf = io.StringIO()
+        csv.writer(buf).writerows(_records(batch))
+        buf.seek(0)
+        try:
+            with self.conn.cursor() as cur:
+                cur.copy_expert(f"COPY {self.table} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+            self.conn.commit()
+        except Exception:
+            self.conn.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+class SQLiteSink:
+    """Local ``location_history`` table in a SQLite file, for development and tests."""
+
+    def __init__(self, path, table='location_history'):
+        self.path = path
+        self.table = table
+        self.conn = None
+
+    @staticmethod
+    def retryable(exc):
+        # Another writer holding the file clears on its own; other OperationalErrors (a bad
+        # table, a full or read-only disk, a corrupt file) do not.
+        if isinstance(exc, sqlite3.OperationalError):
+            code = getattr(exc, 'sqlite_errorcode', None)
+            if code is not None:
+                return code & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+            message = str(exc).lower()
+            return 'locked' in message or 'busy' in message
+        return isinstance(exc, OSError)
+
+    def write(self, batch):
+        if self.conn is None:
+            # Connected on first write so a connection never crosses a fork.
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} (token_id TEXT, recorded_at TEXT, lat REAL, lng REAL, '
+                'speed REAL, anomaly_score REAL, safety_score REAL, zone_id TEXT)')
+            self.conn.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table}_token_time ON {self.table} (token_id, recorded_at)')
+        with self.conn:
+            self.conn.executemany(f'INSERT INTO {self.table} VALUES ({", ".join("?" * len(COLUMNS))})', _records(batch))
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class FileSink:
+    """Appends CSV rows with a header line to a local file."""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerow(COLUMNS)
+
+    def write(self, batch):
+        with open(self.path, 'a', newline='') as f:
+            csv.writer(f).writerows(_records(batch))
+
+    def close(self):
+        pass
+
+
+def open_sink(url=PERSIST_URL):
+    """Sink for ``url``, or None when persistence is disabled."""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme in ('postgres', 'postgresql'):
+        return PostgresSink(url)
+    if parsed.scheme == 'segments':
+        from segments import SegmentSink
+        return SegmentSink(parsed.path)
+    if parsed.scheme == 'sqlite':
+        return SQLiteSink(parsed.path)
+    if parsed.scheme in ('file', ''):
+        return FileSink(parsed.path)
+    raise ValueError(f'Unsupported PERSIST_URL scheme {parsed.scheme!r}')
+
+
+class WriteBehindBuffer:
+    """Collects scored pings in memory and writes them to a sink from a background thread.
+
+    ``append`` only copies column arrays into the buffer. The writer flushes
+    once ``flush_rows`` are waiting or ``flush_interval`` seconds have passed.
+    At most ``max_rows`` are held; when the sink falls behind, ``append``
+    waits up to ``block_seconds`` for room and then drops the pings, counting
+    them. A failed write is retried with backoff and stays counted against the
+    limit. Errors the sink's ``retryable`` accepts (a lost connection, by default
+    any ``OSError``) are retried until they clear; any other error is retried
+    ``max_retries`` times, then the batch is split in half until the rows the
+    sink rejects are isolated and quarantined, so one bad row cannot stall
+    persistence. ``close`` flushes whatever is left.
+    """
+
+    def __init__(self, sink, flush_rows=PERSIST_FLUSH_ROWS, flush_interval=PERSIST_FLUSH_INTERVAL,
+                 max_rows=PERSIST_MAX_ROWS, block_seconds=PERSIST_BLOCK_SECONDS, max_retries=PERSIST_MAX_RETRIES):
+        self.sink = sink
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self.block_seconds = block_seconds
+        self.max_retries = max_retries
+        self.retryable = getattr(sink, 'retryable', lambda exc: isinstance(exc, OSError))
+        self._chunks = []
+        self._rows = 0
+        self._inflight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.written = self.dropped = self.failures = self.quarantined = 0
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return self._rows + self._inflight
+
+    def append(self, cols, scores, zone_ids):
+        """Queue one scored batch; returns False if it was dropped.
+
+        Pings with invalid coordinates are not persisted.
+        """
+        keep = np.nonzero((np.abs(cols['lat']) <= 90) & (np.abs(cols['lng']) <= 180))[0]
+        n = len(keep)
+        if not n:
+            return True
+        timestamp = cols['timestamp'][keep]
+        chunk = {
+            'token_id': [None if cols['token_id'][i] is None else str(cols['token_id'][i]) for i in keep.tolist()],
+            'timestamp': np.where(np.isnan(timestamp), time.time(), timestamp),
+            'lat': cols['lat'][keep].astype(np.float64),
+            'lng': cols['lng'][keep].astype(np.float64),
+            'speed': cols['speed'][keep].astype(np.float64),
+            'anomaly': scores['anomaly'][keep].astype(np.float64),
+            'safety': scores['safety'][keep].astype(np.float64),
+            'zone_id': [zone_ids[z] if z >= 0 else None for z in scores['zone'][keep].tolist()],
+        }
+        with self._cond:
+            if self._pid != os.getpid():
+                # Threads do not survive a fork, so each (preforked) worker starts its own writer.
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+            deadline = time.monotonic() + self.block_seconds
+            while self._closed or len(self) + n > self.max_rows:
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    self.dropped += n
+                    return False
+                self._cond.wait(remaining)
+            self._chunks.append(chunk)
+            self._rows += n
+            if self._rows >= self.flush_rows:
+                self._cond.notify_all()
+        return True
+
+    def _take(self):
+        chunks, self._chunks = self._chunks, []
+        self._inflight, self._rows = self._rows, 0
+        batch = {}
+        for name in chunks[0]:
+            if isinstance(chunks[0][name], list):
+                batch[name] = [v for c in chunks for v in c[name]]
+            else:
+                batch[name] = np.concatenate([c[name] for c in chunks])
+        return batch
+
+    def _run(self):
+        delay = 1.0
+        # [batch, failed attempts] taken from the buffer and not yet written, in order. Splitting
+        # replaces a batch with its halves, which get one attempt each before splitting further.
+        pending = []
+        while True:
+            with self._cond:
+                if not pending:
+                    deadline = time.monotonic() + self.flush_interval
+                    while not self._closed and self._rows < self.flush_rows:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    if not self._rows:
+                        if self._closed:
+                            return
+                        continue
+                    pending.append([self._take(), 0])
+            batch, attempts = pending[0]
+            n = _rows(batch)
+            try:
+                self.sink.write(batch)
+            except Exception as exc:
+                self.failures += 1
+                if not self.retryable(exc):
+                    attempts = pending[0][1] = attempts + 1
+                if attempts >= self.max_retries:
+                    delay = 1.0
+                    if n > 1:
+                        log.warning('write-behind flush of %d rows keeps failing (%s); splitting it', n, exc)
+                        last = self.max_retries - 1
+                        pending[:1] = [[_slice(batch, 0, n // 2), last], [_slice(batch, n // 2, n), last]]
+                        continue
+                    log.error('write-behind quarantined a row the sink rejects (%s): %r', exc,
+                              {name: values[0] for name, values in batch.items()})
+                    pending.pop(0)
+                    with self._cond:
+                        self.quarantined += 1
+                        self._inflight -= 1
+                        self._cond.notify_all()
+                    continue
+                log.exception('write-behind flush of %d rows failed; retrying in %.0fs', n, delay)
+                with self._cond:
+                    if self._closed:
+                        self.dropped += self._inflight
+                        self._inflight = 0
+                        return
+                    self._cond.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            delay = 1.0
+            pending.pop(0)
+            with self._cond:
+                self.written += n
+                self._inflight -= n
+                self._cond.notify_all()
+
+    def close(self, timeout=30.0):
+        """Stop accepting pings, flush what is buffered and close the sink."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                # Still inside sink.write; closing the connection under it would break that write.
+                log.warning('write-behind writer still busy after %.0fs; leaving the sink open with %d rows '
+                            'unwritten', timeout, len(self))
+                return
+        self.sink.close()
+
+    def stats(self):
+        return {
+            'buffered': len(self),
+            'max_rows': self.max_rows,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'quarantined': self.quarantined,
+        }
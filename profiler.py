@@ -0,0 +1,122 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# Fraction of requests to profile; 0 disables profiling and leaves only a float check per request.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# Seconds between stack samples of profiled requests, for the collapsed-stack report.
+PROFILE_STACK_INTERVAL = float(os.getenv('PROFILE_STACK_INTERVAL', 0.005))
+
+FORMATS = ('text', 'pstats', 'collapsed')
+
+
+def _stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler:
+    """Profiles a random sample of requests and aggregates them into one report.
+
+    Each sampled request runs under its own cProfile and the call statistics
+    are merged into a single pstats table. While any sampled request is
+    running, a background thread also records its Python stack every
+    ``interval`` seconds, giving collapsed stacks for flamegraph tools.
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_STACK_INTERVAL):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._sampler = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self._stacks = Counter()
+            self.requests = 0
+            self.started_at = time.time()
+
+    def configure(self, sample_rate=None, interval=None):
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if interval is not None:
+            self.interval = max(float(interval), 0.001)
+
+    def start(self):
+        """Start profiling the current request if it is sampled; returns a handle or None."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler already owns this interpreter; skip this request.
+            return None
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._sample_stacks, daemon=True)
+                self._sampler.start()
+        return profile
+
+    def stop(self, profile):
+        profile.disable()
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.requests += 1
+
+    def _sample_stacks(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = set(self._active)
+                if not active:
+                    self._sampler = None
+                    return
+            frames = sys._current_frames()
+            samples = [_stack(frames[ident]) for ident in active if ident in frames and ident != me]
+            with self._lock:
+                self._stacks.update(samples)
+
+    def report(self, fmt='text', limit=50):
+        """The aggregated profile as bytes in ``fmt`` (one of FORMATS)."""
+        with self._lock:
+            if fmt == 'collapsed':
+                return ''.join(f'{stack} {count}\n' for stack, count in self._stacks.most_common()).encode()
+            if self._stats is None:
+                return b''
+            if fmt == 'pstats':
+                # Same layout as Stats.dump_stats, loadable with pstats.Stats(path) or snakeviz.
+                return marshal.dumps(self._stats.stats)
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats('cumulative').print_stats(limit)
+            return out.getvalue().encode()
+
+    def info(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'stack_interval': self.interval,
+            'profiled_requests': self.requests,
+            'stack_samples': sum(self._stacks.values()),
+            'since': self.started_at,
+        }
@@ -0,0 +1,218 @@
+"""Offline replay of recorded pings through the scoring pipeline, for backtesting models.
+
+    python replay.py --pings pings.ndjson --incidents incidents.json --model models/candidate.joblib
+
+Pings are replayed in timestamp order through the same Scorer that serves
+/api/ai/analyze, sharded by tourist across a process pool so per-tourist
+state stays in one process. A ping becomes an alert when its anomaly score
+reaches --threshold. Alerts are matched against labelled incidents
+(``{token_id, start, end}``), and the report gives per-alert precision,
+per-incident recall, detection delay and throughput.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from ingest import parse_pings
+from model import MODEL_PATH, load_model
+from online import OnlineBaseline
+from scoring import Scorer, parse_timestamp, to_columns
+from trajectory import TrajectoryStore
+from zones import ZONES_PATH, load_zones
+
+# Set in the parent before the pool forks, so workers share them copy-on-write.
+_model = _zones = None
+
+
+def _byte_ranges(path, parts):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(path, lo, hi) for lo, hi in zip(bounds, bounds[1:]) if hi > lo]
+
+
+def _parse_range(args):
+    """Parse the NDJSON lines in one byte range into ping columns; bad lines are counted, not fatal."""
+    path, lo, hi = args
+    with open(path, 'rb') as f:
+        f.seek(lo)
+        data = f.read(hi - lo)
+    records, bad = [], 0
+    for _, record, error in parse_pings(data.splitlines()):
+        if error:
+            bad += 1
+        else:
+            records.append(record)
+    try:
+        cols = to_columns(records)
+    except ValueError:
+        kept = []
+        for record in records:
+            try:
+                to_columns([record])
+                kept.append(record)
+            except ValueError:
+                bad += 1
+        cols = to_columns(kept)
+    cols['token_id'] = np.array(cols['token_id'], dtype=object)
+    return cols, bad
+
+
+def _score_shard(cols, chunk_size):
+    """Score one shard in time order; returns anomaly and safety arrays aligned with ``cols``."""
+    scorer = Scorer(_model, _zones, TrajectoryStore(), OnlineBaseline())
+    n = len(cols['lat'])
+    anomaly, safety = np.empty(n), np.empty(n)
+    for lo in range(0, n, chunk_size):
+        chunk = {name: col[lo:lo + chunk_size] for name, col in cols.items()}
+        chunk['token_id'] = chunk['token_id'].tolist()
+        _, scores = scorer.score(chunk)
+        anomaly[lo:lo + chunk_size] = scores['anomaly']
+        safety[lo:lo + chunk_size] = scores['safety']
+    return anomaly, safety
+
+
+def _shard_of(token_id, shards):
+    return zlib.crc32(str(token_id).encode()) % shards
+
+
+def load_incidents(path):
+    """Incidents as a dict of token_id -> (start, end) arrays; JSON list or NDJSON of {token_id, start, end}."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        items = json.loads(text)
+    except ValueError:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    incidents = {}
+    for item in items:
+        start = parse_timestamp(item['start'])
+        end = parse_timestamp(item.get('end', item['start']))
+        incidents.setdefault(str(item['token_id']), []).append((start, end))
+    return {token: np.array(windows, dtype=np.float64) for token, windows in incidents.items()}
+
+
+def evaluate(token_id, timestamp, anomaly, incidents, threshold, slack):
+    """Precision over alerts and recall over incidents, with ``slack`` seconds around each window."""
+    alert = anomaly >= threshold
+    # Alert timestamps grouped by tourist, so each incident only looks at its own tourist's alerts.
+    tokens, inverse = np.unique(token_id[alert], return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(inverse, minlength=len(tokens)))]
+    alert_times = timestamp[alert][order]
+    tp = 0
+    detected, delays, total = 0, [], 0
+    for token, windows in incidents.items():
+        total += len(windows)
+        i = np.searchsorted(tokens, token)
+        if i == len(tokens) or tokens[i] != token:
+            continue
+        t = alert_times[bounds[i]:bounds[i + 1]]
+        inside = ((t[:, None] >= windows[:, 0] - slack) & (t[:, None] <= windows[:, 1] + slack))
+        tp += int(inside.any(axis=1).sum())
+        hit = inside.any(axis=0)
+        detected += int(hit.sum())
+        for w in np.nonzero(hit)[0]:
+            delays.append(max(float(t[inside[:, w]].min() - windows[w, 0]), 0.0))
+    alerts = int(alert.sum())
+    return {
+        'alerts': alerts,
+        'true_alerts': tp,
+        'false_alerts': alerts - tp,
+        'precision': round(tp / alerts, 4) if alerts else None,
+        'incidents': total,
+        'detected_incidents': detected,
+        'recall': round(detected / total, 4) if total else None,
+        'median_detection_delay_s': round(float(np.median(delays)), 1) if delays else None,
+    }
+
+
+def replay(pings_path, workers, chunk_size):
+    started = time.perf_counter()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(workers) as pool:
+        parsed = pool.map(_parse_range, _byte_ranges(pings_path, workers * 4))
+        parse_seconds = time.perf_counter() - started
+
+        bad = sum(b for _, b in parsed)
+        cols = {name: np.concatenate([c[name] for c, _ in parsed]) for name in parsed[0][0]}
+        # Replays need event time; pings without a timestamp cannot be placed.
+        timed = ~np.isnan(cols['timestamp'])
+        skipped = int((~timed).sum())
+        cols = {name: col[timed] for name, col in cols.items()}
+
+        shard = np.fromiter((_shard_of(t, workers) for t in cols['token_id']), dtype=np.int64,
+                            count=len(cols['token_id']))
+        order = np.lexsort((cols['timestamp'], shard))
+        cols = {name: col[order] for name, col in cols.items()}
+        bounds = np.searchsorted(shard[order], np.arange(workers + 1))
+        jobs = [({name: col[lo:hi] for name, col in cols.items()}, chunk_size)
+                for lo, hi in zip(bounds, bounds[1:])]
+        score_started = time.perf_counter()
+        scored = pool.starmap(_score_shard, jobs)
+    score_seconds = time.perf_counter() - score_started
+
+    anomaly = np.concatenate([a for a, _ in scored]) if scored else np.empty(0)
+    safety = np.concatenate([s for _, s in scored]) if scored else np.empty(0)
+    n = len(anomaly)
+    total_seconds = time.perf_counter() - started
+    stats = {
+        'pings': n,
+        'invalid_lines': bad,
+        'skipped_without_timestamp': skipped,
+        'workers': workers,
+        'parse_seconds': round(parse_seconds, 3),
+        'score_seconds': round(score_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'pings_per_second': round(n / total_seconds, 1) if total_seconds else None,
+        'scoring_pings_per_second': round(n / score_seconds, 1) if score_seconds else None,
+        'mean_safety': round(float(safety.mean()), 4) if n else None,
+    }
+    return cols, anomaly, stats
+
+
+def main():
+    global _model, _zones
+    parser = argparse.ArgumentParser(description='Replay recorded pings through the scoring pipeline')
+    parser.add_argument('--pings', required=True, help='NDJSON file of recorded pings')
+    parser.add_argument('--incidents', help='JSON/NDJSON of labelled incidents {token_id, start, end}')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--zones', default=ZONES_PATH)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--threshold', type=float, default=0.7, help='anomaly score that raises an alert')
+    parser.add_argument('--slack', type=float, default=300.0, help='seconds of tolerance around incidents')
+    parser.add_argument('--output', help='write the report as JSON here as well')
+    args = parser.parse_args()
+
+    _model = load_model(args.model)
+    _zones = load_zones(args.zones)
+    cols, anomaly, report = replay(args.pings, max(args.workers, 1), args.chunk_size)
+    report = {'model': _model.info(), 'threshold': args.threshold, **report}
+    if args.incidents:
+        tokens = np.array([str(t) for t in cols['token_id']], dtype=object)
+        report.update(evaluate(tokens, cols['timestamp'], anomaly, load_incidents(args.incidents),
+                               args.threshold, args.slack))
+    else:
+        report['alerts'] = int((anomaly >= args.threshold).sum())
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+
+from kinematics import haversine
+from model import hour_of_day
+
+# Maximum spacing (metres) between scored points along a route.
+ROUTE_DENSIFY_M = float(os.getenv('ROUTE_DENSIFY_M', 25))
+MAX_ROUTE_POINTS = int(os.getenv('MAX_ROUTE_POINTS', 200000))
+
+# Extra risk for travelling after dark, local time.
+NIGHT_RISK = 0.3
+NIGHT_START, NIGHT_END = 20.0, 6.0
+TRAVEL_SPEED = {'walking': 1.4, 'cycling': 4.0, 'driving': 11.0}
+
+
+def parse_route(route):
+    """``(lat, lng)`` arrays from ``{points: [[lat, lng], ...]}`` or ``[{lat, lng}, ...]``."""
+    points = route.get('points') if isinstance(route, dict) else route
+    if not isinstance(points, list) or len(points) < 2:
+        raise ValueError('each route needs at least two points')
+    try:
+        if isinstance(points[0], dict):
+            coords = np.array([[p['lat'], p['lng']] for p in points], dtype=np.float64)
+        else:
+            coords = np.asarray(points, dtype=np.float64)[:, :2]
+    except (KeyError, TypeError, ValueError, IndexError):
+        raise ValueError('route points must be [lat, lng] pairs or {lat, lng} objects')
+    if not ((np.abs(coords[:, 0]) <= 90) & (np.abs(coords[:, 1]) <= 180)).all():
+        raise ValueError('route points must be valid coordinates')
+    return coords[:, 0], coords[:, 1]
+
+
+def densify(lat, lng, spacing=ROUTE_DENSIFY_M):
+    """Insert points so no gap exceeds ``spacing``; the final vertex is kept.
+
+    Returns the densified lat/lng, the original segment each point lies on,
+    and the distance from each point to the next (0 for the final vertex).
+    """
+    seg_len = haversine(lat[:-1], lng[:-1], lat[1:], lng[1:])
+    pieces = np.maximum(np.ceil(seg_len / spacing), 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(seg_len)), pieces)
+    starts = np.cumsum(pieces) - pieces
+    frac = (np.arange(len(segment)) - starts[segment]) / pieces[segment]
+    d_lat = np.r_[lat[segment] + frac * (lat[segment + 1] - lat[segment]), lat[-1]]
+    d_lng = np.r_[lng[segment] + frac * (lng[segment + 1] - lng[segment]), lng[-1]]
+    step = np.r_[(seg_len / pieces)[segment], 0.0]
+    return d_lat, d_lng, np.r_[segment, len(seg_len) - 1], step
+
+
+def time_risk(timestamp):
+    hours = hour_of_day(timestamp)
+    return np.where((hours >= NIGHT_START) | (hours < NIGHT_END), NIGHT_RISK, 0.0)
+
+
+def score_routes(routes, zones, departure, mode='walking', spacing=ROUTE_DENSIFY_M):
+    """Score every candidate route in a single vectorized pass over all densified points."""
+    speed = TRAVEL_SPEED.get(mode)
+    if speed is None:
+        raise ValueError(f'mode must be one of {sorted(TRAVEL_SPEED)}')
+    parsed = [parse_route(route) for route in routes]
+    dense = [densify(lat, lng, spacing) for lat, lng in parsed]
+    sizes = np.array([len(d[0]) for d in dense])
+    if sizes.sum() > MAX_ROUTE_POINTS:
+        raise ValueError(f'routes densify to more than {MAX_ROUTE_POINTS} points')
+
+    lat = np.concatenate([d[0] for d in dense])
+    lng = np.concatenate([d[1] for d in dense])
+    step = np.concatenate([d[3] for d in dense])
+    route_start = np.cumsum(sizes) - sizes
+    # Distance travelled before each point, restarting at every route.
+    travelled = np.cumsum(step) - step
+    travelled -= np.repeat(travelled[route_start], sizes)
+
+    zone_risk, zone_index = zones.lookup_batch(lat, lng)
+    t_risk = time_risk(departure + travelled / speed)
+    risk = 1.0 - (1.0 - zone_risk) * (1.0 - t_risk)
+
+    results = []
+    for r, (start, size) in enumerate(zip(route_start.tolist(), sizes.tolist())):
+        route_risk = risk[start:start + size]
+        route_step = step[start:start + size]
+        segment = dense[r][2]
+        seg_bounds = np.r_[0, np.nonzero(np.diff(segment))[0] + 1]
+        seg_max = np.maximum.reduceat(route_risk, seg_bounds)
+        length = route_step.sum()
+        mean_risk = float(np.dot(route_risk, route_step) / length) if length > 0 else float(route_risk.mean())
+        route = routes[r]
+        results.append({
+            'route_id': route.get('id', r) if isinstance(route, dict) else r,
+            'safety_score': round(1.0 - mean_risk, 4),
+            'max_risk': round(float(route_risk.max()), 4),
+            'length_m': round(float(length), 1),
+            'duration_s': round(float(length / speed), 1),
+            'risk_exposure_m': round(float(route_step[zone_risk[start:start + size] > 0].sum()), 1),
+            'zones': sorted({zones.ids[i] for i in np.unique(zone_index[start:start + size]).tolist() if i >= 0},
+                            key=str),
+            'segment_safety': np.round(1.0 - seg_max, 4).tolist(),
+        })
+    return results
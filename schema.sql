@@ -21,4 +21,21 @@ INSERT INTO users (token_id, username, full_name, email, password_hash, role) VA
 ('POLICE-456', 'officer_singh', 'Officer Singh', 'singh@police.demo', 'Police@789', 'police'),
 ('HOSPITAL-789', 'dr_patel', 'Dr. Patel', 'patel@hospital.demo', 'Doctor@101', 'hospital'),
 ('TOURISM-101', 'tourism_admin', 'Tourism Admin', 'admin@tourism.demo', 'Tourism@202', 'tourism')
-ON CONFLICT (username) DO NOTHING;
\ No newline at end of file
+ON CONFLICT (username) DO NOTHING;
+
+-- Scored location pings from the AI service, written in bulk with COPY
+CREATE TABLE IF NOT EXISTS location_history (
+    id BIGSERIAL PRIMARY KEY,
+    token_id VARCHAR(50),
+    recorded_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    lat DOUBLE PRECISION NOT NULL,
+    lng DOUBLE PRECISION NOT NULL,
+    speed REAL,
+    anomaly_score REAL,
+    safety_score REAL,
+    zone_id VARCHAR(100),
+    geom GEOGRAPHY(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(lng, lat), 4326)::geography) STORED
+);
+
+CREATE INDEX IF NOT EXISTS idx_location_history_token_time ON location_history (token_id, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_location_history_geom ON location_history USING GIST (geom);
@@ -0,0 +1,183 @@
+from datetime import datetime
+import time
+
+import numpy as np
+
+import metrics
+
+# Speeds (m/s) above this are treated as fully anomalous for a tourist on the ground.
+MAX_PLAUSIBLE_SPEED = 40.0
+
+# Staying this long (seconds) in one spot inside a risk zone is flagged.
+ZONE_DWELL_ALERT = 30 * 60
+
+RECOMMENDATIONS = (
+    ['All systems normal'],
+    ['Unusual movement detected', 'Share live location with emergency contacts'],
+    ['High anomaly detected', 'Contact nearest police assistance'],
+    ['Location unavailable', 'Enable GPS to receive safety alerts'],
+    ['Inside a restricted area', 'Leave the area or contact local police'],
+    ['Inside a high-risk zone', 'Stay on main routes and keep emergency contacts informed'],
+    ['Prolonged stay in a high-risk zone', 'Check in with emergency contacts or local police'],
+)
+
+
+def parse_timestamp(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, (int, float)):
+        # Millisecond epochs (Date.now()) are far larger than second epochs.
+        return value / 1000.0 if value > 1e11 else float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return np.nan
+
+
+def _value(record, key):
+    value = record.get(key)
+    return np.nan if value is None else value
+
+
+def _coord(record, key):
+    location = record.get('location')
+    value = location.get(key) if isinstance(location, dict) else record.get(key)
+    return np.nan if value is None else value
+
+
+def to_columns(records):
+    """Convert a list of ping dicts into float64 column arrays.
+
+    Accepts the flat ``{lat, lng, speed, timestamp}`` form as well as the
+    ``{location: {lat, lng}}`` form the dashboard sends with SOS alerts.
+    """
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise ValueError('records must be a list of objects')
+    n = len(records)
+    try:
+        lat = np.fromiter((_coord(r, 'lat') for r in records), dtype=np.float64, count=n)
+        lng = np.fromiter((_coord(r, 'lng') for r in records), dtype=np.float64, count=n)
+        speed = np.fromiter((_value(r, 'speed') for r in records), dtype=np.float64, count=n)
+    except (TypeError, ValueError):
+        raise ValueError('lat, lng and speed must be numeric')
+    timestamp = np.fromiter((parse_timestamp(r.get('timestamp')) for r in records), dtype=np.float64, count=n)
+    token_id = [r.get('token_id') for r in records]
+    # Tokens key per-tourist state, so they must hash and compare like the ids clients send.
+    if not all(tok is None or isinstance(tok, str) or (isinstance(tok, int) and not isinstance(tok, bool))
+               for tok in token_id):
+        raise ValueError('token_id must be a string or an integer')
+    return {
+        'token_id': token_id,
+        'lat': lat,
+        'lng': lng,
+        'speed': speed,
+        'timestamp': timestamp,
+    }
+
+
+def score_columns(cols, model=None, zones=None, online=None):
+    """Score every ping in one vectorized pass.
+
+    Without a ``model`` the anomaly score falls back to a plain speed ratio.
+    An ``online`` baseline, unless in ``model`` mode, learns from every scored
+    ping and is blended into the anomaly score.
+    Returns a dict of per-ping arrays: anomaly, safety, reason and zone index.
+    """
+    lat, lng, speed = cols['lat'], cols['lng'], cols['speed']
+    valid = (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+
+    speed = np.nan_to_num(speed)
+    if model is None:
+        anomaly = np.clip(speed / MAX_PLAUSIBLE_SPEED, 0.0, 1.0)
+    else:
+        anomaly = model.predict(cols)
+    if online is not None and online.mode != 'model':
+        anomaly = online.blend(anomaly, *online.score_update(cols, time.time()))
+    anomaly = np.where(speed >= MAX_PLAUSIBLE_SPEED, 1.0, anomaly)
+    anomaly = np.where(valid, anomaly, 0.5)
+
+    if zones is not None and len(zones):
+        zone_risk, zone_index = zones.lookup_batch(lat, lng, cols['timestamp'])
+        restricted = zones.restricted[zone_index]
+    else:
+        zone_risk = np.zeros(len(lat))
+        zone_index = np.full(len(lat), -1)
+        restricted = np.zeros(len(lat), dtype=bool)
+    safety = np.clip(1.0 - 0.5 * anomaly - 0.5 * zone_risk, 0.0, 1.0)
+
+    dwell = np.nan_to_num(cols.get('dwell', np.zeros(len(lat))))
+    zone_dwell = (zone_risk > 0) & (dwell >= ZONE_DWELL_ALERT)
+    safety = np.where(zone_dwell, safety * 0.8, safety)
+
+    reason = np.select(
+        [~valid, anomaly >= 0.7, restricted, zone_dwell, zone_risk > 0, anomaly >= 0.4],
+        [3, 2, 4, 6, 5, 1],
+        default=0,
+    )
+    return {'anomaly': anomaly, 'safety': safety, 'reason': reason, 'zone': zone_index}
+
+
+def format_results(cols, scores, zones=None):
+    anomaly = np.round(scores['anomaly'], 4).tolist()
+    safety = np.round(scores['safety'], 4).tolist()
+    zone_ids = [None] if zones is None else zones.ids
+    return [
+        {
+            'token_id': token_id,
+            'anomaly_score': a,
+            'safety_score': s,
+            'zone_id': zone_ids[z],
+            'recommendations': RECOMMENDATIONS[r],
+        }
+        for token_id, a, s, r, z in zip(
+            cols['token_id'], anomaly, safety, scores['reason'].tolist(), scores['zone'].tolist())
+    ]
+
+
+class Scorer:
+    """Bundles everything a scoring pass needs so routes only hold one object."""
+
+    def __init__(self, model=None, zones=None, trajectories=None, online=None, heatmap=None, history=None,
+                 crowds=None, watchdog=None):
+        self.model = model
+        self.zones = zones
+        self.trajectories = trajectories
+        self.online = online
+        self.heatmap = heatmap
+        self.history = history
+        self.crowds = crowds
+        self.watchdog = watchdog
+
+    def add_trajectory_features(self, cols):
+        """Push pings into the trajectory store and merge its features into ``cols``.
+
+        Pings without a timestamp are stamped with the receive time; pings without
+        a reported speed use the speed derived from the track.
+        """
+        if self.trajectories is None:
+            return cols
+        t = np.where(np.isnan(cols['timestamp']), time.time(), cols['timestamp'])
+        features = self.trajectories.update(cols['token_id'], cols['lat'], cols['lng'], t)
+        cols.update(features)
+        cols['speed'] = np.where(np.isnan(cols['speed']), features['track_speed'], cols['speed'])
+        return cols
+
+    def score(self, cols):
+        """Run the full pipeline on ping columns; returns the enriched columns and raw scores."""
+        metrics.BATCH_SIZE.observe(len(cols['lat']))
+        t = np.where(np.isnan(cols['timestamp']), time.time(), cols['timestamp'])
+        if self.heatmap is not None:
+            self.heatmap.add(cols['lat'], cols['lng'], t)
+        if self.crowds is not None:
+            self.crowds.update(cols['token_id'], cols['lat'], cols['lng'], t)
+        cols = self.add_trajectory_features(cols)
+        scores = score_columns(cols, self.model, self.zones, self.online)
+        if self.history is not None:
+            self.history.append(cols, scores, self.zones.ids if self.zones is not None else [None])
+        if self.watchdog is not None:
+            self.watchdog.update(cols['token_id'], cols['lat'], cols['lng'], scores['zone'], t)
+        return cols, scores
+
+    def score_records(self, records):
+        cols, scores = self.score(to_columns(records))
+        return format_results(cols, scores, self.zones)
@@ -0,0 +1,447 @@
+import fcntl
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+# Rows per segment; the active segment is preallocated at this size (~32 bytes per row).
+SEGMENT_ROWS = int(os.getenv('SEGMENT_ROWS', 1 << 20))
+# An active segment no writer holds and nobody has written to for this many seconds is sealed.
+SEGMENT_ORPHAN_AGE = float(os.getenv('SEGMENT_ORPHAN_AGE', 600))
+
+COLUMNS = (('timestamp', '<f8'), ('token', '<i4'), ('lat', '<f8'), ('lng', '<f8'), ('speed', '<f4'))
+
+
+def _open_column(path, dtype, rows, mode):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(rows,))
+
+
+def _write_json(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class _Segment:
+    """One directory of column files plus ``meta.json``.
+
+    A sealed segment is sorted by (token, timestamp) and carries a per-tourist
+    offset index (``tokens``/``offsets``, CSR style) and its time bounds, so a
+    tourist's rows are one contiguous slice of every column. The active
+    segment is indexed in memory as rows arrive: each batch of new rows
+    becomes a sorted run, and runs of similar size are merged, so lookups
+    are a binary search per run rather than a scan.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.sealed = self.meta['sealed']
+        rows = self.meta['rows'] if self.sealed else self.meta['capacity']
+        self.columns = {
+            name: _open_column(os.path.join(path, f'{name}.bin'), dtype, rows, mode)
+            for name, dtype in COLUMNS
+        }
+        if self.sealed:
+            self.tokens = np.fromfile(os.path.join(path, 'tokens.bin'), dtype='<i4')
+            self.offsets = np.fromfile(os.path.join(path, 'offsets.bin'), dtype='<i8')
+        else:
+            # (row order, tokens, offsets) per run, largest first, covering rows [0, _indexed).
+            self._runs = []
+            self._indexed = 0
+
+    def reload_meta(self):
+        """Pick up rows another process appended to this (active) segment."""
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    @classmethod
+    def create(cls, path, capacity):
+        os.makedirs(path)
+        for name, dtype in COLUMNS:
+            with open(os.path.join(path, f'{name}.bin'), 'wb') as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize)
+        _write_json(os.path.join(path, 'meta.json'),
+                    {'sealed': False, 'rows': 0, 'capacity': capacity, 'tmin': None, 'tmax': None})
+        return cls(path, 'r+')
+
+    @property
+    def rows(self):
+        return self.meta['rows']
+
+    def overlaps(self, start, end):
+        if not self.rows:
+            return False
+        return self.meta['tmax'] >= start and self.meta['tmin'] <= end
+
+    def rows_for(self, code, start, end):
+        """Column slices for one tourist in [start, end]; views into the memmaps when sealed."""
+        if self.sealed:
+            i = np.searchsorted(self.tokens, code)
+            if i == len(self.tokens) or self.tokens[i] != code:
+                return None
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            ts = self.columns['timestamp'][lo:hi]
+            lo, hi = lo + np.searchsorted(ts, start, 'left'), lo + np.searchsorted(ts, end, 'right')
+            return {name: col[lo:hi] for name, col in self.columns.items()}
+        ts = self.columns['timestamp']
+        found = []
+        for order, tokens, offsets in self._index():
+            i = np.searchsorted(tokens, code)
+            if i < len(tokens) and tokens[i] == code:
+                rows = order[offsets[i]:offsets[i + 1]]
+                found.append(rows[(ts[rows] >= start) & (ts[rows] <= end)])
+        idx = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        idx = idx[np.argsort(ts[idx], kind='stable')]
+        return {name: col[idx] for name, col in self.columns.items()}
+
+    def _run(self, rows):
+        order = rows[np.lexsort((self.columns['timestamp'][rows], self.columns['token'][rows]))]
+        tokens = self.columns['token'][order]
+        starts = np.r_[0, np.nonzero(np.diff(tokens))[0] + 1]
+        return order, tokens[starts], np.r_[starts, len(order)]
+
+    def _index(self):
+        n = self.rows
+        if n > self._indexed:
+            self._runs.append(self._run(np.arange(self._indexed, n)))
+            self._indexed = n
+            # Merge like a binary counter, so there are O(log rows) runs and each row is re-sorted O(log rows) times.
+            while len(self._runs) > 1 and len(self._runs[-1][0]) * 2 >= len(self._runs[-2][0]):
+                newer, older = self._runs.pop(), self._runs.pop()
+                self._runs.append(self._run(np.concatenate([older[0], newer[0]])))
+        return self._runs
+
+    def rows_between(self, start, end):
+        n = self.rows
+        ts = self.columns['timestamp'][:n]
+        idx = np.nonzero((ts >= start) & (ts <= end))[0]
+        return {name: col[idx] for name, col in self.columns.items()}
+
+
+class SegmentStore:
+    """Append-only columnar store of pings in memory-mapped segment files.
+
+    Pings go into the active segment; when it fills it is sorted by tourist
+    and time, indexed and sealed, and a new one is started. Sealed segments
+    are immutable, so ``query`` for a tourist and time range reads one
+    contiguous slice per overlapping segment instead of scanning. Token ids
+    are mapped to int32 codes through ``tokens.txt``.
+
+    One process writes a store; any number may open it with ``readonly=True``.
+    ``SegmentSink`` wraps it as a sink for ``persistence.WriteBehindBuffer``.
+    """
+
+    def __init__(self, root, segment_rows=SEGMENT_ROWS, readonly=False):
+        self.root = root
+        self.segment_rows = segment_rows
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._names = []
+        self._dict_size = 0
+        self.sealed = []
+        self.active = None
+        if not readonly:
+            os.makedirs(root, exist_ok=True)
+            self._recover()
+        self._load()
+
+    def _recover(self):
+        """Finish or undo a seal that was interrupted."""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.endswith('.tmp') and os.path.isdir(path):
+                shutil.rmtree(path)
+            elif name.startswith('active-') and os.path.isdir(os.path.join(self.root, 'seg-' + name[7:])):
+                shutil.rmtree(path)
+
+    def _load(self):
+        """Open segments not seen yet; already open ones are kept, so a refresh only costs what changed."""
+        names = sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []
+        mode = 'r' if self.readonly else 'r+'
+        known = {os.path.basename(seg.path): seg for seg in self.sealed}
+        sealed = [n for n in names if n.startswith('seg-') and not n.endswith('.tmp')]
+        self.sealed = [known.get(n) or _Segment(os.path.join(self.root, n)) for n in sealed]
+        # An active segment with a sealed copy is being (or was) sealed; the copy wins.
+        active = [n for n in names if n.startswith('active-') and f'seg-{n[7:]}' not in sealed]
+        if not active:
+            self.active = None
+        elif self.active is not None and os.path.basename(self.active.path) == active[-1]:
+            if self.readonly:
+                self.active.reload_meta()
+        else:
+            self.active = _Segment(os.path.join(self.root, active[-1]), mode)
+        self._next_id = 1 + max([int(n.split('-')[1].split('.')[0]) for n in names
+                                 if n.startswith(('seg-', 'active-'))] or [0])
+        self._read_dictionary()
+
+    def _read_dictionary(self):
+        path = os.path.join(self.root, 'tokens.txt')
+        if not os.path.exists(path) or os.path.getsize(path) == self._dict_size:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._dict_size)
+            data = f.read()
+        # Only whole lines; a writer may be mid-append.
+        data = data[:data.rfind(b'\n') + 1]
+        for line in data.decode().splitlines():
+            self._codes[line] = len(self._names)
+            self._names.append(line)
+        self._dict_size += len(data)
+
+    def _encode(self, token_ids):
+        new = []
+        codes = np.empty(len(token_ids), dtype=np.int32)
+        for i, token in enumerate(token_ids):
+            key = '' if token is None else str(token).replace('\n', ' ')
+            code = self._codes.get(key)
+            if code is None:
+                code = self._codes[key] = len(self._names)
+                self._names.append(key)
+                new.append(key)
+            codes[i] = code
+        if new:
+            data = ''.join(f'{name}\n' for name in new).encode()
+            with open(os.path.join(self.root, 'tokens.txt'), 'ab') as f:
+                f.write(data)
+            self._dict_size += len(data)
+        return codes
+
+    def __len__(self):
+        return sum(s.rows for s in self.sealed) + (self.active.rows if self.active else 0)
+
+    def append(self, token_ids, timestamp, lat, lng, speed):
+        if self.readonly:
+            raise ValueError('store is read-only')
+        with self._lock:
+            columns = {
+                'token': self._encode(token_ids),
+                'timestamp': np.asarray(timestamp, dtype=np.float64),
+                'lat': np.asarray(lat, dtype=np.float64),
+                'lng': np.asarray(lng, dtype=np.float64),
+                'speed': np.asarray(speed, dtype=np.float32),
+            }
+            done, n = 0, len(columns['token'])
+            while done < n:
+                if self.active is None:
+                    self.active = _Segment.create(
+                        os.path.join(self.root, f'active-{self._next_id:06d}'), self.segment_rows)
+                    self._next_id += 1
+                seg = self.active
+                take = min(n - done, seg.meta['capacity'] - seg.rows)
+                at = seg.rows
+                for name, col in seg.columns.items():
+                    col[at:at + take] = columns[name][done:done + take]
+                ts = columns['timestamp'][done:done + take]
+                seg.meta['rows'] += take
+                seg.meta['tmin'] = min(float(ts.min()), seg.meta['tmin'] if seg.meta['tmin'] is not None else np.inf)
+                seg.meta['tmax'] = max(float(ts.max()), seg.meta['tmax'] if seg.meta['tmax'] is not None else -np.inf)
+                done += take
+                if seg.rows == seg.meta['capacity']:
+                    self._seal()
+            self._write_meta()
+
+    def write(self, batch):
+        self.append(batch['token_id'], batch['timestamp'], batch['lat'], batch['lng'], batch['speed'])
+
+    def _write_meta(self):
+        if self.active is not None:
+            for col in self.active.columns.values():
+                col.flush()
+            _write_json(os.path.join(self.active.path, 'meta.json'), self.active.meta)
+
+    def _seal(self):
+        seg, n = self.active, self.active.rows
+        seg_id = os.path.basename(seg.path)[len('active-'):]
+        order = np.lexsort((seg.columns['timestamp'][:n], seg.columns['token'][:n]))
+        tmp = os.path.join(self.root, f'seg-{seg_id}.tmp')
+        os.makedirs(tmp)
+        for name, col in seg.columns.items():
+            np.asarray(col[:n])[order].tofile(os.path.join(tmp, f'{name}.bin'))
+        tokens = seg.columns['token'][:n][order]
+        starts = np.r_[0, np.nonzero(np.diff(tokens))[0] + 1]
+        tokens[starts].astype('<i4').tofile(os.path.join(tmp, 'tokens.bin'))
+        np.r_[starts, n].astype('<i8').tofile(os.path.join(tmp, 'offsets.bin'))
+        _write_json(os.path.join(tmp, 'meta.json'), dict(seg.meta, sealed=True))
+        final = os.path.join(self.root, f'seg-{seg_id}')
+        os.rename(tmp, final)
+        self.active = None
+        seg.columns.clear()
+        shutil.rmtree(seg.path)
+        self.sealed.append(_Segment(final))
+
+    def seal(self):
+        """Seal the active segment however full it is, e.g. one left behind by a writer that died."""
+        with self._lock:
+            if self.active is not None and self.active.rows:
+                self._seal()
+
+    def flush(self):
+        with self._lock:
+            self._write_meta()
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+
+    def refresh(self):
+        """Pick up segments, rows and tokens written by another process (read-only stores)."""
+        with self._lock:
+            self._load()
+
+    def query(self, token_id, start=-np.inf, end=np.inf):
+        """Pings of one tourist with ``start <= timestamp <= end``, oldest first.
+
+        Returns timestamp/lat/lng/speed arrays. When a single sealed segment
+        holds the range they are views into its memory maps, with nothing copied.
+        """
+        with self._lock:
+            self._read_dictionary()
+            code = self._codes.get(str(token_id))
+            parts = []
+            if code is not None:
+                for seg in self.sealed + ([self.active] if self.active else []):
+                    if seg.overlaps(start, end):
+                        part = seg.rows_for(code, start, end)
+                        if part is not None and len(part['timestamp']):
+                            parts.append(part)
+        return _merge_by_time(parts)
+
+    def between(self, start, end):
+        """All pings with ``start <= timestamp <= end``, with a ``token_id`` per row (not time-sorted)."""
+        with self._lock:
+            self._read_dictionary()
+            parts = [seg.rows_between(start, end) for seg in self.sealed + ([self.active] if self.active else [])
+                     if seg.overlaps(start, end)]
+            out = _concat(parts, with_token=True)
+            out['token_id'] = [self._names[c] for c in out.pop('token').tolist()]
+        return out
+
+    def stats(self):
+        return {
+            'rows': len(self),
+            'sealed_segments': len(self.sealed),
+            'active_rows': self.active.rows if self.active else 0,
+            'tourists': len(self._names),
+        }
+
+
+class SegmentSink:
+    """``WriteBehindBuffer`` sink that gives each writer process its own store under ``root``.
+
+    Stores are ``writer-<n>`` directories. A writer holds an exclusive lock on
+    the lowest free one for as long as it lives, so a restarted worker carries
+    on where its predecessor stopped, active segment included, and the number
+    of stores stays at the number of concurrent writers. On opening, a writer
+    also seals active segments in stores nobody holds that have been idle for
+    ``SEGMENT_ORPHAN_AGE`` seconds.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.store = None
+        self.pid = None
+        self._held = None
+
+    def write(self, batch):
+        if self.store is None or self.pid != os.getpid():
+            self._open()
+        self.store.write(batch)
+
+    def _open(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.pid = os.getpid()
+        for slot in itertools.count():
+            path = os.path.join(self.root, f'writer-{slot}')
+            held = _try_lock(path)
+            if held is not None:
+                self._held = held
+                self.store = SegmentStore(path)
+                break
+        self._seal_orphans()
+
+    def _seal_orphans(self):
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if path == self.store.root or not os.path.isdir(path):
+                continue
+            active = [n for n in os.listdir(path) if n.startswith('active-') and not n.endswith('.tmp')]
+            if not active or time.time() - os.path.getmtime(os.path.join(path, active[-1], 'meta.json')) < SEGMENT_ORPHAN_AGE:
+                continue
+            held = _try_lock(path)
+            if held is not None:
+                try:
+                    SegmentStore(path).seal()
+                finally:
+                    held.close()
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+def _try_lock(path):
+    """Exclusive lock on a store directory, held while the returned file stays open; None if taken."""
+    os.makedirs(path, exist_ok=True)
+    f = open(os.path.join(path, 'writer.lock'), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _concat(parts, with_token=False):
+    names = [name for name, _ in COLUMNS if with_token or name != 'token']
+    if len(parts) == 1:
+        return {name: parts[0][name] for name in names}
+    if not parts:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS if name in names}
+    return {name: np.concatenate([p[name] for p in parts]) for name in names}
+
+
+def _merge_by_time(parts):
+    """Concatenate time-sorted parts into one time-sorted result; late pings can land in a later segment."""
+    merged = _concat(parts)
+    if len(parts) < 2:
+        return merged
+    order = np.argsort(merged['timestamp'], kind='stable')
+    return {name: col[order] for name, col in merged.items()}
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def _reader(path):
+    """Read-only store for ``path``, opened once per process and refreshed incrementally."""
+    with _readers_lock:
+        store = _readers.get(path)
+        if store is None:
+            store = _readers[path] = SegmentStore(path, readonly=True)
+            return store
+    store.refresh()
+    return store
+
+
+def query_shards(root, token_id, start=-np.inf, end=np.inf):
+    """Query every store under ``root`` (one per writer process); results merged in time order."""
+    parts = []
+    if os.path.isdir(root):
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isdir(path):
+                found = _reader(path).query(token_id, start, end)
+                if len(found['timestamp']):
+                    parts.append(found)
+    return _merge_by_time(parts)
@@ -1,6 +1,7 @@
 const express = require('express');
 const cors = require('cors');
 const http = require('http');
+const crypto = require('crypto');
 const socketIo = require('socket.io');
 require('dotenv').config();
 
@@ -117,12 +118,31 @@ app.post('/api/auth/login', (req, res) => {
 });
 
 // SOS endpoint
-app.post('/api/emergency/sos', (req, res) => {
+const AI_SERVICE_URL = process.env.AI_SERVICE_URL || 'http://ai-service:5000';
+
+app.post('/api/emergency/sos', async (req, res) => {
   console.log('SOS Alert received:', req.body);
+  const alertId = 'SOS-' + crypto.randomUUID();
+  let dispatch = null;
+
+  // Hand the alert to the AI service dispatch queue; the SOS is still acknowledged if it is down.
+  try {
+    const response = await fetch(`${AI_SERVICE_URL}/api/ai/dispatch/alerts`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ...req.body, alert_id: alertId }),
+      signal: AbortSignal.timeout(2000)
+    });
+    dispatch = (await response.json()).data || null;
+  } catch (error) {
+    console.error('Dispatch service unavailable:', error.message);
+  }
+
   res.json({
     success: true,
     message: 'SOS alert sent successfully',
-    alertId: 'SOS-' + Date.now()
+    alertId,
+    dispatch
   });
 });
 
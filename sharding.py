@@ -0,0 +1,380 @@
+"""Routes each tourist's pings to the worker process that owns their state.
+
+Owners come from a consistent-hash ring over the members listed in
+``$SHARD_DIR/members.json``. Every worker serves its peers on a local socket:
+a worker scores the pings it owns itself and sends the rest to their owners,
+so per-tourist state (trajectories) lives in exactly one process. When the
+member list changes, each worker hands the tourists it no longer owns to
+their new owner; a worker that is shutting down hands over everything.
+
+Under gunicorn the hooks in gunicorn.conf.py keep the member list in step with
+the live workers. To span hosts, set ``SHARD_LISTEN=host:port`` (worker ``i``
+listens on ``port + i``) and provide members.json yourself, e.g.
+``{"members": ["10.0.0.1:7000", "10.0.0.1:7001", "10.0.0.2:7000"]}``.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import metrics
+from scoring import format_results, to_columns
+
+# Unset disables sharding: every worker scores whatever it receives with its own state.
+SHARD_DIR = os.getenv('SHARD_DIR', '')
+SHARD_LISTEN = os.getenv('SHARD_LISTEN', '')
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', 64))
+SHARD_TIMEOUT = float(os.getenv('SHARD_TIMEOUT', 2.0))
+# How often the member list is checked for changes.
+SHARD_REFRESH = float(os.getenv('SHARD_REFRESH', 1.0))
+
+MEMBERS_FILE = 'members.json'
+MESSAGE = struct.Struct('<cI')
+SCORE, HANDOFF, REPLY, ERROR = b'S', b'H', b'R', b'E'
+
+log = logging.getLogger(__name__)
+
+
+def _key_hash(keys):
+    return np.fromiter((zlib.crc32(k.encode()) for k in keys), dtype=np.int64, count=len(keys))
+
+
+class HashRing:
+    """Consistent-hash ring with ``vnodes`` points per member; adding or removing one member moves ~1/n of the keys."""
+
+    def __init__(self, members, vnodes=SHARD_VNODES):
+        self.members = tuple(members)
+        points = sorted(
+            (int.from_bytes(hashlib.blake2b(f'{member}#{i}'.encode(), digest_size=4).digest(), 'little'), k)
+            for k, member in enumerate(self.members) for i in range(vnodes))
+        self.points = np.array([p for p, _ in points], dtype=np.int64)
+        self.owner = np.array([k for _, k in points], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.members)
+
+    def owners(self, keys):
+        """Index into ``members`` of the owner of each string key."""
+        i = np.searchsorted(self.points, _key_hash(keys), side='right') % len(self.points)
+        return self.owner[i]
+
+
+def member_address(index, directory=SHARD_DIR, listen=SHARD_LISTEN):
+    if listen:
+        host, port = listen.rsplit(':', 1)
+        return f'{host}:{int(port) + index}'
+    return f'unix:{os.path.join(directory, f"w{index}.sock")}'
+
+
+def write_members(indices, directory=SHARD_DIR):
+    """Publish the member list for worker ``indices`` (atomically, for workers polling it)."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    path = os.path.join(directory, MEMBERS_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'members': [member_address(i, directory) for i in sorted(indices)]}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _connect(address, timeout):
+    if address.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address[5:])
+        return sock
+    host, port = address.rsplit(':', 1)
+    return socket.create_connection((host, int(port)), timeout)
+
+
+def _send(sock, kind, arrays):
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    payload = buf.getbuffer()
+    sock.sendall(MESSAGE.pack(kind, len(payload)))
+    sock.sendall(payload)
+
+
+def _read_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(min(n - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError('peer closed the connection')
+        data += chunk
+    return data
+
+
+def _recv(sock):
+    kind, n = MESSAGE.unpack(_read_exact(sock, MESSAGE.size))
+    with np.load(io.BytesIO(_read_exact(sock, n)), allow_pickle=False) as z:
+        arrays = {name: z[name] for name in z.files}
+    if kind == ERROR:
+        raise RuntimeError(f"peer error: {arrays['error']}")
+    return kind, arrays
+
+
+def _take(cols, idx):
+    return {name: [col[i] for i in idx.tolist()] if isinstance(col, list) else col[idx]
+            for name, col in cols.items()}
+
+
+class _PeerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        shards = self.server.shards
+        while True:
+            try:
+                kind, arrays = _recv(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                if kind == SCORE:
+                    reply = shards.serve_score(arrays)
+                elif kind == HANDOFF:
+                    reply = {'absorbed': np.array(shards.absorb(arrays))}
+                else:
+                    raise ValueError(f'unknown message {kind!r}')
+                _send(self.request, REPLY, reply)
+            except Exception as e:
+                log.exception('shard peer request failed')
+                _send(self.request, ERROR, {'error': np.array(str(e))})
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ShardedScorer:
+    """Drop-in for ``Scorer`` that scores each tourist's pings on the worker owning the tourist.
+
+    Pings without a token stay local. If an owner cannot be reached within
+    ``timeout`` the pings are scored here without its state rather than failed.
+    """
+
+    def __init__(self, scorer, directory=SHARD_DIR, timeout=SHARD_TIMEOUT, refresh=SHARD_REFRESH):
+        self.scorer = scorer
+        self.directory = directory
+        self.timeout = timeout
+        self.refresh = refresh
+        self.address = None
+        self.ring = None
+        self._server = None
+        self._checked = 0.0
+        self._mtime = None
+        self._conns = threading.local()
+        self._lock = threading.Lock()
+        self.handed_off = self.absorbed = 0
+
+    def __getattr__(self, name):
+        return getattr(self.scorer, name)
+
+    # Serving side.
+
+    def start(self, index):
+        """Listen for peers as member ``index``; called in each worker after fork."""
+        self.address = member_address(index, self.directory)
+        if self.address.startswith('unix:'):
+            path = self.address[5:]
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = _UnixServer(path, _PeerHandler)
+        else:
+            host, port = self.address.rsplit(':', 1)
+            self._server = _TCPServer((host, int(port)), _PeerHandler)
+        self._server.shards = self
+        self._mtime = None
+        threading.Thread(target=self._server.serve_forever, name='shard-peer', daemon=True).start()
+
+    def serve_score(self, arrays):
+        cols = {
+            'token_id': arrays['token_id'].tolist(),
+            'timestamp': arrays['timestamp'],
+            'lat': arrays['lat'],
+            'lng': arrays['lng'],
+            'speed': arrays['speed'],
+        }
+        cols, scores = self.scorer.score(cols)
+        return {'speed': cols['speed'], **{name: scores[name] for name in ('anomaly', 'safety', 'reason', 'zone')}}
+
+    def _stores(self):
+        """Per-tourist state that moves with ownership, by name."""
+        stores = {'trajectory': self.scorer.trajectories, 'watchdog': getattr(self.scorer, 'watchdog', None)}
+        return {name: store for name, store in stores.items() if store is not None}
+
+    def absorb(self, arrays):
+        n = 0
+        for name, store in self._stores().items():
+            prefix = f'{name}.'
+            state = {key[len(prefix):]: value for key, value in arrays.items() if key.startswith(prefix)}
+            if state:
+                state['tokens'] = state['tokens'].tolist()
+                n = max(n, store.absorb(state))
+        self.absorbed += n
+        return n
+
+    # Membership.
+
+    def current_ring(self):
+        """Ring for the published member list, re-read at most every ``refresh`` seconds."""
+        if not self.directory:
+            return None
+        now = time.monotonic()
+        if now - self._checked < self.refresh:
+            return self.ring
+        self._checked = now
+        path = os.path.join(self.directory, MEMBERS_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime != self._mtime:
+                with open(path) as f:
+                    members = json.load(f)['members']
+                self._mtime = mtime
+                if self.ring is None or tuple(members) != self.ring.members:
+                    self.ring = HashRing(members) if members else None
+                    if self.ring is not None and self.address is not None:
+                        threading.Thread(target=self.rebalance, args=(self.ring,), daemon=True).start()
+        except (OSError, ValueError, KeyError):
+            log.exception('cannot read shard members from %s', path)
+        return self.ring
+
+    def rebalance(self, ring):
+        """Hand every tourist this worker does not own under ``ring`` to its owner."""
+        with self._lock:
+            stores = self._stores()
+            if not stores or not len(ring):
+                return
+            tokens = list({tok for store in stores.values() for tok in list(store.slots)})
+            if not tokens:
+                return
+            owners = ring.owners(tokens)
+            me = ring.members.index(self.address) if self.address in ring.members else -1
+            for k in np.unique(owners[owners != me]).tolist():
+                moving = [tokens[i] for i in np.nonzero(owners == k)[0].tolist()]
+                message = {}
+                for name, store in stores.items():
+                    state = store.export(moving)
+                    state['tokens'] = np.array(state['tokens'], dtype=str)
+                    message.update({f'{name}.{key}': value for key, value in state.items()})
+                try:
+                    self._call(ring.members[k], HANDOFF, message)
+                except (OSError, RuntimeError):
+                    log.warning('handoff of %d tourists to %s failed; keeping them', len(moving), ring.members[k])
+                    continue
+                for store in stores.values():
+                    store.drop(moving)
+                self.handed_off += len(moving)
+                metrics.SHARD_HANDOFFS.inc(len(moving))
+
+    def drain(self):
+        """Hand all state to the remaining members and stop serving; called when a worker exits."""
+        ring = self.current_ring()
+        if ring is not None and self.address in ring.members:
+            rest = [m for m in ring.members if m != self.address]
+            if rest:
+                self.rebalance(HashRing(rest))
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if self.address.startswith('unix:'):
+                try:
+                    os.unlink(self.address[5:])
+                except OSError:
+                    pass
+
+    # Client side.
+
+    def _call(self, address, kind, arrays):
+        conns = self._conns.__dict__.setdefault('by_address', {})
+        sock = conns.get(address)
+        for attempt in (0, 1):
+            if sock is None:
+                sock = conns[address] = _connect(address, self.timeout)
+            try:
+                _send(sock, kind, arrays)
+                return _recv(sock)[1]
+            except (OSError, ConnectionError):
+                # A pooled connection may have gone stale; retry once on a fresh one.
+                sock.close()
+                conns.pop(address, None)
+                sock = None
+                if attempt:
+                    raise
+
+    def score(self, cols):
+        ring = self.current_ring()
+        tokens = cols['token_id']
+        keyed = [None if tok is None else str(tok) for tok in tokens]
+        local_cols = dict(cols, token_id=keyed)
+        if ring is None:
+            return self._local(cols, local_cols)
+
+        n = len(keyed)
+        me = ring.members.index(self.address) if self.address in ring.members else -1
+        owner = np.full(n, me, dtype=np.int64)
+        has_token = np.array([k is not None for k in keyed], dtype=bool)
+        if has_token.any():
+            owner[has_token] = ring.owners([k for k in keyed if k is not None])
+        if (owner == me).all():
+            return self._local(cols, local_cols)
+
+        speed = np.array(cols['speed'], dtype=np.float64)
+        scores = {'anomaly': np.empty(n), 'safety': np.empty(n),
+                  'reason': np.zeros(n, dtype=np.int64), 'zone': np.full(n, -1, dtype=np.int64)}
+
+        def merge(idx, part_speed, part):
+            speed[idx] = part_speed
+            for name in scores:
+                scores[name][idx] = part[name]
+
+        local = np.nonzero(owner == me)[0]
+        for k in np.unique(owner[owner != me]).tolist():
+            idx = np.nonzero(owner == k)[0]
+            part = _take(local_cols, idx)
+            request = {'token_id': np.array(part['token_id'], dtype=str),
+                       **{name: np.asarray(part[name], dtype=np.float64) for name in ('timestamp', 'lat', 'lng', 'speed')}}
+            try:
+                reply = self._call(ring.members[k], SCORE, request)
+            except (OSError, RuntimeError):
+                log.warning('shard owner %s unreachable; scoring %d pings locally', ring.members[k], len(idx))
+                metrics.SHARD_FALLBACKS.inc(len(idx))
+                local = np.concatenate([local, idx])
+                continue
+            metrics.SHARD_FORWARDED.inc(len(idx))
+            merge(idx, reply['speed'], reply)
+        if len(local):
+            local_out, local_scores = self.scorer.score(_take(local_cols, local))
+            merge(local, local_out['speed'], local_scores)
+        return dict(cols, speed=speed), scores
+
+    def _local(self, cols, local_cols):
+        out, scores = self.scorer.score(local_cols)
+        out['token_id'] = cols['token_id']
+        return out, scores
+
+    def score_records(self, records):
+        cols, scores = self.score(to_columns(records))
+        return format_results(cols, scores, self.scorer.zones)
+
+    def info(self):
+        ring = self.current_ring()
+        return {
+            'enabled': bool(self.directory),
+            'address': self.address,
+            'members': len(ring) if ring is not None else 0,
+            'tracked_tourists': len(self.scorer.trajectories) if self.scorer.trajectories is not None else 0,
+            'handed_off': self.handed_off,
+            'absorbed': self.absorbed,
+        }
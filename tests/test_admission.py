@@ -0,0 +1,57 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_class_limits_and_reserved_share():
+    admission = AdmissionController(capacity=4, queue='critical=0,normal=0,low=0')
+    assert admission.limits == {'critical': 4, 'normal': 3, 'low': 1}
+    admission.acquire('low')
+    with pytest.raises(Overloaded):
+        admission.acquire('low')
+    admission.acquire('normal')
+    admission.acquire('normal')
+    with pytest.raises(Overloaded) as exc:
+        admission.acquire('normal')
+    assert exc.value.cls == 'normal'
+    admission.acquire('critical')
+    with pytest.raises(Overloaded):
+        admission.acquire('critical')
+    assert admission.stats()['rejected'] == {'critical': 1, 'normal': 1, 'low': 1}
+
+
+def test_critical_admitted_with_normal_slots_and_queues_full():
+    admission = AdmissionController(capacity=4, queue='critical=4,normal=2,low=1', wait='critical=5,normal=5,low=5')
+    done = threading.Event()
+
+    def hold(cls):
+        admission.acquire(cls)
+        try:
+            done.wait()
+        finally:
+            admission.release(cls)
+
+    # One thread per request, as gunicorn's gthread pool would run them.
+    with ThreadPoolExecutor(admission.threads_needed()) as pool:
+        try:
+            for cls in ['normal'] * 5 + ['low']:
+                pool.submit(hold, cls)
+            wait_for(lambda: admission.stats()['waiting'] == {'critical': 0, 'normal': 2, 'low': 1})
+            assert admission.stats()['active']['normal'] == 3
+
+            critical = pool.submit(admission.acquire, 'critical')
+            assert critical.result(timeout=1) == 0.0
+            admission.release('critical')
+        finally:
+            done.set()
@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import asgi
+
+
+async def call(method, path, chunks=(b'',), content_type=b'application/json'):
+    """One request through the ASGI app, the body sent in ``chunks``; returns (status, headers, body)."""
+    incoming = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'http_version': '1.1',
+             'headers': [(b'content-type', content_type)]}
+    await asgi.app(scope, receive, send)
+    start, = [m for m in sent if m['type'] == 'http.response.start']
+    body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+    return start['status'], dict(start['headers']), body
+
+
+def test_concurrent_analyze_calls_are_scored_together(monkeypatch):
+    batches = []
+    score_records = asgi.flask_service.scorer.score_records
+    monkeypatch.setattr(asgi.flask_service.scorer, 'score_records',
+                        lambda payloads: batches.append(len(payloads)) or score_records(payloads))
+
+    async def many():
+        pings = [json.dumps({'token_id': f'T-{i}', 'lat': 12.97, 'lng': 77.59}).encode() for i in range(20)]
+        return await asyncio.gather(*(call('POST', '/api/ai/analyze', [ping]) for ping in pings))
+
+    results = asyncio.run(many())
+    assert [status for status, _, _ in results] == [200] * 20
+    assert all(json.loads(body)['success'] for _, _, body in results)
+    assert sum(batches) == 20 and len(batches) < 20
+
+
+def test_analyze_rejects_non_object_payloads():
+    status, headers, body = asyncio.run(call('POST', '/api/ai/analyze', [b'[{"lat": 12.97, ', b'"lng": 77.59}]']))
+    assert status == 400 and headers[b'access-control-allow-origin'] == b'*'
+    assert json.loads(body)['success'] is False
+
+
+def test_other_routes_stream_through_flask():
+    chunks = [b'{"token_id": "T-1", "lat": 12.97, ', b'"lng": 77.59}\n{"token_id": "T-2", "lat": 12.98, "lng": 77.6}\n']
+    status, headers, body = asyncio.run(call('POST', '/api/ai/ingest', chunks, b'application/x-ndjson'))
+    assert status == 200 and headers[b'content-type'] == b'application/x-ndjson'
+    assert [json.loads(line)['token_id'] for line in body.splitlines()] == ['T-1', 'T-2']
+
+    status, _, body = asyncio.run(call('GET', '/health'))
+    assert status == 200 and json.loads(body)['status'] == 'healthy'
@@ -0,0 +1,33 @@
+import numpy as np
+
+from cache import CachedZoneLookup
+from zones import Zone, ZoneRegistry
+
+
+def registry():
+    # Restricted square whose western edge (lng 77.0003) runs through the middle of a cache cell.
+    ring = [[77.0003, 12.0], [77.02, 12.0], [77.02, 12.02], [77.0003, 12.02], [77.0003, 12.0]]
+    triangle = [[77.03, 12.0], [77.05, 12.03], [77.06, 12.001], [77.03, 12.0]]
+    return ZoneRegistry([Zone('cliff', 'Cliff', 'restricted', 1.0, [ring]),
+                         Zone('ghat', 'Ghat', 'high_risk', 0.6, [triangle])])
+
+
+def test_point_just_inside_an_edge_cell_is_in_the_zone():
+    cached = CachedZoneLookup(registry())
+    for _ in range(2):  # miss, then hit
+        risk, index = cached.lookup_batch(np.array([12.005]), np.array([77.00045]))
+        assert risk.tolist() == [1.0] and index.tolist() == [0]
+
+
+def test_cached_lookups_match_exact_lookups():
+    zones = registry()
+    cached = CachedZoneLookup(zones)
+    rng = np.random.default_rng(7)
+    lat = rng.uniform(11.995, 12.035, 20000)
+    lng = rng.uniform(76.995, 77.065, 20000)
+    exact = zones.lookup_batch(lat, lng)
+    for _ in range(2):
+        risk, index = cached.lookup_batch(lat, lng)
+        np.testing.assert_array_equal(risk, exact[0])
+        np.testing.assert_array_equal(index, exact[1])
+    assert cached.cache.hits and cached.exact_lookups < 2 * len(lat)
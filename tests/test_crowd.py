@@ -0,0 +1,33 @@
+import numpy as np
+
+from crowd import CrowdMonitor
+
+
+def ping(monitor, tokens, t, lat=12.9716, lng=77.5946):
+    n = len(tokens)
+    return monitor.update(tokens, np.full(n, lat), np.full(n, lng), np.full(n, float(t)))
+
+
+def test_future_ping_does_not_expire_or_pin_everyone():
+    clock = [1000.0]
+    monitor = CrowdMonitor(window=300, min_points=3, min_size=3, alert_density=1e9, clock=lambda: clock[0])
+    ping(monitor, [f'A{i}' for i in range(10)], 1000)
+    ping(monitor, ['LIAR'], 1000 + 5.5 * 3600)
+    assert len(monitor.tourists) == 11
+
+    # Everyone goes quiet; later pings come from a fresh group only.
+    for step in range(1, 6):
+        clock[0] = 1000.0 + step * 200
+        ping(monitor, [f'B{step}-{i}' for i in range(2)], clock[0])
+    assert set(monitor.tourists) == {f'B{step}-{i}' for step in (4, 5) for i in range(2)}
+    assert sum(monitor.counts.values()) == 4
+
+
+def test_repeated_pings_keep_a_tourist_counted_once():
+    clock = [0.0]
+    monitor = CrowdMonitor(window=60, clock=lambda: clock[0])
+    for t in range(0, 3000, 10):
+        clock[0] = float(t)
+        ping(monitor, ['A', 'B'], t)
+    assert len(monitor.tourists) == 2 and sum(monitor.counts.values()) == 2
+    assert len(monitor._expiry) <= 4 * 2 + 1024
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+import app
+from dispatch import DispatchEngine, UnitGrid, _haversine
+
+
+def test_alerts_go_to_nearest_unit_then_queue_by_priority():
+    engine = DispatchEngine(clock=lambda: 0.0)
+    engine.upsert_unit('far', 10.5, 76.3)
+    engine.upsert_unit('near', 10.01, 76.3)
+    first = engine.submit(10.0, 76.3, 'low')
+    second = engine.submit(10.0, 76.3, 'medium')
+    assert (first.unit_id, second.unit_id) == ('near', 'far')
+
+    low = engine.submit(10.0, 76.3, 'low')
+    critical = engine.submit(10.0, 76.3, 'critical')
+    assert engine.status()['queued'] == 2
+    (alert, unit_id), = engine.release('far')
+    assert (alert.id, unit_id) == (critical.id, 'far')
+    assert engine.submit(0, 0, alert_id=low.id) is low
+
+
+@pytest.mark.parametrize('lat, lng', [('north', 76.3), (91.0, 76.3), (10.0, float('nan')), (10.0, None)])
+def test_bad_position_leaves_unit_untouched(lat, lng):
+    engine = DispatchEngine()
+    engine.upsert_unit('U1', 10.0, 76.3)
+    engine.submit(10.0, 76.3)
+    with pytest.raises((TypeError, ValueError)):
+        engine.release('U1', lat, lng)
+    with pytest.raises((TypeError, ValueError)):
+        engine.upsert_unit('U1', lat, lng)
+    assert engine.units['U1']['alert_id'] is not None
+    assert (engine.units['U1']['lat'], engine.units['U1']['lng']) == (10.0, 76.3)
+
+    engine.release('U1', 10.2, 76.4)
+    assert engine.available.nearest(10.2, 76.4)[0] == 'U1'
+
+
+@pytest.mark.parametrize('path', ['/api/ai/dispatch/alerts', '/api/ai/dispatch/units',
+                                  '/api/ai/dispatch/units/U1/release'])
+def test_routes_reject_non_object_bodies(path):
+    with app.app.test_client().post(path, json=[{'lat': 10.0, 'lng': 76.3}]) as response:
+        assert response.status_code == 400
+
+
+def test_nearest_matches_brute_force_as_units_come_and_go():
+    rng = random.Random(3)
+    grid, units = UnitGrid(), {}
+    for step in range(3000):
+        roll = rng.random()
+        if roll < 0.5 or not units:
+            # Mostly one dense city, some units anywhere.
+            near = rng.random() < 0.9
+            lat, lng = ((rng.uniform(9, 11), rng.uniform(76, 78)) if near
+                        else (rng.uniform(-60, 60), rng.uniform(-170, 170)))
+            grid.add(f'U{step}', lat, lng)
+            units[f'U{step}'] = (lat, lng)
+        elif roll < 0.8:
+            unit_id = rng.choice(sorted(units))
+            grid.remove(unit_id)
+            del units[unit_id]
+        else:
+            lat, lng = (rng.uniform(9, 11), rng.uniform(76, 78)) if roll < 0.9 else (rng.uniform(-60, 60), 0.0)
+            _, d = grid.nearest(lat, lng)
+            assert d == pytest.approx(min(_haversine(lat, lng, *p) for p in units.values()), rel=1e-6, abs=1e-3)
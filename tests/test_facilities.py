@@ -0,0 +1,45 @@
+import pytest
+
+import app
+from facilities import FacilityIndex, parse_facilities
+
+FACILITIES = parse_facilities([
+    {'id': 'h1', 'type': 'hospital', 'lat': 12.970, 'lng': 77.590},
+    {'id': 'h2', 'type': 'hospital', 'lat': 12.990, 'lng': 77.590},
+    {'id': 'p1', 'type': 'police', 'lat': 12.975, 'lng': 77.590},
+    {'id': 'h3', 'type': 'hospital', 'lat': 13.200, 'lng': 77.590},
+])
+
+
+def ids(found):
+    return [facility['id'] for facility, _ in found]
+
+
+def test_k_nearest_per_point_closest_first():
+    index = FacilityIndex(FACILITIES)
+    first, second = index.nearest([12.970, 13.190], [77.590, 77.590], k=2)
+    assert ids(first) == ['h1', 'p1']
+    assert ids(second) == ['h3', 'h2']
+    assert first[1][1] == pytest.approx(556, abs=1)
+    assert ids(index.nearest(12.970, 77.590, 'hospital', k=10)[0]) == ['h1', 'h2', 'h3']
+    assert index.nearest(12.970, 77.590, 'fire', k=3) == [[]]
+    assert ids(index.within(12.970, 77.590, 1000)[0]) == ['h1', 'p1']
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, 'facilities', FacilityIndex(FACILITIES))
+    return app.app.test_client()
+
+
+def test_route_returns_k_nearest(client):
+    with client.post('/api/ai/facilities/nearest', json={'lat': 12.970, 'lng': 77.590, 'k': 2,
+                                                         'type': 'hospital'}) as response:
+        assert response.status_code == 200
+        assert [f['id'] for f in response.json['data']['facilities']] == ['h1', 'h2']
+
+
+@pytest.mark.parametrize('payload', [[{'lat': 12.97, 'lng': 77.59}], {'lat': 12.97, 'lng': 77.59, 'k': 0}])
+def test_route_rejects_bad_requests(client, payload):
+    with client.post('/api/ai/facilities/nearest', json=payload) as response:
+        assert response.status_code == 400
@@ -0,0 +1,34 @@
+import numpy as np
+
+from heatmap import HeatmapGrid
+
+# Rebases happen once pings are more than ~29 min past the base at this half-life.
+REBASE_S = 2000.0
+
+
+def ping(grid, clock, t, lat, lng):
+    clock[0] = t
+    grid.add(np.array([lat]), np.array([lng]), np.array([t]))
+
+
+def test_pruned_tile_never_reuses_an_etag_and_retired_stays_bounded():
+    clock = [0.0]
+    grid = HeatmapGrid(zooms=(10,), half_life=60, decay_step=30, clock=lambda: clock[0])
+    x, y = 732, 474
+    ping(grid, clock, 0.0, 12.9716, 77.5946)
+    assert grid.tile(10, x, y) is not None
+    before = grid.etag(10, x, y)
+
+    # Far from the first ping: the first tile decays away and is pruned at the rebase.
+    ping(grid, clock, REBASE_S, 28.6, 77.2)
+    level = grid.levels[10]
+    assert grid.tile(10, x, y) is None and len(level.retired) == 1
+    # Back within the same decay step.
+    ping(grid, clock, REBASE_S + 1, 12.9716, 77.5946)
+    assert grid.etag(10, x, y) not in (before, f'10-{x}-{y}-1-{grid.epoch()}')
+
+    # Every rebase forgets what was retired in earlier decay steps.
+    for step in range(2, 30):
+        ping(grid, clock, step * REBASE_S, 12.0 + step, 77.0)
+    assert len(level.retired) == 1
+    assert len(grid) == 1
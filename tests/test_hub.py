@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+import pytest
+
+import hub
+from crowd import CrowdMonitor
+from dispatch import DispatchEngine
+from heatmap import HeatmapGrid
+from watchdog import InactivityWatchdog
+
+
+@pytest.fixture
+def served():
+    hub.start({'dispatcher': DispatchEngine(), 'watchdog': InactivityWatchdog(),
+               'crowds': CrowdMonitor(min_points=4, min_size=4, clock=lambda: 1000.0),
+               'heatmap': HeatmapGrid(zooms=(10,))})
+    yield
+    hub.stop()
+
+
+def test_workers_share_one_dispatcher(served):
+    first, second = hub.connect()['dispatcher'], hub.connect()['dispatcher']
+    first.upsert_unit('U1', 10.0, 76.3)
+    assigned = second.submit(10.01, 76.3)
+    queued = first.submit(10.02, 76.3)
+    assert (assigned.unit_id, queued.unit_id) == ('U1', None)
+    assert assigned.id != queued.id
+
+    (alert, unit_id), = second.release('U1')
+    assert (alert.id, unit_id) == (queued.id, 'U1')
+    assert first.status()['assigned_total'] == 2
+    with pytest.raises(KeyError):
+        first.release('U2')
+
+
+def test_workers_share_one_watchdog(served):
+    first, second = hub.connect()['watchdog'], hub.connect()['watchdog']
+    first.update(['T-1'], np.array([12.0]), np.array([77.0]))
+    second.update(['T-2'], np.array([12.0]), np.array([77.0]))
+    assert len(first) == len(second) == 2
+    assert second.forget_token('T-1') and not first.forget_token('T-1')
+
+
+def test_crowd_split_over_workers_is_seen_whole(served):
+    first, second = hub.connect()['crowds'], hub.connect()['crowds']
+    lat, lng, t = np.full(3, 12.9716), np.full(3, 77.5946), np.full(3, 1000.0)
+    first.update(['A1', 'A2', 'A3'], lat, lng, t)
+    assert len(second) == 0
+    second.update(['B1', 'B2', 'B3'], lat, lng, t)
+    assert [c['size'] for c in first.snapshot()] == [6]
+    assert second.stats()['tourists'] == 6
+
+
+def test_workers_serve_the_same_heatmap_tile(served):
+    first, second = hub.connect()['heatmap'], hub.connect()['heatmap']
+    now = np.array([time.time()])
+    first.add(np.array([12.9716]), np.array([77.5946]), now)
+    second.add(np.array([12.9716]), np.array([77.5946]), now)
+    assert first.etag(10, 732, 474) == second.etag(10, 732, 474)
+    assert second.tile(10, 732, 474).sum() == first.tile(10, 732, 474).sum() > 0
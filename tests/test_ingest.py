@@ -0,0 +1,47 @@
+import io
+import json
+
+import app
+from ingest import iter_lines, parse_pings, score_stream
+
+
+class EchoScorer:
+    def __init__(self):
+        self.batches = []
+
+    def score_records(self, records):
+        self.batches.append(len(records))
+        if any(record.get('lat') == 'bad' for record in records):
+            raise ValueError('bad lat')
+        return [{'token_id': record.get('token_id')} for record in records]
+
+
+def test_overlong_lines_are_drained_not_buffered():
+    stream = io.BytesIO(b'{"a": 1}\n' + b'x' * 50 + b'\n{"b": 2}\n')
+    assert list(iter_lines(stream, max_line_bytes=16)) == [b'{"a": 1}\n', None, b'{"b": 2}\n']
+
+
+def test_parse_errors_keep_their_line_numbers():
+    lines = [b'{"token_id": "T-1"}\n', b'\n', b'not json\n', b'[1, 2]\n', None]
+    assert [(n, error) for n, _, error in parse_pings(lines)] == [
+        (1, None), (3, 'invalid JSON'), (4, 'expected a JSON object'), (5, 'line too long')]
+
+
+def test_one_bad_ping_does_not_fail_its_chunk():
+    pings = [{'token_id': 'T-1', 'lat': 1.0}, {'token_id': 'T-2', 'lat': 'bad'}, {'token_id': 'T-3', 'lat': 1.0}]
+    body = ''.join(json.dumps(p) + '\n' for p in pings) + '{oops\n'
+    scorer = EchoScorer()
+    results = [json.loads(line) for line in score_stream(io.BytesIO(body.encode()), scorer, chunk_size=8)]
+    assert results == [{'token_id': 'T-1', 'line': 1}, {'token_id': 'T-2', 'error': 'bad lat', 'line': 2},
+                       {'token_id': 'T-3', 'line': 3}, {'line': 4, 'error': 'invalid JSON'}]
+    assert scorer.batches == [3, 1, 1, 1]
+
+
+def test_route_streams_one_result_per_ping():
+    body = '\n'.join(json.dumps({'token_id': f'T-{i}', 'lat': 12.97, 'lng': 77.59}) for i in range(3))
+    with app.app.test_client().post('/api/ai/ingest', data=body + '\nnope\n',
+                                    content_type='application/x-ndjson') as response:
+        assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+        results = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r['line'] for r in results] == [1, 2, 3, 4]
+    assert [r.get('token_id') for r in results[:3]] == ['T-0', 'T-1', 'T-2'] and 'error' in results[3]
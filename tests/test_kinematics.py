@@ -0,0 +1,40 @@
+import numpy as np
+
+from kinematics import haversine, rolling_track_features, step_kinematics
+from trajectory import TrajectoryStore
+
+
+def tracks(n=600, tourists=5, seed=0):
+    rng = np.random.default_rng(seed)
+    token = np.array([f'T{i}' for i in rng.integers(0, tourists, n)], dtype=object)
+    t = 1.7e9 + 10.0 * rng.permutation(n) + rng.uniform(0, 1, n)
+    lat = 12.97 + rng.normal(0, 5e-4, n)
+    lng = 77.59 + rng.normal(0, 5e-4, n)
+    return token, t, lat, lng
+
+
+def test_steps_follow_each_tourist_in_time_order():
+    token, t, lat, lng = tracks()
+    steps = step_kinematics(token, t, lat, lng)
+    for tok in np.unique(token):
+        rows = np.nonzero(token == tok)[0]
+        rows = rows[np.argsort(t[rows])]
+        assert np.isnan(steps['speed'][rows[0]]) and np.isnan(steps['turn'][rows[0]])
+        dist = haversine(lat[rows[:-1]], lng[rows[:-1]], lat[rows[1:]], lng[rows[1:]])
+        np.testing.assert_allclose(steps['distance'][rows[1:]], dist)
+        np.testing.assert_allclose(steps['speed'][rows[1:]], dist / np.diff(t[rows]))
+    assert all(len(v) == 0 for v in step_kinematics([], [], [], []).values())
+
+
+def test_rolling_features_match_the_live_store():
+    token, t, lat, lng = tracks()
+    order = np.argsort(t)
+    store = TrajectoryStore(window=8)
+    live = store.update(list(token[order]), lat[order], lng[order], t[order])
+    batch = {name: values[order] for name, values in rolling_track_features(token, t, lat, lng, window=8).items()}
+    # A tourist's first ping has no step: NaN here, 0 in the store.
+    later = ~np.isnan(batch['track_speed'])
+    assert later.sum() == len(t) - 5
+    # The store keeps positions as float32 and speeds and turns as float16; pings are 10 s apart or more.
+    for name in ('track_speed', 'mean_speed', 'mean_turn'):
+        np.testing.assert_allclose(live[name][later], batch[name][later], rtol=5e-3, atol=0.05, err_msg=name)
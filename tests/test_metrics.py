@@ -0,0 +1,40 @@
+import app
+import metrics
+
+
+def test_exposition_format():
+    registry = metrics.Registry()
+    hits = registry.counter('hits_total', 'Hits.', labelnames=('route',))
+    latency = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    registry.callback('queue_depth', 'Queued.', lambda: {'a"b': 2, 'c': None}, labelname='queue')
+    hits.inc(1, '/x')
+    hits.inc(2, '/x')
+    for value in (0.05, 0.1, 3.0):
+        latency.observe(value)
+    assert registry.render().splitlines() == [
+        '# HELP hits_total Hits.',
+        '# TYPE hits_total counter',
+        'hits_total{route="/x"} 3',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 3.15',
+        'latency_seconds_count 3',
+        '# HELP queue_depth Queued.',
+        '# TYPE queue_depth gauge',
+        'queue_depth{queue="a\\"b"} 2',
+    ]
+
+
+def test_requests_are_timed_by_route_template():
+    client = app.app.test_client()
+    with client.post('/api/ai/dispatch/units/U-404/release', json={}) as response:
+        assert response.status_code == 404
+    with client.get('/metrics') as response:
+        assert response.content_type == metrics.CONTENT_TYPE
+        body = response.get_data(as_text=True)
+    assert 'ai_request_duration_seconds_count{route="/api/ai/dispatch/units/<unit_id>/release",method="POST",' \
+           'status="404"}' in body
+    assert 'ai_requests_in_flight 1' in body
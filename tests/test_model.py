@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import app
+from model import BUILTIN_VERSION, FEATURES, AnomalyModel, load_model, save_model, synthetic_baseline, train
+
+
+def test_missing_artifact_trains_the_builtin_baseline(tmp_path):
+    model = load_model(str(tmp_path / 'missing.joblib'))
+    assert model.version == BUILTIN_VERSION and model.loaded_at and model.load_seconds >= 0
+    noon = 1.7e9 - 1.7e9 % 86400 + 6.5 * 3600  # 12:00 IST
+    cols = {'speed': np.array([1.3, 80.0]), 'timestamp': np.array([noon, noon - 12 * 3600])}
+    walking, racing = model.predict(cols)
+    assert 0 <= walking < 0.5 < racing <= 1
+    assert model.predict({'speed': np.empty(0), 'timestamp': np.empty(0)}).shape == (0,)
+
+
+def test_saved_artifact_round_trips(tmp_path):
+    path = str(tmp_path / 'models' / 'iforest.joblib')
+    features = synthetic_baseline(500)
+    saved = AnomalyModel(train(features), 'iforest-test')
+    save_model(saved, path)
+    loaded = load_model(path)
+    assert loaded.version == 'iforest-test'
+    np.testing.assert_allclose(loaded.forest.decision_function(features), saved.forest.decision_function(features))
+
+
+def test_artifact_with_other_features_is_refused():
+    with pytest.raises(ValueError):
+        AnomalyModel(None, 'old', FEATURES[:2])
+
+
+def test_health_reports_the_loaded_model():
+    with app.app.test_client().get('/health') as response:
+        assert response.status_code == 200
+        assert response.json['model']['version'] == app.model.version
@@ -0,0 +1,93 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from persistence import SQLiteSink, WriteBehindBuffer
+
+
+def scored(tokens):
+    n = len(tokens)
+    cols = {'token_id': list(tokens), 'lat': np.full(n, 12.97), 'lng': np.full(n, 77.59), 'speed': np.ones(n),
+            'timestamp': np.full(n, 1.7e9)}
+    scores = {'anomaly': np.zeros(n), 'safety': np.ones(n), 'zone': np.full(n, -1)}
+    return cols, scores, [None]
+
+
+class FlakySink:
+    def __init__(self, fail_first=0, reject=()):
+        self.fail_first = fail_first
+        self.reject = set(reject)
+        self.rows = []
+        self.closed = False
+
+    def write(self, batch):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise OSError('connection reset')
+        if self.reject & set(batch['token_id']):
+            raise ValueError('bad row')
+        self.rows += batch['token_id']
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_sqlite_retries_only_a_locked_database(tmp_path):
+    path = str(tmp_path / 'history.db')
+    holder = sqlite3.connect(path)
+    holder.execute('CREATE TABLE t (x)')
+    holder.execute('BEGIN EXCLUSIVE')
+    try:
+        sqlite3.connect(path, timeout=0).execute('INSERT INTO t VALUES (1)')
+    except sqlite3.OperationalError as exc:
+        locked = exc
+    holder.rollback()
+    try:
+        sqlite3.connect(path).execute('INSERT INTO missing VALUES (1)')
+    except sqlite3.OperationalError as exc:
+        missing = exc
+    assert SQLiteSink.retryable(locked) and SQLiteSink.retryable(OSError())
+    assert not SQLiteSink.retryable(missing)
+
+
+def test_lost_connection_is_retried_until_it_clears():
+    sink = FlakySink(fail_first=1)
+    buffer = WriteBehindBuffer(sink, flush_rows=1, max_retries=1)
+    buffer.append(*scored(['T-1', 'T-2']))
+    wait_for(lambda: buffer.written == 2)
+    assert sink.rows == ['T-1', 'T-2'] and buffer.failures == 1 and buffer.quarantined == 0
+    buffer.close()
+    assert sink.closed
+
+
+def test_rejected_rows_are_quarantined_and_the_rest_written():
+    sink = FlakySink(reject={'BAD'})
+    buffer = WriteBehindBuffer(sink, flush_rows=8, max_retries=1)
+    tokens = [f'T-{i}' for i in range(8)]
+    tokens[5] = 'BAD'
+    buffer.append(*scored(tokens))
+    wait_for(lambda: buffer.written == 7)
+    assert buffer.quarantined == 1 and len(buffer) == 0
+    assert sink.rows == [t for t in tokens if t != 'BAD']
+    buffer.close()
+
+
+def test_close_leaves_a_busy_sink_open():
+    release = threading.Event()
+    sink = FlakySink()
+    sink.write = lambda batch: release.wait()
+    buffer = WriteBehindBuffer(sink, flush_rows=1)
+    buffer.append(*scored(['T-1']))
+    wait_for(lambda: len(buffer._chunks) == 0)
+    buffer.close(timeout=0.1)
+    assert not sink.closed
+    release.set()
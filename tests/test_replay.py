@@ -0,0 +1,42 @@
+import json
+
+import numpy as np
+
+import app
+import replay
+
+
+def test_evaluate_matches_alerts_to_incidents():
+    token = np.array(['A', 'A', 'A', 'B', 'C'], dtype=object)
+    timestamp = np.array([100.0, 500.0, 2000.0, 100.0, 100.0])
+    anomaly = np.array([0.9, 0.9, 0.9, 0.1, 0.9])
+    incidents = {'A': np.array([[400.0, 600.0], [5000.0, 5100.0]]), 'B': np.array([[0.0, 200.0]])}
+    assert replay.evaluate(token, timestamp, anomaly, incidents, threshold=0.7, slack=0.0) == {
+        'alerts': 4, 'true_alerts': 1, 'false_alerts': 3, 'precision': 0.25,
+        'incidents': 3, 'detected_incidents': 1, 'recall': 0.3333, 'median_detection_delay_s': 100.0,
+    }
+    assert replay.evaluate(token, timestamp, anomaly, incidents, threshold=0.7, slack=300.0)['true_alerts'] == 2
+
+
+def test_incidents_load_from_json_or_ndjson(tmp_path):
+    items = [{'token_id': 7, 'start': 1700000000000, 'end': 1700000060}, {'token_id': 'B', 'start': 1700000000}]
+    (tmp_path / 'a.json').write_text(json.dumps(items))
+    (tmp_path / 'b.ndjson').write_text('\n'.join(json.dumps(item) for item in items) + '\n')
+    for name in ('a.json', 'b.ndjson'):
+        incidents = replay.load_incidents(str(tmp_path / name))
+        np.testing.assert_array_equal(incidents['7'], [[1.7e9, 1.7e9 + 60]])
+        np.testing.assert_array_equal(incidents['B'], [[1.7e9, 1.7e9]])
+
+
+def test_replay_scores_every_timed_ping_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, '_model', app.model)
+    lines = [json.dumps({'token_id': f'T-{i % 5}', 'lat': 12.97 + i * 1e-5, 'lng': 77.59,
+                         'timestamp': 1.7e9 + i * 10}) for i in range(200)]
+    lines[50] = '{broken'
+    lines[60] = json.dumps({'token_id': 'T-0', 'lat': 12.97, 'lng': 77.59})
+    path = tmp_path / 'pings.ndjson'
+    path.write_text('\n'.join(lines) + '\n')
+    cols, anomaly, stats = replay.replay(str(path), workers=2, chunk_size=16)
+    assert (stats['pings'], stats['invalid_lines'], stats['skipped_without_timestamp']) == (198, 1, 1)
+    assert sorted(cols['timestamp']) == [1.7e9 + i * 10 for i in range(200) if i not in (50, 60)]
+    assert anomaly.shape == (198,) and ((anomaly >= 0) & (anomaly <= 1)).all()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import app
+from model import TZ_OFFSET_HOURS
+from route_safety import NIGHT_RISK, densify, score_routes
+from zones import Zone, ZoneRegistry
+
+# Local noon and local midnight on some day.
+NOON = (12 - TZ_OFFSET_HOURS) * 3600.0 + 20000 * 86400.0
+MIDNIGHT = NOON + 12 * 3600.0
+
+
+def zones():
+    ring = [[77.000, 12.000], [77.010, 12.000], [77.010, 12.010], [77.000, 12.010], [77.000, 12.000]]
+    return ZoneRegistry([Zone('market', 'market', 'high_risk', 0.8, [ring])])
+
+
+def test_densify_caps_spacing_and_keeps_vertices():
+    lat, lng = np.array([12.0, 12.001, 12.001]), np.array([77.0, 77.0, 77.001])
+    d_lat, d_lng, segment, step = densify(lat, lng, spacing=25)
+    assert (step[:-1] <= 25).all() and step[-1] == 0
+    assert step.sum() == pytest.approx(111.2 + 108.7, abs=1)
+    assert (d_lat[-1], d_lng[-1]) == (12.001, 77.001)
+    assert segment[0] == 0 and segment[-1] == 1
+
+
+def test_route_through_zone_scores_below_detour():
+    through = {'id': 'through', 'points': [[11.995, 77.005], [12.015, 77.005]]}
+    around = {'id': 'around', 'points': [[11.995, 77.005], [11.995, 77.015], [12.015, 77.015], [12.015, 77.005]]}
+    day = {r['route_id']: r for r in score_routes([through, around], zones(), NOON)}
+    assert day['around']['safety_score'] == 1.0 and day['around']['zones'] == []
+    assert day['through']['safety_score'] < 0.7 and day['through']['zones'] == ['market']
+    assert day['through']['risk_exposure_m'] == pytest.approx(1112, abs=30)
+    assert max(day['through']['segment_safety']) < 1.0
+
+    night, = score_routes([around], zones(), MIDNIGHT)
+    assert night['safety_score'] == pytest.approx(1 - NIGHT_RISK)
+    with pytest.raises(ValueError):
+        score_routes([around], zones(), NOON, mode='flying')
+
+
+@pytest.mark.parametrize('payload', [[{'points': [[12.0, 77.0], [12.1, 77.1]]}], {'routes': []},
+                                     {'routes': [{'points': [[12.0, 77.0]]}]}])
+def test_route_rejects_bad_requests(payload):
+    with app.app.test_client().post('/api/ai/routes/score', json=payload) as response:
+        assert response.status_code == 400
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+import app
+from scoring import to_columns
+
+
+def test_to_columns_reads_both_ping_forms():
+    cols = to_columns([{'token_id': 'T-1', 'lat': 12.9, 'lng': 77.5, 'speed': 1.5, 'timestamp': 1700000000000},
+                       {'token_id': 7, 'location': {'lat': '13.0', 'lng': 77.6}},
+                       {'lat': 13.1, 'lng': 77.7}])
+    assert cols['token_id'] == ['T-1', 7, None]
+    np.testing.assert_array_equal(cols['lat'], [12.9, 13.0, 13.1])
+    assert cols['timestamp'][0] == 1700000000.0
+    assert np.isnan(cols['speed'][1:]).all() and np.isnan(cols['timestamp'][1:]).all()
+
+
+@pytest.mark.parametrize('token_id', [['T-1'], {'id': 'T-1'}, 1.5, True])
+def test_to_columns_rejects_unhashable_or_odd_token_ids(token_id):
+    with pytest.raises(ValueError):
+        to_columns([{'token_id': token_id, 'lat': 12.9, 'lng': 77.5}])
+
+
+def test_analyze_answers_400_for_bad_token_id():
+    with app.app.test_client().post('/api/ai/analyze', json={'token_id': ['T-1'], 'lat': 12.9,
+                                                             'lng': 77.5}) as response:
+        assert response.status_code == 400
@@ -0,0 +1,56 @@
+import numpy as np
+
+from segments import SegmentSink, SegmentStore, query_shards
+
+
+def pings(n, tourists=7, seed=0):
+    rng = np.random.default_rng(seed)
+    return {'token_id': [f'T-{i}' for i in rng.integers(0, tourists, n)],
+            'timestamp': 1.7e9 + rng.uniform(0, 3600, n),
+            'lat': rng.uniform(12, 13, n), 'lng': rng.uniform(77, 78, n),
+            'speed': rng.uniform(0, 5, n)}
+
+
+def test_query_matches_a_scan_across_sealed_and_active_segments(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_rows=64)
+    data = pings(300)
+    for lo in range(0, 300, 37):
+        store.write({name: col[lo:lo + 37] for name, col in data.items()})
+    assert store.stats() == {'rows': 300, 'sealed_segments': 4, 'active_rows': 44, 'tourists': 7}
+
+    token = np.array(data['token_id'])
+    start, end = 1.7e9 + 600, 1.7e9 + 2400
+    for name in ('T-0', 'T-3'):
+        rows = np.nonzero((token == name) & (data['timestamp'] >= start) & (data['timestamp'] <= end))[0]
+        rows = rows[np.argsort(data['timestamp'][rows])]
+        found = store.query(name, start, end)
+        np.testing.assert_array_equal(found['timestamp'], data['timestamp'][rows])
+        np.testing.assert_array_equal(found['lat'], data['lat'][rows])
+    assert len(store.query('nobody')['timestamp']) == 0
+    assert len(store.between(start, end)['token_id']) == np.count_nonzero(
+        (data['timestamp'] >= start) & (data['timestamp'] <= end))
+
+
+def test_reader_picks_up_new_rows_and_reopened_writer_resumes(tmp_path):
+    writer = SegmentStore(str(tmp_path), segment_rows=64)
+    data = pings(40)
+    writer.write({name: col[:20] for name, col in data.items()})
+    reader = SegmentStore(str(tmp_path), readonly=True)
+    assert len(reader) == 20
+    writer.write({name: col[20:] for name, col in data.items()})
+    reader.refresh()
+    assert len(reader) == 40
+    writer.close()
+    assert len(SegmentStore(str(tmp_path), segment_rows=64)) == 40
+
+
+def test_each_writer_gets_its_own_store_and_queries_merge(tmp_path):
+    first, second = SegmentSink(str(tmp_path)), SegmentSink(str(tmp_path))
+    data = pings(20, tourists=1)
+    first.write({name: col[::2] for name, col in data.items()})
+    second.write({name: col[1::2] for name, col in data.items()})
+    assert (first.store.root, second.store.root) == (str(tmp_path / 'writer-0'), str(tmp_path / 'writer-1'))
+    first.close()
+    second.close()
+    found = query_shards(str(tmp_path), 'T-0')
+    np.testing.assert_array_equal(found['timestamp'], np.sort(data['timestamp']))
@@ -0,0 +1,50 @@
+import numpy as np
+
+import app
+from online import OnlineBaseline
+from scoring import Scorer
+from sharding import HashRing, ShardedScorer, write_members
+from trajectory import TrajectoryStore
+
+
+def test_ring_moves_about_one_in_n_keys_per_member_change():
+    keys = [f'T-{i}' for i in range(20000)]
+    members = [f'unix:/run/w{i}.sock' for i in range(4)]
+    before = HashRing(members).owners(keys)
+    np.testing.assert_array_equal(HashRing(members).owners(keys), before)
+    assert np.bincount(before).min() > 20000 / 4 * 0.6
+
+    grown = HashRing(members + ['unix:/run/w4.sock']).owners(keys)
+    moved = grown != before
+    assert (grown[moved] == 4).all() and 0.1 < moved.mean() < 0.3
+
+    shrunk = HashRing(members[:2] + members[3:]).owners(keys)
+    # Indices after the removed member shift down by one.
+    remapped = np.array([0, 1, 2, 2])[before]
+    moved = shrunk != remapped
+    assert (before[moved] == 2).all() and 0.1 < moved.mean() < 0.4
+
+
+def shard(directory, index):
+    scorer = ShardedScorer(Scorer(app.model, None, TrajectoryStore(), OnlineBaseline()), str(directory), refresh=0)
+    scorer.start(index)
+    return scorer
+
+
+def test_pings_are_scored_by_their_owner_and_handed_over_on_exit(tmp_path):
+    first, second = shard(tmp_path, 0), shard(tmp_path, 1)
+    write_members([0, 1], str(tmp_path))
+    tokens = [f'T-{i}' for i in range(40)]
+    n = len(tokens)
+    cols = {'token_id': tokens, 'timestamp': np.full(n, 1.7e9), 'lat': np.full(n, 12.97),
+            'lng': np.full(n, 77.59), 'speed': np.full(n, np.nan)}
+    _, scores = first.score(cols)
+    assert len(scores['anomaly']) == n and not np.isnan(scores['anomaly']).any()
+
+    owners = first.current_ring().owners(tokens)
+    assert set(first.scorer.trajectories.slots) == {t for t, k in zip(tokens, owners) if k == 0}
+    assert set(second.scorer.trajectories.slots) == {t for t, k in zip(tokens, owners) if k == 1}
+
+    second.drain()
+    assert set(first.scorer.trajectories.slots) == set(tokens) and len(second.scorer.trajectories) == 0
+    first.drain()
@@ -0,0 +1,41 @@
+import numpy as np
+
+from trajectory import FEATURE_NAMES, TrajectoryStore
+
+
+def walk(n, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = 12.9716 + np.cumsum(rng.normal(0, 2e-4, n))
+    lng = 77.5946 + np.cumsum(rng.normal(0, 2e-4, n))
+    # Stand still now and then so dwell anchors get exercised.
+    lat[40:60], lng[40:60] = lat[40], lng[40]
+    t = 1.7e9 + np.cumsum(rng.uniform(1, 30, n))
+    return lat, lng, t
+
+
+def test_backlog_in_one_batch_matches_ping_by_ping():
+    lat, lng, t = walk(200)
+    one_by_one = TrajectoryStore(window=8)
+    expected = {name: [] for name in FEATURE_NAMES}
+    for i in range(len(t)):
+        features = one_by_one.update(['T1'], lat[i:i + 1], lng[i:i + 1], t[i:i + 1])
+        for name in FEATURE_NAMES:
+            expected[name].append(features[name][0])
+
+    batched = TrajectoryStore(window=8)
+    batched.update(['T1'] * 5, lat[:5], lng[:5], t[:5])
+    # Shuffled, with a duplicate and a ping older than the ring.
+    order = np.random.default_rng(1).permutation(np.arange(5, len(t)))
+    tokens = ['T1'] * (len(order) + 2)
+    features = batched.update(tokens, np.r_[lat[order], lat[7], lat[0]], np.r_[lng[order], lng[7], lng[0]],
+                              np.r_[t[order], t[7], t[0]])
+    for name in FEATURE_NAMES:
+        got = np.empty(len(t))
+        got[order] = features[name][:len(order)]
+        np.testing.assert_allclose(got[5:], np.array(expected[name])[5:], rtol=1e-6, atol=1e-6, err_msg=name)
+    assert np.isnan(features['track_speed'][-2:]).all()
+
+    slot_a, slot_b = one_by_one.slots['T1'], batched.slots['T1']
+    for name in ('head', 'count', 'anchor_t', 'speed_sum', 'turn_sum'):
+        np.testing.assert_allclose(getattr(batched, name)[slot_b], getattr(one_by_one, name)[slot_a], err_msg=name)
+    np.testing.assert_array_equal(batched.speed[slot_b], one_by_one.speed[slot_a])
@@ -0,0 +1,63 @@
+import numpy as np
+
+from cache import CachedZoneLookup
+from watchdog import InactivityWatchdog, silence_thresholds
+from zones import Zone, ZoneRegistry
+
+
+def square(zone_id, level, lng, lat, size=0.01, **properties):
+    ring = [[lng, lat], [lng + size, lat], [lng + size, lat + size], [lng, lat + size], [lng, lat]]
+    return Zone(zone_id, zone_id, level, 1.0, [ring], properties)
+
+
+def two_zones():
+    return ZoneRegistry([square('park', 'high_risk', 77.0, 12.0, silence_minutes=10),
+                         square('cliff', 'restricted', 77.1, 12.0)])
+
+
+def test_thresholds_follow_each_zone():
+    zones = two_zones()
+    expected = [600.0, 1800.0, 7200.0]
+    np.testing.assert_array_equal(silence_thresholds(zones), expected)
+    np.testing.assert_array_equal(silence_thresholds(CachedZoneLookup(zones)), expected)
+    np.testing.assert_array_equal(silence_thresholds(zones.zones), expected)
+
+
+def test_ping_in_second_zone_escalates_on_its_threshold():
+    zones = two_zones()
+    events = []
+    watchdog = InactivityWatchdog(silence_thresholds(zones), zone_ids=zones.ids, on_event=events.append,
+                                  clock=lambda: 0.0)
+    lat, lng = np.array([12.005, 12.005]), np.array([77.105, 77.5])
+    _, zone_index = zones.lookup_batch(lat, lng)
+    assert zone_index.tolist() == [1, -1]
+    watchdog.update(['T-1', 'T-2'], lat, lng, zone_index, now=0.0)
+    watchdog.advance(1799.0)
+    assert not events
+    watchdog.advance(1800.0)
+    assert [(e['token_id'], e['event'], e['zone_id']) for e in events] == [('T-1', 'overdue', 'cliff')]
+
+
+def test_thresholds_must_match_zone_ids():
+    try:
+        InactivityWatchdog(np.array([7200.0]), zone_ids=['park', None])
+    except AssertionError:
+        return
+    raise AssertionError('mismatched thresholds accepted')
+
+
+def test_ping_times_are_per_ping_and_latest_wins():
+    events = []
+    watchdog = InactivityWatchdog(np.array([100.0]), on_event=events.append, max_skew=10.0, clock=lambda: 1000.0)
+    lat, lng = np.array([12.0, 12.1, 12.2, 12.3]), np.array([77.0, 77.1, 77.2, 77.3])
+    watchdog.update(['T-1', 'T-1', 'T-2', 'T-3'], lat, lng, now=np.array([950.0, 900.0, 5000.0, 990.0]))
+    assert watchdog.last_seen[watchdog.slots['T-1']] == 950.0
+    assert watchdog.lat[watchdog.slots['T-1']] == np.float32(12.0)
+    # Dated in the future: counts as clock + skew.
+    assert watchdog.last_seen[watchdog.slots['T-2']] == 1010.0
+
+    # A ping older than the one held changes nothing.
+    watchdog.update(['T-3'], lat[:1], lng[:1], now=980.0)
+    assert watchdog.last_seen[watchdog.slots['T-3']] == 990.0
+    watchdog.advance(1051.0)
+    assert [e['token_id'] for e in events] == ['T-1']
@@ -0,0 +1,38 @@
+import io
+
+import numpy as np
+import pytest
+
+import wire
+
+
+def test_ping_frame_carries_string_tokens():
+    data = wire.encode_pings(['TOURIST-1', None, 'TOURIST-2', 'TOURIST-1'], [10.0, 10.1, 10.2, 10.3],
+                             [76.3, 76.4, 76.5, 76.6], timestamp_ms=[1_700_000_000_000] * 4)
+    cols = wire.decode_pings(data)
+    assert list(cols['token_id']) == ['TOURIST-1', None, 'TOURIST-2', 'TOURIST-1']
+    assert cols['token_table'] == ['TOURIST-1', 'TOURIST-2']
+    np.testing.assert_array_equal(cols['token'], [0, -1, 1, 0])
+    np.testing.assert_allclose(cols['timestamp'], 1.7e9)
+
+    frames = list(wire.read_frames(io.BytesIO(data + data), max_rows=10))
+    assert [list(f['token_id']) for f in frames] == [list(cols['token_id'])] * 2
+
+
+def test_result_frame_echoes_the_token_table():
+    cols = wire.decode_pings(wire.encode_pings(['A', 'B', None], [0.0] * 3, [0.0] * 3))
+    scores = {'anomaly': np.zeros(3), 'safety': np.ones(3), 'zone': np.array([-1, 0, 0]),
+              'reason': np.zeros(3, dtype=np.int64)}
+    (frame,) = wire.decode_results(wire.encode_results(cols, scores, ['Z']))
+    assert frame['token_ids'] == ['A', 'B']
+    np.testing.assert_array_equal(frame['token'], [0, 1, -1])
+    assert frame['zone_ids'] == ['Z']
+
+
+def test_bad_token_table_is_rejected():
+    data = bytearray(wire.encode_pings(['A'], [0.0], [0.0]))
+    data[wire.HEADER.size + 8:wire.HEADER.size + 12] = np.int32(3).tobytes()
+    with pytest.raises(wire.WireError, match='outside the token table'):
+        wire.decode_pings(bytes(data))
+    with pytest.raises(wire.WireError, match='list of strings'):
+        wire.decode_pings(wire.encode_pings([], [], [])[:-2] + b'{}')
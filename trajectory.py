@@ -0,0 +1,320 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+from kinematics import EARTH_RADIUS_M, haversine, steps_between, turns_since_move
+
+TRAJECTORY_WINDOW = int(os.getenv('TRAJECTORY_WINDOW', 16))
+TRAJECTORY_MAX_IDLE = float(os.getenv('TRAJECTORY_MAX_IDLE', 6 * 3600))
+
+# A tourist is "dwelling" while every ping stays within this radius of the anchor point.
+DWELL_RADIUS_M = 50.0
+# GPS jumps can imply absurd speeds; cap them so they fit the float16 ring.
+MAX_TRACK_SPEED = 1000.0
+
+FEATURE_NAMES = ('track_speed', 'mean_speed', 'speed_std', 'heading_change', 'mean_turn', 'dwell', 'points')
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    """Scalar ``kinematics.haversine``, for walking one tourist's pings."""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class TrajectoryStore:
+    """Recent pings per tourist in struct-of-arrays ring buffers.
+
+    Every tourist owns one row (slot) in a set of fixed-width arrays. Rolling
+    sums are updated as values enter and leave the ring, so each ping costs
+    O(1) regardless of the window size. Rows of idle tourists are recycled.
+
+    To keep a row near 300 bytes at the default window, ring timestamps are
+    float32 offsets from a per-row base time, and speeds and turns are float16.
+    """
+
+    def __init__(self, window=TRAJECTORY_WINDOW, capacity=1024, max_idle=TRAJECTORY_MAX_IDLE):
+        self.window = window
+        self.max_idle = max_idle
+        self.slots = {}
+        self.tokens = []
+        self._free = []
+        self._lock = threading.Lock()
+        self._updates_since_evict = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        w = self.window
+        self.capacity = capacity
+        self.lat = np.zeros((capacity, w), dtype=np.float32)
+        self.lng = np.zeros((capacity, w), dtype=np.float32)
+        self.t = np.zeros((capacity, w), dtype=np.float32)
+        self.speed = np.zeros((capacity, w), dtype=np.float16)
+        self.turn = np.zeros((capacity, w), dtype=np.float16)
+        self.t_base = np.zeros(capacity, dtype=np.float64)
+        self.head = np.zeros(capacity, dtype=np.int16)
+        self.count = np.zeros(capacity, dtype=np.int16)
+        self.speed_sum = np.zeros(capacity, dtype=np.float64)
+        self.speed_sq_sum = np.zeros(capacity, dtype=np.float64)
+        self.turn_sum = np.zeros(capacity, dtype=np.float64)
+        self.last_bearing = np.full(capacity, np.nan, dtype=np.float32)
+        self.anchor_lat = np.zeros(capacity, dtype=np.float32)
+        self.anchor_lng = np.zeros(capacity, dtype=np.float32)
+        self.anchor_t = np.zeros(capacity, dtype=np.float64)
+
+    def _grow(self):
+        old = {name: getattr(self, name) for name in self._array_names()}
+        self._alloc(self.capacity + self.capacity // 2)
+        for name, values in old.items():
+            getattr(self, name)[:len(values)] = values
+
+    @staticmethod
+    def _array_names():
+        return ('lat', 'lng', 't', 'speed', 'turn', 't_base', 'head', 'count', 'speed_sum', 'speed_sq_sum',
+                'turn_sum', 'last_bearing', 'anchor_lat', 'anchor_lng', 'anchor_t')
+
+    def __len__(self):
+        return len(self.slots)
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self._array_names())
+
+    def _slot(self, token):
+        slot = self.slots.get(token)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.tokens[slot] = token
+            else:
+                slot = len(self.tokens)
+                if slot >= self.capacity:
+                    self._grow()
+                self.tokens.append(token)
+            self.slots[token] = slot
+            self._reset(slot)
+        return slot
+
+    def _reset(self, slot):
+        for name in ('head', 'count', 'speed_sum', 'speed_sq_sum', 'turn_sum'):
+            getattr(self, name)[slot] = 0
+        self.last_bearing[slot] = np.nan
+
+    def update(self, tokens, lat, lng, t):
+        """Push one batch of pings and return per-ping feature arrays (in input order).
+
+        Pings without a token or coordinates are not stored and get NaN features,
+        as do pings no newer than the tourist's previous one. A tourist may appear
+        many times in a batch (a gateway flushing its backlog): steps and rolling
+        sums are computed for the whole batch at once over each tourist's ring
+        followed by its new pings, and only the final state goes back into the ring.
+        """
+        n = len(tokens)
+        out = {name: np.full(n, np.nan) for name in FEATURE_NAMES}
+        usable = np.array([tok is not None for tok in tokens], dtype=bool)
+        usable &= (np.abs(lat) <= 90) & (np.abs(lng) <= 180) & ~np.isnan(t)
+        idx = np.nonzero(usable)[0]
+        if not len(idx):
+            return out
+
+        with self._lock:
+            slots = np.fromiter((self._slot(tokens[i]) for i in idx), dtype=np.int64, count=len(idx))
+            order = np.lexsort((t[idx], slots))
+            idx, slots = idx[order], slots[order]
+            t_in = np.asarray(t[idx], dtype=np.float64)
+            # Only pings newer than the tourist's last one count: newer than the ring, and no
+            # duplicate timestamps within the batch.
+            first = np.r_[True, slots[1:] != slots[:-1]]
+            last = (self.head[slots] - 1) % self.window
+            newer = (self.count[slots] == 0) | (t_in > self.t_base[slots] + self.t[slots, last])
+            newer &= first | (t_in > np.r_[-np.inf, t_in[:-1]])
+            idx, slots = idx[newer], slots[newer]
+            if len(idx):
+                self._push(slots, np.asarray(lat[idx], dtype=np.float64), np.asarray(lng[idx], dtype=np.float64),
+                           np.asarray(t[idx], dtype=np.float64), out, idx)
+
+            self._updates_since_evict += len(idx)
+            if self._updates_since_evict >= 10000 and len(idx):
+                self._evict_idle(float(np.max(t[idx])))
+        return out
+
+    def _push(self, s, lat, lng, t, out, dest):
+        """Append pings grouped by slot and sorted by time within each (all newer than the ring)."""
+        w = self.window
+        n = len(s)
+        pos = np.arange(n)
+        first = np.r_[True, s[1:] != s[:-1]]
+        starts = np.nonzero(first)[0]
+        group = np.cumsum(first) - 1
+        k = np.diff(np.r_[starts, n])
+        rows = s[starts]
+        count0 = self.count[rows].astype(np.int64)
+        head0 = self.head[rows].astype(np.int64)
+        rank = pos - starts[group]
+
+        # Each ping's predecessor: the previous ping in the batch, or the ring's latest entry.
+        # Batch predecessors are rounded like the ring would store them.
+        ring_last = (head0 - 1) % w
+        t_base = np.where(count0 > 0, self.t_base[rows], t[starts])[group]
+        prev_lat, prev_lng, prev_t = np.empty(n), np.empty(n), np.empty(n)
+        prev_lat[1:] = lat[:-1].astype(np.float32)
+        prev_lng[1:] = lng[:-1].astype(np.float32)
+        prev_t[1:] = t_base[1:] + (t[:-1] - t_base[1:]).astype(np.float32)
+        prev_lat[starts], prev_lng[starts] = self.lat[rows, ring_last], self.lng[rows, ring_last]
+        prev_t[starts] = self.t_base[rows] + self.t[rows, ring_last]
+        has_prev = np.ones(n, dtype=bool)
+        has_prev[starts] = count0 > 0
+
+        # The same step kernels as kinematics.step_kinematics, but each tourist's first
+        # predecessor comes from the ring and turns carry on from its last bearing.
+        dist, _, speed, heading = steps_between(prev_lat, prev_lng, prev_t, lat, lng, t)
+        dist = np.where(has_prev, dist, 0.0)
+        speed = np.where(has_prev, speed, 0.0)
+        moved = has_prev & (dist > 1.0)
+        turn, moved_at = turns_since_move(heading, moved, starts[group], self.last_bearing[rows][group])
+        # Rounded to their storage dtype so the ring and the rolling sums agree.
+        speed = np.minimum(speed, MAX_TRACK_SPEED).astype(np.float16).astype(np.float64)
+        turn = turn.astype(np.float16).astype(np.float64)
+
+        # Window sums over each tourist's ring entries (oldest first) followed by its new pings.
+        held = np.minimum(count0, w)
+        base = np.r_[0, np.cumsum(held + k)[:-1]]
+        ring_group = np.repeat(np.arange(len(rows)), held)
+        ring_rank = np.arange(len(ring_group)) - np.repeat(np.r_[0, np.cumsum(held)[:-1]], held)
+        ring_at = base[ring_group] + ring_rank
+        ring_col = (head0[ring_group] - held[ring_group] + ring_rank) % w
+        at = base[group] + held[group] + rank
+        lo = np.maximum(at - w + 1, base[group])
+        ring_speed = self.speed[rows[ring_group], ring_col].astype(np.float64)
+        ring_turn = self.turn[rows[ring_group], ring_col].astype(np.float64)
+        sums = {}
+        for name, ring, values in (('speed', ring_speed, speed), ('speed_sq', ring_speed ** 2, speed ** 2),
+                                   ('turn', ring_turn, turn)):
+            seq = np.zeros(len(ring) + n)
+            seq[ring_at] = ring
+            seq[at] = values
+            c = np.r_[0.0, np.cumsum(seq)]
+            sums[name] = c[at + 1] - c[lo]
+        # count runs one past the window so the first ping (which has no speed)
+        # is only counted until it is evicted.
+        count = np.minimum(count0[group] + rank + 1, w + 1)
+        anchor_t = self._dwell_anchors(rows, group, starts, k, count0, lat, lng, t)
+
+        samples = np.maximum(np.minimum(count - 1, w), 1).astype(np.float64)
+        mean = sums['speed'] / samples
+        out['track_speed'][dest] = speed
+        out['mean_speed'][dest] = mean
+        out['speed_std'][dest] = np.sqrt(np.maximum(sums['speed_sq'] / samples - mean * mean, 0.0))
+        out['heading_change'][dest] = turn
+        out['mean_turn'][dest] = sums['turn'] / samples
+        out['dwell'][dest] = t - anchor_t
+        out['points'][dest] = np.minimum(count, w)
+
+        # Fold the final state of each tourist back into its row.
+        ends = starts + k - 1
+        self.t_base[rows] = np.where(count0 > 0, self.t_base[rows], t[starts])
+        self._rebase(rows, t[ends])
+        kept = rank >= k[group] - w
+        rs, col = s[kept], (head0[group] + rank)[kept] % w
+        self.lat[rs, col], self.lng[rs, col] = lat[kept], lng[kept]
+        self.t[rs, col] = t[kept] - self.t_base[rs]
+        self.speed[rs, col], self.turn[rs, col] = speed[kept], turn[kept]
+        self.head[rows] = (head0 + k) % w
+        self.count[rows] = count[ends]
+        self.speed_sum[rows] = sums['speed'][ends]
+        self.speed_sq_sum[rows] = sums['speed_sq'][ends]
+        self.turn_sum[rows] = sums['turn'][ends]
+        turned = moved_at[ends] >= starts
+        self.last_bearing[rows[turned]] = heading[moved_at[ends][turned]]
+
+    def _dwell_anchors(self, rows, group, starts, k, count0, lat, lng, t):
+        """Anchor time per ping: a new anchor starts at a tourist's first ping or once a ping
+        leaves ``DWELL_RADIUS_M`` of the current anchor. Updates the rows' anchors.
+
+        Each anchor depends on the one before, so tourists with several pings in the
+        batch are walked in order; everyone else is handled in one vectorized step.
+        """
+        anchor_t = np.empty(len(t))
+        single = k == 1
+        one = starts[single]
+        r = rows[single]
+        dist = haversine(self.anchor_lat[r].astype(np.float64), self.anchor_lng[r].astype(np.float64),
+                         lat[one], lng[one])
+        away = (count0[single] == 0) | (dist > DWELL_RADIUS_M)
+        self.anchor_lat[r] = np.where(away, lat[one], self.anchor_lat[r])
+        self.anchor_lng[r] = np.where(away, lng[one], self.anchor_lng[r])
+        self.anchor_t[r] = np.where(away, t[one], self.anchor_t[r])
+        anchor_t[one] = self.anchor_t[r]
+
+        lat_l, lng_l, t_l = lat.tolist(), lng.tolist(), t.tolist()
+        # Anchors are compared as stored (float32), like anchors carried over from earlier batches.
+        lat32, lng32 = lat.astype(np.float32).tolist(), lng.astype(np.float32).tolist()
+        for g in np.nonzero(~single)[0].tolist():
+            row, lo = int(rows[g]), int(starts[g])
+            a_lat, a_lng, a_t = float(self.anchor_lat[row]), float(self.anchor_lng[row]), float(self.anchor_t[row])
+            fresh = count0[g] == 0
+            for i in range(lo, lo + int(k[g])):
+                if fresh or _haversine(a_lat, a_lng, lat_l[i], lng_l[i]) > DWELL_RADIUS_M:
+                    a_lat, a_lng, a_t = lat32[i], lng32[i], t_l[i]
+                    fresh = False
+                anchor_t[i] = a_t
+            self.anchor_lat[row], self.anchor_lng[row], self.anchor_t[row] = a_lat, a_lng, a_t
+        return anchor_t
+
+    def _rebase(self, s, t):
+        # Keep float32 offsets below ~18 h so they stay millisecond-accurate.
+        stale = t - self.t_base[s] > 2 ** 16
+        if stale.any():
+            rows = s[stale]
+            shift = t[stale] - self.t_base[rows]
+            self.t[rows] -= shift[:, None].astype(np.float32)
+            self.t_base[rows] += shift
+
+    def history(self, token):
+        """Stored pings for one tourist, oldest first, as (t, lat, lng) arrays."""
+        with self._lock:
+            slot = self.slots.get(token)
+            if slot is None:
+                return np.empty(0), np.empty(0), np.empty(0)
+            count, head = min(int(self.count[slot]), self.window), int(self.head[slot])
+            order = np.arange(head - count, head) % self.window
+            t = self.t_base[slot] + self.t[slot, order].astype(np.float64)
+            return t, self.lat[slot, order].copy(), self.lng[slot, order].copy()
+
+    def export(self, tokens):
+        """Ring state of ``tokens`` that are held here, as arrays, for handing to another store."""
+        with self._lock:
+            held = [tok for tok in tokens if tok in self.slots]
+            rows = np.array([self.slots[tok] for tok in held], dtype=np.int64)
+            state = {name: getattr(self, name)[rows] for name in self._array_names()}
+        state['tokens'] = held
+        return state
+
+    def drop(self, tokens):
+        with self._lock:
+            for tok in tokens:
+                slot = self.slots.pop(tok, None)
+                if slot is not None:
+                    self.tokens[slot] = None
+                    self._free.append(slot)
+
+    def absorb(self, state):
+        """Take over tourists exported by another store; ones already tracked here keep their own state."""
+        with self._lock:
+            new = np.array([i for i, tok in enumerate(state['tokens']) if tok not in self.slots], dtype=np.int64)
+            slots = np.fromiter((self._slot(state['tokens'][i]) for i in new.tolist()), dtype=np.int64,
+                                count=len(new))
+            for name in self._array_names():
+                getattr(self, name)[slots] = state[name][new]
+        return len(new)
+
+    def _evict_idle(self, now):
+        self._updates_since_evict = 0
+        live = np.array([tok is not None for tok in self.tokens], dtype=bool)
+        rows = np.arange(len(self.tokens))
+        last_t = self.t_base[rows] + self.t[rows, (self.head[rows] - 1) % self.window]
+        for slot in np.nonzero(live & (now - last_t > self.max_idle))[0].tolist():
+            del self.slots[self.tokens[slot]]
+            self.tokens[slot] = None
+            self._free.append(slot)
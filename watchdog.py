@@ -0,0 +1,345 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from zones import ZoneRegistry
+
+# Seconds of silence before a tourist is overdue, outside any zone and inside each zone level.
+# A zone can set its own with a ``silence_minutes`` property.
+WATCHDOG_SILENCE = float(os.getenv('WATCHDOG_SILENCE', 2 * 3600))
+WATCHDOG_SILENCE_HIGH_RISK = float(os.getenv('WATCHDOG_SILENCE_HIGH_RISK', 3600))
+WATCHDOG_SILENCE_RESTRICTED = float(os.getenv('WATCHDOG_SILENCE_RESTRICTED', 1800))
+# Escalation stages as multiples of the zone's threshold.
+WATCHDOG_STAGES = tuple(float(s) for s in os.getenv('WATCHDOG_STAGES', '1,2,4').split(','))
+# A tourist past the last stage is forgotten this long after their last ping.
+WATCHDOG_FORGET = float(os.getenv('WATCHDOG_FORGET', 7 * 86400))
+WATCHDOG_TICK = float(os.getenv('WATCHDOG_TICK', 1.0))
+# Pings dated further ahead of the server clock than this count as sent at clock + skew.
+WATCHDOG_MAX_SKEW = float(os.getenv('WATCHDOG_MAX_SKEW', 60))
+
+STAGE_NAMES = ('active', 'overdue', 'missing', 'critical')
+LEVEL_SILENCE = {'high_risk': WATCHDOG_SILENCE_HIGH_RISK, 'restricted': WATCHDOG_SILENCE_RESTRICTED}
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_LEVELS = 4
+MAX_EVENTS = 1000
+
+log = logging.getLogger(__name__)
+
+
+def silence_thresholds(zones, default=WATCHDOG_SILENCE):
+    """Per-zone silence threshold in seconds, with a trailing entry for "no zone" (index -1)."""
+    # Accepts a ZoneRegistry, the CachedZoneLookup wrapping one, or a plain list of zones.
+    registry = getattr(zones, 'zones', zones)
+    values = []
+    for zone in registry.zones if isinstance(registry, ZoneRegistry) else registry or []:
+        minutes = zone.properties.get('silence_minutes')
+        values.append(float(minutes) * 60.0 if minutes is not None else LEVEL_SILENCE.get(zone.level, default))
+    return np.array(values + [default], dtype=np.float64)
+
+
+def stage_name(stage):
+    return STAGE_NAMES[stage] if stage < len(STAGE_NAMES) else f'stage-{stage}'
+
+
+class InactivityWatchdog:
+    """Raises escalation events for tourists whose pings stop, via a hierarchical timer wheel.
+
+    Four wheels of 64 slots cover 64 ticks, ~68 min, ~73 h and ~194 days at
+    the default 1 s tick. Each tourist has one slot in struct-of-arrays state
+    and at most one live entry in the wheels. A ping only moves the tourist's
+    deadline in the arrays (O(1), vectorized per batch). The entry is checked
+    lazily when its slot comes round: if the deadline has moved it is
+    re-inserted, otherwise the tourist escalates one stage. Escalation never
+    scans all tourists, so refresh and expiry stay O(1) however many are tracked.
+    """
+
+    def __init__(self, thresholds=None, stages=WATCHDOG_STAGES, forget=WATCHDOG_FORGET, tick=WATCHDOG_TICK,
+                 zone_ids=None, capacity=1024, on_event=None, max_skew=WATCHDOG_MAX_SKEW, clock=time.time):
+        self.thresholds = np.array([WATCHDOG_SILENCE]) if thresholds is None else np.asarray(thresholds)
+        # Zone index -> id, with None last for "no zone" (the zone registry's ``ids``).
+        self.zone_ids = zone_ids or [None] * len(self.thresholds)
+        assert len(self.thresholds) == len(self.zone_ids), 'one silence threshold per zone, plus "no zone"'
+        self.stages = np.asarray(stages, dtype=np.float64)
+        self.forget = forget
+        self.tick = tick
+        self.on_event = on_event
+        self.max_skew = max_skew
+        self.clock = clock
+        self.slots = {}
+        self.tokens = []
+        self._free = []
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+        self._lock = threading.Lock()
+        self._alloc(capacity)
+        # wheels[level][index] holds (slot, tick) array pairs; an entry is live while scheduled[slot] == tick.
+        self.wheels = [[[] for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)]
+        self.current = int(self._tick_of(clock()))
+        self._pid = None
+
+    @staticmethod
+    def _array_names():
+        return ('last_seen', 'lat', 'lng', 'zone', 'stage', 'deadline')
+
+    def _alloc(self, capacity):
+        self.capacity = capacity
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        self.lat = np.zeros(capacity, dtype=np.float32)
+        self.lng = np.zeros(capacity, dtype=np.float32)
+        self.zone = np.full(capacity, -1, dtype=np.int32)
+        self.stage = np.zeros(capacity, dtype=np.int8)
+        self.deadline = np.zeros(capacity, dtype=np.int64)
+        self.scheduled = np.full(capacity, -1, dtype=np.int64)
+
+    def _grow(self, needed):
+        old = {name: getattr(self, name) for name in self._array_names() + ('scheduled',)}
+        self._alloc(max(needed, self.capacity + self.capacity // 2))
+        for name, values in old.items():
+            getattr(self, name)[:len(values)] = values
+
+    def __len__(self):
+        return len(self.slots)
+
+    def nbytes(self):
+        arrays = sum(getattr(self, name).nbytes for name in self._array_names() + ('scheduled',))
+        entries = sum(len(e[0]) for wheel in self.wheels for bucket in wheel for e in bucket)
+        return arrays + entries * 16
+
+    def _tick_of(self, t):
+        return np.floor(np.asarray(t) / self.tick).astype(np.int64)
+
+    def _slot_for(self, token):
+        slot = self.slots.get(token)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+                self.tokens[slot] = token
+            else:
+                slot = len(self.tokens)
+                self.tokens.append(token)
+            self.slots[token] = slot
+        return slot
+
+    def _deadline(self, slots):
+        stage = self.stage[slots].astype(np.int64)
+        base = self.thresholds[self.zone[slots]]
+        after = np.where(stage < len(self.stages), base * self.stages[np.minimum(stage, len(self.stages) - 1)],
+                         self.forget)
+        return np.ceil((self.last_seen[slots] + after) / self.tick).astype(np.int64)
+
+    def _schedule(self, slots, ticks):
+        """Add wheel entries for ``slots`` firing at ``ticks``."""
+        self.scheduled[slots] = ticks
+        delta = np.maximum(ticks - self.current, 1)
+        target = np.maximum(ticks, self.current + 1)
+        level = np.minimum(np.floor(np.log2(delta) / WHEEL_BITS).astype(np.int64), WHEEL_LEVELS - 1)
+        index = (target >> (WHEEL_BITS * level)) & (WHEEL_SIZE - 1)
+        bucket = level * WHEEL_SIZE + index
+        order = np.argsort(bucket, kind='stable')
+        bucket, slots, ticks = bucket[order], slots[order], ticks[order]
+        bounds = np.r_[0, np.nonzero(np.diff(bucket))[0] + 1, len(bucket)]
+        for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            b = int(bucket[lo])
+            self.wheels[b // WHEEL_SIZE][b % WHEEL_SIZE].append((slots[lo:hi], ticks[lo:hi]))
+
+    def update(self, tokens, lat, lng, zone_index=None, now=None):
+        """Record that ``tokens`` were heard from at these positions and zones.
+
+        ``now`` is each ping's time (or one time for all; default the clock). Each tourist
+        keeps their latest ping; pings older than the one already held are ignored.
+        """
+        n = len(tokens)
+        if not n:
+            return
+        clock = self.clock()
+        now = np.full(n, clock) if now is None else np.broadcast_to(np.asarray(now, dtype=np.float64), (n,))
+        now = np.minimum(now, clock + self.max_skew)
+        self._ensure_ticker()
+        zone_index = np.full(n, -1, dtype=np.int64) if zone_index is None else np.asarray(zone_index)
+        keep = np.array([tok is not None for tok in tokens], dtype=bool)
+        keep &= (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+        idx = np.nonzero(keep)[0]
+        if not len(idx):
+            return
+        with self._lock:
+            slots = np.fromiter((self._slot_for(tokens[i]) for i in idx.tolist()), dtype=np.int64, count=len(idx))
+            if len(self.tokens) > self.capacity:
+                self._grow(len(self.tokens))
+            # Latest ping per tourist: newest first, then each slot's first occurrence.
+            order = np.argsort(now[idx], kind='stable')[::-1]
+            slots, first = np.unique(slots[order], return_index=True)
+            idx = idx[order[first]]
+            seen = now[idx]
+            new = self.scheduled[slots] < 0
+            fresh = new | (seen >= self.last_seen[slots])
+            slots, idx, seen, new = slots[fresh], idx[fresh], seen[fresh], new[fresh]
+            silent = self.stage[slots] > 0
+            for slot, at in zip(slots[silent].tolist(), seen[silent].tolist()):
+                self._emit(slot, 'recovered', at)
+            self.last_seen[slots] = seen
+            self.lat[slots], self.lng[slots] = lat[idx], lng[idx]
+            self.zone[slots] = zone_index[idx]
+            self.stage[slots] = 0
+            # Only deadlines that moved earlier (or new tourists) need an entry; later ones are
+            # found lazily when the existing entry fires.
+            deadline = self._deadline(slots)
+            self.deadline[slots] = deadline
+            earlier = new | (deadline < self.scheduled[slots])
+            if earlier.any():
+                self._schedule(slots[earlier], deadline[earlier])
+
+    def advance(self, now=None):
+        """Run every tick up to ``now``; returns the events raised."""
+        target = int(self._tick_of(self.clock() if now is None else now))
+        events = []
+        with self._lock:
+            while self.current < target:
+                self.current += 1
+                t = self.current
+                # Cascade higher wheels top-down when the wheel below wraps.
+                for level in range(WHEEL_LEVELS - 1, 0, -1):
+                    if t & ((1 << (WHEEL_BITS * level)) - 1) == 0:
+                        self._run_bucket(level, (t >> (WHEEL_BITS * level)) & (WHEEL_SIZE - 1), events)
+                self._run_bucket(0, t & (WHEEL_SIZE - 1), events)
+        return events
+
+    def _run_bucket(self, level, index, events):
+        bucket = self.wheels[level][index]
+        if not bucket:
+            return
+        self.wheels[level][index] = []
+        slots = np.concatenate([s for s, _ in bucket])
+        ticks = np.concatenate([t for _, t in bucket])
+        live = self.scheduled[slots] == ticks
+        slots, ticks = slots[live], ticks[live]
+        if not len(slots):
+            return
+        deadline = self.deadline[slots]
+        due = deadline <= self.current
+        later = ~due
+        if later.any():
+            self._schedule(slots[later], deadline[later])
+        for slot in slots[due].tolist():
+            self._expire(slot, events)
+
+    def _expire(self, slot, events):
+        self.scheduled[slot] = -1
+        stage = int(self.stage[slot])
+        if stage >= len(self.stages):
+            del self.slots[self.tokens[slot]]
+            self.stage[slot] = 0
+            self.tokens[slot] = None
+            self._free.append(slot)
+            return
+        self.stage[slot] = stage + 1
+        events.append(self._emit(slot, stage_name(stage + 1), self.current * self.tick))
+        deadline = self._deadline(np.array([slot]))
+        self.deadline[slot] = deadline[0]
+        self._schedule(np.array([slot]), deadline)
+
+    def _emit(self, slot, kind, now):
+        event = {
+            'token_id': self.tokens[slot],
+            'event': kind,
+            'silent_for': round(float(now) - float(self.last_seen[slot]), 1),
+            'last_seen': float(self.last_seen[slot]),
+            'lat': float(self.lat[slot]),
+            'lng': float(self.lng[slot]),
+            'zone_id': self.zone_ids[int(self.zone[slot])],
+            'at': float(now),
+        }
+        self.events.append(event)
+        metrics.WATCHDOG_EVENTS.inc(1, kind)
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                log.exception('watchdog event handler failed')
+        return event
+
+    def forget_token(self, token):
+        """Stop watching ``token`` (e.g. the trip ended); returns whether it was tracked."""
+        with self._lock:
+            slot = self.slots.pop(token, None)
+            if slot is None:
+                return False
+            self.scheduled[slot] = -1
+            self.stage[slot] = 0
+            self.tokens[slot] = None
+            self._free.append(slot)
+            return True
+
+    def overdue(self, min_stage=1):
+        """Tourists at or past ``min_stage``, longest silent first."""
+        with self._lock:
+            rows = np.nonzero(self.stage[:len(self.tokens)] >= min_stage)[0]
+            rows = rows[np.argsort(self.last_seen[rows])]
+            return [{
+                'token_id': self.tokens[slot],
+                'stage': stage_name(int(self.stage[slot])),
+                'last_seen': float(self.last_seen[slot]),
+                'lat': float(self.lat[slot]),
+                'lng': float(self.lng[slot]),
+                'zone_id': self.zone_ids[int(self.zone[slot])],
+            } for slot in rows.tolist() if self.tokens[slot] is not None]
+
+    def recent_events(self, since=None):
+        with self._lock:
+            return [e for e in self.events if since is None or e['at'] >= since]
+
+    # Ticking: a daemon thread per process, started on first use (threads do not survive a fork).
+
+    def _ensure_ticker(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._tick_loop, name='watchdog', daemon=True).start()
+
+    def _tick_loop(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.advance()
+            except Exception:
+                log.exception('watchdog tick failed')
+
+    # State handoff between workers (see sharding.py).
+
+    def export(self, tokens):
+        with self._lock:
+            held = [tok for tok in tokens if tok in self.slots]
+            rows = np.array([self.slots[tok] for tok in held], dtype=np.int64)
+            state = {name: getattr(self, name)[rows] for name in self._array_names()}
+        state['tokens'] = held
+        return state
+
+    def drop(self, tokens):
+        for tok in tokens:
+            self.forget_token(tok)
+
+    def absorb(self, state):
+        with self._lock:
+            new = np.array([i for i, tok in enumerate(state['tokens']) if tok not in self.slots], dtype=np.int64)
+            slots = np.fromiter((self._slot_for(state['tokens'][i]) for i in new.tolist()), dtype=np.int64,
+                                count=len(new))
+            if len(self.tokens) > self.capacity:
+                self._grow(len(self.tokens))
+            for name in self._array_names():
+                getattr(self, name)[slots] = state[name][new]
+            if len(slots):
+                self._schedule(slots, self.deadline[slots])
+        return len(new)
+
+    def stats(self):
+        with self._lock:
+            stage = self.stage[:len(self.tokens)]
+            return {
+                'tracked': len(self.slots),
+                **{stage_name(s): int((stage == s).sum()) for s in range(1, len(self.stages) + 1)},
+                'events': len(self.events),
+            }
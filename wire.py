@@ -0,0 +1,215 @@
+"""Fixed-layout binary columns for ping batches, an alternative to JSON.
+
+Requests and responses with ``Content-Type: application/vnd.jn.columns`` are
+made of frames. All values are little-endian and each column is stored
+contiguously, so a frame decodes into NumPy arrays without per-ping objects.
+
+Ping frame (request), 24 bytes per ping plus a token table:
+    b'JNP2'  uint32 n
+    int64[n]    timestamp_ms   epoch milliseconds; INT64_MIN when unknown
+    int32[n]    token          index into the token table; -1 when unknown
+    float32[n]  lat
+    float32[n]  lng
+    float32[n]  speed          m/s; NaN when unknown
+    uint32 m, then m bytes of UTF-8 JSON: the list of tourist ids (strings) used by this frame
+
+Result frame (response), 13 bytes per ping plus a zone table and the request's token table:
+    b'JNR2'  uint32 n
+    int32[n]    token          as in the ping frame
+    float32[n]  anomaly_score
+    float32[n]  safety_score
+    int32[n]    zone           index into the zone table; -1 outside every zone
+    uint8[n]    reason         index into scoring.RECOMMENDATIONS
+    uint32 m, then m bytes of UTF-8 JSON: the list of zone ids used by this frame
+    uint32 m, then m bytes of UTF-8 JSON: the token table
+
+Error frame (ends a response stream): b'JNE1'  uint32 m, then m bytes of UTF-8 message.
+"""
+import json
+import struct
+
+import numpy as np
+
+CONTENT_TYPE = 'application/vnd.jn.columns'
+
+PING_MAGIC = b'JNP2'
+RESULT_MAGIC = b'JNR2'
+ERROR_MAGIC = b'JNE1'
+HEADER = struct.Struct('<4sI')
+LENGTH = struct.Struct('<I')
+
+PING_COLUMNS = (('timestamp_ms', '<i8'), ('token', '<i4'), ('lat', '<f4'), ('lng', '<f4'), ('speed', '<f4'))
+PING_BYTES = sum(np.dtype(dtype).itemsize for _, dtype in PING_COLUMNS)
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+# Upper bound on the token table, in bytes per ping of the frame.
+MAX_TOKEN_BYTES = 256
+
+
+class WireError(ValueError):
+    pass
+
+
+def _columns(buf, n):
+    """Split the body of a ping frame into its raw column arrays (views, no copies)."""
+    out, offset = {}, 0
+    for name, dtype in PING_COLUMNS:
+        out[name] = np.frombuffer(buf, dtype=dtype, count=n, offset=offset)
+        offset += n * np.dtype(dtype).itemsize
+    return out
+
+
+def _token_table(data, n):
+    try:
+        table = json.loads(bytes(data))
+    except ValueError:
+        raise WireError('token table is not valid JSON')
+    if not isinstance(table, list) or not all(isinstance(tok, str) for tok in table):
+        raise WireError('token table must be a list of strings')
+    if len(table) > n:
+        raise WireError('token table has more entries than pings')
+    return table
+
+
+def to_scoring_columns(raw, table):
+    """Convert raw ping columns and their token table into the column dict the scorer works on."""
+    token = raw['token']
+    if len(token) and (token.min() < -1 or token.max() >= len(table)):
+        raise WireError('token index outside the token table')
+    ms = raw['timestamp_ms']
+    # Index -1 picks the trailing None.
+    ids = np.empty(len(table) + 1, dtype=object)
+    ids[:-1] = table
+    return {
+        'token_id': ids[token],
+        'lat': raw['lat'].astype(np.float64),
+        'lng': raw['lng'].astype(np.float64),
+        'speed': raw['speed'].astype(np.float64),
+        'timestamp': np.where(ms == MISSING_TIMESTAMP, np.nan, ms / 1000.0),
+        'token': token,
+        'token_table': table,
+    }
+
+
+def decode_pings(data):
+    """Decode a body holding exactly one ping frame."""
+    if len(data) < HEADER.size:
+        raise WireError('truncated frame header')
+    magic, n = HEADER.unpack_from(data)
+    if magic != PING_MAGIC:
+        raise WireError('not a ping frame')
+    end = HEADER.size + n * PING_BYTES
+    if len(data) < end + LENGTH.size:
+        raise WireError(f'expected {n * PING_BYTES} bytes of columns and a token table for {n} pings')
+    (m,) = LENGTH.unpack_from(data, end)
+    if len(data) != end + LENGTH.size + m:
+        raise WireError(f'expected a {m}-byte token table')
+    data = memoryview(data)
+    return to_scoring_columns(_columns(data[HEADER.size:end], n), _token_table(data[end + LENGTH.size:], n))
+
+
+def _read_exactly(stream, size):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frames(stream, max_rows):
+    """Yield scoring columns for each ping frame in a binary stream."""
+    while True:
+        header = _read_exactly(stream, HEADER.size)
+        if not header:
+            return
+        if len(header) < HEADER.size:
+            raise WireError('truncated frame header')
+        magic, n = HEADER.unpack(header)
+        if magic != PING_MAGIC:
+            raise WireError('not a ping frame')
+        if n > max_rows:
+            raise WireError(f'frame exceeds {max_rows} pings')
+        body = _read_exactly(stream, n * PING_BYTES + LENGTH.size)
+        if len(body) < n * PING_BYTES + LENGTH.size:
+            raise WireError('truncated frame')
+        (m,) = LENGTH.unpack_from(body, n * PING_BYTES)
+        if m > max(n, 1) * MAX_TOKEN_BYTES:
+            raise WireError('token table too large')
+        footer = _read_exactly(stream, m)
+        if len(footer) < m:
+            raise WireError('truncated frame')
+        yield to_scoring_columns(_columns(body, n), _token_table(footer, n))
+
+
+def encode_pings(token_id, lat, lng, speed=None, timestamp_ms=None):
+    """Client-side helper: build one ping frame from array-likes; ``token_id`` may hold None."""
+    n = len(lat)
+    codes = {}
+    token = [-1 if tok is None else codes.setdefault(str(tok), len(codes)) for tok in token_id]
+    footer = json.dumps(list(codes)).encode()
+    columns = {
+        'token': token,
+        'timestamp_ms': np.full(n, MISSING_TIMESTAMP) if timestamp_ms is None else timestamp_ms,
+        'lat': lat,
+        'lng': lng,
+        'speed': np.full(n, np.nan) if speed is None else speed,
+    }
+    parts = [HEADER.pack(PING_MAGIC, n)]
+    parts += [np.ascontiguousarray(columns[name], dtype=dtype).tobytes() for name, dtype in PING_COLUMNS]
+    parts += [LENGTH.pack(len(footer)), footer]
+    return b''.join(parts)
+
+
+def encode_results(cols, scores, zone_ids):
+    """One result frame for ``cols`` scored into ``scores``; ``zone_ids`` maps zone index to id."""
+    n = len(scores['anomaly'])
+    zone = scores['zone']
+    used = np.unique(zone[zone >= 0])
+    table = [zone_ids[i] for i in used.tolist()]
+    zone = np.where(zone >= 0, np.searchsorted(used, zone), -1)
+    footer = json.dumps(table).encode()
+    tokens = json.dumps(cols['token_table']).encode()
+    return b''.join([
+        HEADER.pack(RESULT_MAGIC, n),
+        np.ascontiguousarray(cols['token'], dtype='<i4').tobytes(),
+        scores['anomaly'].astype('<f4').tobytes(),
+        scores['safety'].astype('<f4').tobytes(),
+        zone.astype('<i4').tobytes(),
+        scores['reason'].astype('u1').tobytes(),
+        LENGTH.pack(len(footer)),
+        footer,
+        LENGTH.pack(len(tokens)),
+        tokens,
+    ])
+
+
+def encode_error(message):
+    data = str(message).encode()
+    return HEADER.pack(ERROR_MAGIC, len(data)) + data
+
+
+def decode_results(data):
+    """Client-side helper: split a response body into a list of result-column dicts."""
+    frames, offset = [], 0
+    while offset < len(data):
+        magic, n = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        if magic == ERROR_MAGIC:
+            raise WireError(bytes(data[offset:offset + n]).decode())
+        frame = {}
+        for name, dtype in (('token', '<i4'), ('anomaly_score', '<f4'), ('safety_score', '<f4'),
+                            ('zone', '<i4'), ('reason', 'u1')):
+            frame[name] = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+            offset += n * np.dtype(dtype).itemsize
+        (m,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        frame['zone_ids'] = json.loads(bytes(data[offset:offset + m]))
+        offset += m
+        (m,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        frame['token_ids'] = json.loads(bytes(data[offset:offset + m]))
+        offset += m
+        frames.append(frame)
+    return frames
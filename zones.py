@@ -0,0 +1,187 @@
+import json
+import os
+
+import numpy as np
+
+ZONES_PATH = os.getenv('ZONES_PATH', 'data/zones.geojson')
+
+# Grid cell edge in degrees (~1.1 km at the equator).
+ZONE_CELL_DEG = float(os.getenv('ZONE_CELL_DEG', 0.01))
+
+DEFAULT_RISK = {'restricted': 1.0, 'high_risk': 0.6}
+
+
+class Zone:
+    def __init__(self, zone_id, name, level, risk, rings, properties=None):
+        self.id = zone_id
+        self.name = name
+        self.level = level
+        self.risk = risk
+        self.properties = properties or {}
+        # Edges of every ring (outer boundaries and holes) as (x0, y0, x1, y1) columns;
+        # the even-odd crossing test handles holes and multipolygons for free.
+        edges = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            edges.append(np.column_stack([ring, np.roll(ring, -1, axis=0)]))
+        self.edges = np.concatenate(edges)
+        self.bbox = (
+            self.edges[:, 0].min(), self.edges[:, 1].min(),
+            self.edges[:, 0].max(), self.edges[:, 1].max(),
+        )
+
+    def contains(self, lng, lat):
+        """Vectorized point-in-polygon test for arrays of coordinates."""
+        inside = np.zeros(np.shape(lng), dtype=bool)
+        for x0, y0, x1, y1 in self.edges:
+            if y0 == y1:
+                continue
+            crosses = (y0 > lat) != (y1 > lat)
+            x_at = x0 + (lat - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (lng < x_at)
+        return inside
+
+    def crosses(self, min_x, min_y, max_x, max_y):
+        """Which boxes an edge of the zone passes through; containment is uniform inside the others.
+
+        Separating-axis test of every edge against every box. Touching counts as
+        crossing, so the answer errs towards boxes that need an exact test.
+        """
+        min_x, min_y, max_x, max_y = (np.asarray(a, dtype=np.float64)[:, None] for a in (min_x, min_y, max_x, max_y))
+        hit = np.zeros(min_x.shape[0], dtype=bool)
+        # Bound the (boxes x edges) temporaries to ~1M elements.
+        step = max(1, (1 << 20) // len(self.edges))
+        for lo in range(0, len(self.edges), step):
+            x0, y0, x1, y1 = self.edges[lo:lo + step].T
+            overlap = ((np.maximum(x0, x1) >= min_x) & (np.minimum(x0, x1) <= max_x)
+                       & (np.maximum(y0, y1) >= min_y) & (np.minimum(y0, y1) <= max_y))
+            dx, dy = x1 - x0, y1 - y0
+            sides = [dx * (cy - y0) - dy * (cx - x0) for cx, cy in
+                     ((min_x, min_y), (min_x, max_y), (max_x, min_y), (max_x, max_y))]
+            above = sides[0] > 0
+            below = sides[0] < 0
+            for side in sides[1:]:
+                above &= side > 0
+                below &= side < 0
+            hit |= (overlap & ~above & ~below).any(axis=1)
+        return hit
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'level': self.level, 'risk': self.risk}
+
+
+class ZoneRegistry:
+    """Risk-zone polygons bucketed into a uniform lat/lng grid.
+
+    Each cell lists the zones whose bounding box overlaps it, so a lookup only runs
+    the exact polygon test against a handful of candidates. The registry is
+    immutable once built; reloading builds a new one and swaps the reference.
+    """
+
+    def __init__(self, zones=(), cell_deg=ZONE_CELL_DEG):
+        self.zones = list(zones)
+        self.cell_deg = cell_deg
+        self._cols = int(np.ceil(360.0 / cell_deg)) + 1
+        # Per-zone attributes with a trailing sentinel so zone index -1 means "no zone".
+        self.ids = [z.id for z in self.zones] + [None]
+        self.restricted = np.array([z.level == 'restricted' for z in self.zones] + [False])
+        self.grid = {}
+        for index, zone in enumerate(self.zones):
+            min_x, min_y, max_x, max_y = zone.bbox
+            for iy in range(self._row(min_y), self._row(max_y) + 1):
+                for ix in range(self._col(min_x), self._col(max_x) + 1):
+                    self.grid.setdefault(iy * self._cols + ix, []).append(index)
+        # CSR copy of the grid for batch lookups: sorted cell keys, offsets into a flat
+        # array of zone indices.
+        self._keys = np.array(sorted(self.grid), dtype=np.int64)
+        counts = [len(self.grid[k]) for k in self._keys.tolist()]
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._members = np.array(
+            [i for k in self._keys.tolist() for i in self.grid[k]], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def _col(self, lng):
+        return int(np.floor((lng + 180.0) / self.cell_deg))
+
+    def _row(self, lat):
+        return int(np.floor((lat + 90.0) / self.cell_deg))
+
+    def _cell_keys(self, lng, lat):
+        ix = np.floor((lng + 180.0) / self.cell_deg).astype(np.int64)
+        iy = np.floor((lat + 90.0) / self.cell_deg).astype(np.int64)
+        return iy * self._cols + ix
+
+    def lookup(self, lat, lng):
+        """All zones containing a single point, highest risk first."""
+        if not self.zones or not (abs(lat) <= 90 and abs(lng) <= 180):
+            return []
+        candidates = self.grid.get(self._row(lat) * self._cols + self._col(lng), ())
+        hits = [self.zones[i] for i in candidates if self.zones[i].contains(lng, lat)]
+        return sorted(hits, key=lambda z: -z.risk)
+
+    def lookup_batch(self, lat, lng, timestamp=None):
+        """Highest-risk zone per point as ``(risk, zone_index)`` arrays; index -1 means none.
+
+        ``timestamp`` is accepted for callers that pass one and ignored; zone risk does not vary with time.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        risk = np.zeros(lat.shape)
+        zone_index = np.full(lat.shape, -1, dtype=np.int64)
+        valid = (np.abs(lat) <= 90) & (np.abs(lng) <= 180)
+        if not self.zones or not valid.any():
+            return risk, zone_index
+
+        points = np.nonzero(valid)[0]
+        keys = self._cell_keys(lng[points], lat[points])
+        pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        hit = self._keys[pos] == keys
+        points, pos = points[hit], pos[hit]
+
+        # Expand into (point, candidate zone) pairs, then test each zone once against
+        # all of its candidate points.
+        counts = self._offsets[pos + 1] - self._offsets[pos]
+        pair_point = np.repeat(points, counts)
+        starts = np.repeat(self._offsets[pos] - np.cumsum(counts) + counts, counts)
+        pair_zone = self._members[starts + np.arange(len(pair_point))]
+        order = np.argsort(pair_zone, kind='stable')
+        zone_ids, bounds = np.unique(pair_zone[order], return_index=True)
+        for i, group in zip(zone_ids.tolist(), np.split(order, bounds[1:])):
+            zone = self.zones[i]
+            idx = pair_point[group]
+            better = zone.contains(lng[idx], lat[idx]) & (zone.risk > risk[idx])
+            risk[idx[better]] = zone.risk
+            zone_index[idx[better]] = i
+        return risk, zone_index
+
+
+def parse_geojson(collection):
+    zones = []
+    for n, feature in enumerate(collection.get('features', [])):
+        geometry = feature.get('geometry') or {}
+        props = feature.get('properties') or {}
+        if geometry.get('type') == 'Polygon':
+            rings = geometry['coordinates']
+        elif geometry.get('type') == 'MultiPolygon':
+            rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+        else:
+            continue
+        level = props.get('level', 'high_risk')
+        zones.append(Zone(
+            zone_id=feature.get('id', props.get('id', f'zone-{n}')),
+            name=props.get('name', ''),
+            level=level,
+            risk=float(props.get('risk', DEFAULT_RISK.get(level, 0.5))),
+            rings=rings,
+            properties=props,
+        ))
+    return zones
+
+
+def load_zones(path=ZONES_PATH):
+    if not os.path.exists(path):
+        return ZoneRegistry()
+    with open(path) as f:
+        return ZoneRegistry(parse_geojson(json.load(f)))